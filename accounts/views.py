@@ -177,6 +177,8 @@ def bulk_license_change(request):
         if form.is_valid():
             selected_license = form.cleaned_data['license']
             Sound.objects.filter(user=request.user).update(license=selected_license, is_index_dirty=True)
+            Sound.objects.invalidate_template_caches(
+                Sound.objects.filter(user=request.user).values_list('id', flat=True))
             for sound in Sound.objects.filter(user=request.user).all():
                 SoundLicenseHistory.objects.create(sound=sound, license=selected_license)
             request.user.profile.has_old_license = False
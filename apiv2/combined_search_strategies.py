@@ -20,6 +20,13 @@
 #     See AUTHORS file.
 #
 
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
 from utils.similarity_utilities import api_search as similarity_api_search
 from utils.search.solr import Solr, SolrException, SolrResponseInterpreter
 from similarity.client import SimilarityException
@@ -29,6 +36,114 @@ from urllib import unquote
 from django.conf import settings
 
 
+class ParallelRequests(object):
+    """
+    Runs the requests to solr and gaia needed by a combined search strategy in parallel threads. All the requests of
+    a combined search share a deadline: if it is reached before the requests finish, a ServerErrorException is raised
+    and the search is cancelled (page loops check 'cancelled' before sending new requests, requests which have
+    already been sent can't be interrupted and their results are discarded). The time spent in each backend is stored
+    so that it can be reported in the response note.
+    The timeout and the number of requests run at the same time are bounded by APIV2_COMBINED_SEARCH_MAX_TIMEOUT and
+    APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS as the timeout can be given by clients.
+    """
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = settings.APIV2_COMBINED_SEARCH_TIMEOUT
+        timeout = min(timeout, settings.APIV2_COMBINED_SEARCH_MAX_TIMEOUT)
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout
+        self.cancelled = threading.Event()
+        self.timings = OrderedDict()
+        self.timings_lock = threading.Lock()
+
+    def run(self, named_functions):
+        """
+        Runs the given functions in parallel and returns their results in the same order. Functions with the same
+        name are reported together in the timings (number of requests and maximum time).
+        :param list named_functions: list of (name, function) tuples.
+        :return list: results of the functions.
+        """
+        def timed(name, function):
+            def run_function():
+                start_time = time.time()
+                try:
+                    return function()
+                finally:
+                    self._add_timing(name, time.time() - start_time)
+            return run_function
+        with self.timings_lock:
+            # Report timings in the order in which requests are made, not in the order in which they finish
+            for name, _ in named_functions:
+                self.timings.setdefault(name, (0, 0.0))
+        return self.map([timed(name, function) for name, function in named_functions])
+
+    def map(self, functions):
+        """
+        Runs the given functions in parallel (without recording timings) and returns their results in the same order.
+        If any of the functions raises an exception, the first one (in the order of the functions) is re-raised.
+        Functions are run in groups of at most APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS.
+        """
+        self.check_deadline()
+        max_parallel_requests = settings.APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS
+        results = list()
+        for i in range(0, len(functions), max_parallel_requests):
+            results += self._map_group(functions[i:i + max_parallel_requests])
+        return results
+
+    def _map_group(self, functions):
+        if len(functions) == 1:
+            # No need to start a thread for a single request
+            results = [functions[0]()]
+            self.check_deadline()
+            return results
+
+        results = [None] * len(functions)
+        errors = [None] * len(functions)
+
+        def worker(index, function):
+            try:
+                results[index] = function()
+            except Exception:
+                errors[index] = sys.exc_info()
+
+        threads = [threading.Thread(target=worker, args=(index, function)) for index, function in enumerate(functions)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(max(self.deadline - time.time(), 0))
+            if thread.is_alive():
+                self.cancelled.set()
+                self.check_deadline()
+
+        for error in errors:
+            if error is not None:
+                self.cancelled.set()
+                raise error[0], error[1], error[2]
+        return results
+
+    def check_deadline(self):
+        if self.cancelled.is_set() or time.time() > self.deadline:
+            self.cancelled.set()
+            raise ServerErrorException(msg='The search request took too long and has been cancelled '
+                                           '(timeout of %i seconds).' % round(self.deadline - self.start_time))
+
+    def _add_timing(self, name, elapsed):
+        with self.timings_lock:
+            n_requests, max_elapsed = self.timings.get(name, (0, 0.0))
+            self.timings[name] = (n_requests + 1, max(max_elapsed, elapsed))
+
+    def add_timings_to_note(self, note):
+        timings = ', '.join(['%s %.3fs' % (name, elapsed) if n_requests == 1
+                             else '%s %.3fs (%i requests)' % (name, elapsed, n_requests)
+                             for name, (n_requests, elapsed) in self.timings.items()])
+        timings_note = 'Search timings: %s, total %.3fs.' % (timings, time.time() - self.start_time)
+        if note:
+            return '%s %s' % (note, timings_note)
+        return timings_note
+
+
 def merge_all(search_form, target_file=None, extra_parameters=None):
     """
     Merge all strategy will get all results from solr and all results from gaia and then combine the ids
@@ -42,12 +157,13 @@ def merge_all(search_form, target_file=None, extra_parameters=None):
     max_solr_pages = extra_parameters.get('cs_max_solr_pages', 10)
     gaia_page_size = extra_parameters.get('cs_gaia_page_size', 9999999)  # We can get ALL gaia results at once
     max_gaia_pages = extra_parameters.get('cs_max_gaia_pages', 1)
+    requests = ParallelRequests(extra_parameters.get('cs_timeout'))
 
-    # Get all gaia results
-    gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=max_gaia_pages)
-
-    # Get 'max_pages' pages of size 'page_size' from solr results
-    solr_ids, solr_count = get_solr_results(search_form, page_size=solr_page_size, max_pages=max_solr_pages)
+    # Get all gaia results and 'max_pages' pages of size 'page_size' from solr results at the same time
+    (gaia_ids, gaia_count, distance_to_target_data, note), (solr_ids, solr_count) = requests.run([
+        ('gaia', lambda: get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=max_gaia_pages, requests=requests)),
+        ('solr', lambda: get_solr_results(search_form, page_size=solr_page_size, max_pages=max_solr_pages, requests=requests)),
+    ])
 
     if len(solr_ids) == solr_count and len(gaia_ids) == gaia_count:
         # Got complete results, maybe we should log that?
@@ -67,7 +183,7 @@ def merge_all(search_form, target_file=None, extra_parameters=None):
     combined_ids = [id for id in results_a if id in results_b_set]
     combined_count = len(combined_ids)
     return combined_ids[(search_form.cleaned_data['page'] - 1) * search_form.cleaned_data['page_size']:search_form.cleaned_data['page'] * search_form.cleaned_data['page_size']], \
-           combined_count, distance_to_target_data, None, note, None, None
+           combined_count, distance_to_target_data, None, requests.add_timings_to_note(note), None, None
 
 
 def filter_both(search_form, target_file=None, extra_parameters=None):
@@ -88,15 +204,18 @@ def filter_both(search_form, target_file=None, extra_parameters=None):
     gaia_filter_id_max_pages = extra_parameters.get('cs_gaia_filter_id_max_pages', 7)
     gaia_max_pages = extra_parameters.get('cs_max_gaia_pages', 1)
     gaia_page_size = extra_parameters.get('cs_gaia_page_size', 9999999)  # We can get ALL gaia results at once
+    requests = ParallelRequests(extra_parameters.get('cs_timeout'))
 
     if search_form.cleaned_data['target'] or target_file:
         # First search into gaia and then into solr (get all gaia results)
-        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages)
+        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages, requests=requests)
         valid_ids_pages = [gaia_ids[i:i+solr_filter_id_block_size] for i in range(0, len(gaia_ids), solr_filter_id_block_size) if (i/solr_filter_id_block_size) < solr_filter_id_max_pages]
-        solr_ids = list()
         solr = Solr(settings.SOLR_URL)
-        for valid_ids_page in valid_ids_pages:
-            page_solr_ids, solr_count = get_solr_results(search_form, page_size=len(valid_ids_page), max_pages=1, valid_ids=valid_ids_page, solr=solr)
+        # Query solr for all id blocks in parallel and concatenate the results in the order of the blocks
+        solr_pages = requests.run([('solr', partial(get_solr_results, search_form, page_size=len(valid_ids_page), max_pages=1, valid_ids=valid_ids_page, solr=solr, requests=requests))
+                                   for valid_ids_page in valid_ids_pages])
+        solr_ids = list()
+        for page_solr_ids, solr_count in solr_pages:
             solr_ids += page_solr_ids
 
         if gaia_count <= solr_filter_id_block_size * solr_filter_id_max_pages:
@@ -106,13 +225,14 @@ def filter_both(search_form, target_file=None, extra_parameters=None):
     else:
         # First search into solr and then into gaia
         # These queries are SLOW because we need to get many pages from solr
-        solr_ids, solr_count = get_solr_results(search_form, page_size=solr_page_size, max_pages=solr_max_pages)
-
         # Now we should split solr ids in blocks and iteratively query gaia restricting the results to those ids
         # present in the current block. However given that gaia results can be retrieved
         # all at once very quickly, we optimize this bit by retrieving them all at once and avoiding many requests
-        # to similarity server.
-        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages)
+        # to similarity server. As gaia results don't depend on solr results, both queries are made at the same time.
+        (solr_ids, solr_count), (gaia_ids, gaia_count, distance_to_target_data, note) = requests.run([
+            ('solr', lambda: get_solr_results(search_form, page_size=solr_page_size, max_pages=solr_max_pages, requests=requests)),
+            ('gaia', lambda: get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages, requests=requests)),
+        ])
         '''
         # That would be the code without the optimization:
         valid_ids_pages = [solr_ids[i:i+gaia_filter_id_block_size] for i in range(0, len(solr_ids), gaia_filter_id_block_size) if (i/gaia_filter_id_block_size) < gaia_filter_id_max_pages]
@@ -143,7 +263,7 @@ def filter_both(search_form, target_file=None, extra_parameters=None):
     combined_ids = [id for id in results_a if id in results_b_set]
     combined_count = len(combined_ids)
     return combined_ids[(search_form.cleaned_data['page'] - 1) * search_form.cleaned_data['page_size']:search_form.cleaned_data['page'] * search_form.cleaned_data['page_size']], \
-           combined_count, distance_to_target_data, None, note, None, None
+           combined_count, distance_to_target_data, None, requests.add_timings_to_note(note), None, None
 
 
 def merge_optimized(search_form, target_file=None, extra_parameters=None):
@@ -152,6 +272,8 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
     valid results in a gaia query, or the other way around.
     In gaia and solr we can restrict the query to a particular set of results, but there are limitations both in the
     length of the resulting url and in the number of OR clauses that solr can support.
+    Solr requests are made in parallel in groups of 'cs_parallel_requests' requests, results are still combined in the
+    same order so the output does not depend on the number of parallel requests.
     """
 
     if not extra_parameters:
@@ -162,6 +284,10 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
     solr_page_size = extra_parameters.get('cs_solr_page_size', 200)
     gaia_max_pages = extra_parameters.get('cs_max_gaia_pages', 1)
     gaia_page_size = extra_parameters.get('cs_gaia_page_size', 9999999)  # We can get ALL gaia results at once
+    num_parallel_requests = min(max(extra_parameters.get('cs_parallel_requests', 4), 1),
+                                settings.APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS)
+    requests = ParallelRequests(extra_parameters.get('cs_timeout'))
+    solr = Solr(settings.SOLR_URL)
 
     num_requested_results = search_form.cleaned_data['page_size']
     params_for_next_page = dict()
@@ -173,18 +299,23 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
         last_checked_valid_id_position = extra_parameters.get('cs_lcvidp', 0)
         if last_checked_valid_id_position < 0:
             last_checked_valid_id_position = 0
-        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages, offset=last_checked_valid_id_position)
+        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages, offset=last_checked_valid_id_position, requests=requests)
         if len(gaia_ids):
             # Now divide gaia results in blocks of "solr_filter_id_block_size" results and iteratively query solr limiting the
             # results to those ids in the common block to obtain common results for the search.
             # Once we get as many results as "num_requested_results" or we exceed a maximum number
             # of iterations (solr_filter_id_max_pages), return what we got and update 'cs_lcvidp' parameter for further calls.
             valid_ids_pages = [gaia_ids[i:i+solr_filter_id_block_size] for i in range(0, len(gaia_ids), solr_filter_id_block_size)]
+            valid_ids_pages = valid_ids_pages[:solr_filter_id_max_pages + 1]
             solr_ids = list()
             checked_gaia_ids = list()
-            solr = Solr(settings.SOLR_URL)
+            solr_pages = list()
             for count, valid_ids_page in enumerate(valid_ids_pages):
-                page_solr_ids, solr_count = get_solr_results(search_form, page_size=len(valid_ids_page), max_pages=1, valid_ids=valid_ids_page, solr=solr)
+                if count == len(solr_pages):
+                    # Query solr for the next group of id blocks in parallel
+                    solr_pages += requests.run([('solr', partial(get_solr_results, search_form, page_size=len(next_valid_ids_page), max_pages=1, valid_ids=next_valid_ids_page, solr=solr, requests=requests))
+                                                for next_valid_ids_page in valid_ids_pages[count:count + num_parallel_requests]])
+                page_solr_ids, solr_count = solr_pages[count]
                 solr_ids += page_solr_ids
                 checked_gaia_ids += valid_ids_page
                 if len(solr_ids) >= num_requested_results:
@@ -196,9 +327,10 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
                     #print 'Too many requests and not enough results'
                     break
 
+            solr_ids_set = set(solr_ids)
             combined_ids = list()
             for index, sid in enumerate(checked_gaia_ids):
-                if sid in solr_ids:
+                if sid in solr_ids_set:
                     combined_ids.append(sid)
                 new_last_checked_valid_id_position = index + 1
                 if len(combined_ids) == num_requested_results:
@@ -215,15 +347,23 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
             params_for_next_page['no_more_results'] = True
 
     else:
-        # First search into gaia to obtain a list of all sounds that match content-based query parameters
-        gaia_ids, gaia_count, distance_to_target_data, note = get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages)
         last_retrieved_solr_id_pos = extra_parameters.get('cs_lrsidp', 0)
         if last_retrieved_solr_id_pos < 0:
             last_retrieved_solr_id_pos = 0
 
+        def get_solr_page(offset):
+            return get_solr_results(search_form, page_size=solr_page_size, max_pages=1, offset=offset, solr=solr, requests=requests)
+
+        # First search into gaia to obtain a list of all sounds that match content-based query parameters. At the same
+        # time, get the first page of solr results as it will be needed unless there are very few gaia results.
+        (gaia_ids, gaia_count, distance_to_target_data, note), first_solr_page = requests.run([
+            ('gaia', lambda: get_gaia_results(search_form, target_file, page_size=gaia_page_size, max_pages=gaia_max_pages, requests=requests)),
+            ('solr', lambda: get_solr_page(last_retrieved_solr_id_pos)),
+        ])
+
         if len(gaia_ids) < solr_filter_id_block_size:
             # optimization, if there are few gaia_ids, we can get all results in one query
-            solr_ids, solr_count = get_solr_results(search_form, page_size=len(gaia_ids), max_pages=1, valid_ids=gaia_ids, offset=last_retrieved_solr_id_pos)
+            solr_ids, solr_count = requests.run([('solr', lambda: get_solr_results(search_form, page_size=len(gaia_ids), max_pages=1, valid_ids=gaia_ids, offset=last_retrieved_solr_id_pos, solr=solr, requests=requests))])[0]
             combined_ids = solr_ids[:num_requested_results]
             params_for_next_page['cs_lrsidp'] = last_retrieved_solr_id_pos + num_requested_results
             if len(combined_ids) < num_requested_results:
@@ -233,20 +373,28 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
             # each page of the query with gaia ids. Once we reach the desired  "num_requested_results", return what we got and
             # update 'cs_lrsidp' parameter for further queries. Set a maximum number of iterations (solr_max_requests) to prevent a virtually
             # infinite query if not enough results are found (num_requested_results is not reached).
+            # Pages are requested in parallel in groups of "num_parallel_requests" pages but processed in order.
+            gaia_ids_set = set(gaia_ids)
             combined_ids = list()
             new_last_retrieved_solr_id_pos = last_retrieved_solr_id_pos
             stop_main_for_loop = False
             n_requests_made = 0
+            solr_pages = [first_solr_page]
             for i in range(0, solr_max_requests):
                 if stop_main_for_loop:
-                    continue
-                offset = last_retrieved_solr_id_pos + i * solr_page_size
-                solr_ids, solr_count = get_solr_results(search_form, page_size=solr_page_size, max_pages=1, offset=offset)
+                    break
+                if i == len(solr_pages):
+                    # Don't request pages beyond the total number of results
+                    offsets = [last_retrieved_solr_id_pos + j * solr_page_size for j in range(i, min(i + num_parallel_requests, solr_max_requests))]
+                    offsets = [offset for offset in offsets if offset < solr_pages[-1][1]]
+                    if not offsets:
+                        break
+                    solr_pages += requests.run([('solr', partial(get_solr_page, offset)) for offset in offsets])
+                solr_ids, solr_count = solr_pages[i]
                 n_requests_made += 1
-                common_ids = list(set(solr_ids).intersection(gaia_ids))
                 for index, sid in enumerate(solr_ids):
                     new_last_retrieved_solr_id_pos += 1
-                    if sid in common_ids:
+                    if sid in gaia_ids_set:
                         combined_ids.append(sid)
                     if len(combined_ids) == num_requested_results:
                         stop_main_for_loop = True
@@ -264,39 +412,57 @@ def merge_optimized(search_form, target_file=None, extra_parameters=None):
             params_for_next_page['cs_lrsidp'] = new_last_retrieved_solr_id_pos
 
     # Combine results
-    return combined_ids, len(combined_ids), distance_to_target_data, None, note, params_for_next_page, debug_note
+    return combined_ids, len(combined_ids), distance_to_target_data, None, requests.add_timings_to_note(note), \
+           params_for_next_page, debug_note
+
+
+def get_pages(get_page, page_size, max_pages, start_page, requests):
+    """
+    Gets the first page of results and, once the total number of results is known, gets all the remaining pages
+    (up to max_pages) in parallel.
+    :param function get_page: function which takes a page number and returns a (ids, count) tuple.
+    :return list: list of (ids, count) tuples, one for every page.
+    """
+    pages = [get_page(start_page)]
+    count = pages[0][1] or 0
+    n_pages = min(max_pages, int(math.ceil(float(count) / page_size)) if page_size else 1)
+    if n_pages > 1:
+        pages += requests.map([partial(get_page, page) for page in range(start_page + 1, start_page + n_pages)])
+    return pages
 
 
-def get_gaia_results(search_form, target_file, page_size, max_pages, start_page=1, valid_ids=None, offset=None):
+def get_gaia_results(search_form, target_file, page_size, max_pages, start_page=1, valid_ids=None, offset=None, requests=None):
+    if requests is None:
+        requests = ParallelRequests()
     gaia_ids = list()
     gaia_count = None
     distance_to_target_data = dict()
-    note = None
+    notes = list()
+
+    def get_page(page):
+        requests.check_deadline()
+        if offset:
+            page_offset = offset + (page - start_page) * page_size
+        else:
+            page_offset = (page - 1) * page_size
+        results, count, note = similarity_api_search(target=search_form.cleaned_data['target'],
+                                                     filter=search_form.cleaned_data['descriptors_filter'],
+                                                     num_results=page_size,
+                                                     offset=page_offset,
+                                                     target_file=target_file,
+                                                     in_ids=valid_ids)
+        notes.append(note)
+        return results, count
 
     try:
-        current_page = start_page
-        n_page_requests = 1
         # Iterate over gaia result pages
-        while (len(gaia_ids) < gaia_count or gaia_count == None) and n_page_requests <= max_pages:
-            if not offset:
-                offset = (current_page - 1) * page_size
-            results, count, note = similarity_api_search(target=search_form.cleaned_data['target'],
-                                                         filter=search_form.cleaned_data['descriptors_filter'],
-                                                         num_results=page_size,
-                                                         offset=offset,
-                                                         target_file=target_file,
-                                                         in_ids=valid_ids)
-
+        for results, count in get_pages(get_page, page_size, max_pages, start_page, requests):
             gaia_ids += [id[0] for id in results]
             gaia_count = count
             if search_form.cleaned_data['target'] or target_file:
                 # Save sound distance to target into so it can be later used in the view class and added to results
                 distance_to_target_data.update(dict(results))
 
-            #print 'Gaia page %i (total %i sounds)' % (current_page, gaia_count)
-            current_page += 1
-            n_page_requests += 1
-
     except SimilarityException as e:
         if e.status_code == 500:
             raise ServerErrorException(msg=e.message)
@@ -306,15 +472,19 @@ def get_gaia_results(search_form, target_file, page_size, max_pages, start_page=
             raise NotFoundException(msg=e.message)
         else:
             raise ServerErrorException(msg='Similarity server error: %s' % e.message)
+    except ServerErrorException:
+        raise
     except Exception as e:
         raise ServerErrorException(msg='The similarity server could not be reached or some unexpected error occurred.')
 
-    return gaia_ids, gaia_count, distance_to_target_data, note
+    return gaia_ids, gaia_count, distance_to_target_data, notes[-1] if notes else None
 
 
-def get_solr_results(search_form, page_size, max_pages, start_page=1, valid_ids=None, solr=None, offset=None):
+def get_solr_results(search_form, page_size, max_pages, start_page=1, valid_ids=None, solr=None, offset=None, requests=None):
     if not solr:
         solr = Solr(settings.SOLR_URL)
+    if requests is None:
+        requests = ParallelRequests()
 
     query_filter = search_form.cleaned_data['filter']
     if valid_ids:
@@ -328,30 +498,30 @@ def get_solr_results(search_form, page_size, max_pages, start_page=1, valid_ids=
     solr_ids = []
     solr_count = None
 
+    def get_page(page):
+        requests.check_deadline()
+        query = search_prepare_query(unquote(search_form.cleaned_data['query'] or ""),
+                                     unquote(query_filter or ""),
+                                     search_form.cleaned_data['sort'],
+                                     page,
+                                     page_size,
+                                     grouping=False,
+                                     include_facets=False,
+                                     offset=offset + (page - start_page) * page_size if offset else None)
+        result = SolrResponseInterpreter(solr.select(unicode(query)))
+        return [element['id'] for element in result.docs], result.num_found
+
     try:
-        current_page = start_page
-        n_page_requests = 1
         # Iterate over solr result pages
-        while (len(solr_ids) < solr_count or solr_count == None) and n_page_requests <= max_pages:
-            query = search_prepare_query(unquote(search_form.cleaned_data['query'] or ""),
-                                         unquote(query_filter or ""),
-                                         search_form.cleaned_data['sort'],
-                                         current_page,
-                                         page_size,
-                                         grouping=False,
-                                         include_facets=False,
-                                         offset=offset)
-            result = SolrResponseInterpreter(solr.select(unicode(query)))
-            solr_ids += [element['id'] for element in result.docs]
-            solr_count = result.num_found
-
-            #print 'Solr page %i (total %i sounds)' % (current_page, solr_count)
-            current_page += 1
-            n_page_requests += 1
+        for page_solr_ids, count in get_pages(get_page, page_size, max_pages, start_page, requests):
+            solr_ids += page_solr_ids
+            solr_count = count
 
     except SolrException as e:
         raise ServerErrorException(msg='Search server error: %s' % e.message)
+    except ServerErrorException:
+        raise
     except Exception as e:
         raise ServerErrorException(msg='The search server could not be reached or some unexpected error occurred.')
 
-    return solr_ids, solr_count
\ No newline at end of file
+    return solr_ids, solr_count
@@ -17,7 +17,12 @@
 # Authors:
 #     See AUTHORS file.
 #
-from django.test import TestCase, SimpleTestCase, RequestFactory
+import threading
+import time
+from functools import partial
+
+import mock
+from django.test import TestCase, SimpleTestCase, RequestFactory, override_settings
 from django.urls import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -26,12 +31,13 @@ from django.contrib.sites.models import Site
 
 from apiv2.models import ApiV2Client
 from apiv2.apiv2_utils import ApiSearchPaginator
+from apiv2.combined_search_strategies import ParallelRequests, filter_both, merge_optimized
 from apiv2.serializers import SoundListSerializer, DEFAULT_FIELDS_IN_SOUND_LIST, SoundSerializer
 from forms import SoundCombinedSearchFormAPI
 from sounds.models import Sound
 from utils.test_helpers import create_user_and_sounds
 
-from exceptions import BadRequestException
+from exceptions import BadRequestException, ServerErrorException
 
 
 class TestAPiViews(TestCase):
@@ -139,6 +145,20 @@ class TestAPI(TestCase):
         resp = self.client.options("/apiv2/search/text/?query=ambient&filter=tag:(rain%20OR%CAfe)", secure=True, **headers)
         self.assertEqual(resp.status_code, 200)
 
+    def test_combined_search_invalid_parameter(self):
+        user, _, _ = create_user_and_sounds(num_sounds=1)
+        c = ApiV2Client(user=user, status='OK', redirect_uri="https://freesound.com",
+                        url="https://freesound.com", name="test")
+        c.save()
+
+        headers = {
+            'HTTP_AUTHORIZATION': 'Token %s' % c.key,
+        }
+        resp = self.client.get(reverse('apiv2-sound-combined-search'), {
+            'query': 'dog', 'descriptors_filter': '.lowlevel.pitch.mean:[90 TO 110]', 'cs_timeout': 'never'},
+            secure=True, **headers)
+        self.assertEqual(resp.status_code, 400)
+
 
 class ApiSearchPaginatorTest(TestCase):
     def test_page(self):
@@ -387,4 +407,112 @@ class TestApiV2Client(TestCase):
         })
         self.assertEqual(resp.status_code, 200)
         self.assertIn('redirect_uri', resp.context['form'].errors)
-        self.assertIn('url', resp.context['form'].errors)
\ No newline at end of file
+        self.assertIn('url', resp.context['form'].errors)
+
+class CombinedSearchStrategiesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.search_form = mock.Mock(cleaned_data={'target': '', 'query': 'dog', 'filter': None, 'sort': None,
+                                                   'descriptors_filter': '.lowlevel.pitch.mean:[90 TO 110]',
+                                                   'page': 1, 'page_size': 15})
+        self.gaia_ids = range(1, 1001)
+
+    def fake_get_solr_results(self, search_form, page_size, max_pages, valid_ids=None, offset=None, **kwargs):
+        # Only even sound ids match the text query
+        matching_ids = [sid for sid in (valid_ids or range(1, 2001)) if sid % 2 == 0]
+        return matching_ids[offset or 0:(offset or 0) + page_size], len(matching_ids)
+
+    def test_parallel_requests_keep_order(self):
+        requests = ParallelRequests(timeout=10)
+        results = requests.run([('solr', lambda: time.sleep(0.05) or 'a'), ('gaia', lambda: 'b'), ('solr', lambda: 'c')])
+        self.assertEqual(results, ['a', 'b', 'c'])
+        self.assertEqual(requests.timings.keys(), ['solr', 'gaia'])
+        self.assertEqual(requests.timings['solr'][0], 2)
+        self.assertIn('solr', requests.add_timings_to_note(None))
+        self.assertTrue(requests.add_timings_to_note('Gaia note.').startswith('Gaia note. Search timings:'))
+
+    def test_parallel_requests_deadline(self):
+        requests = ParallelRequests(timeout=0.05)
+        with self.assertRaises(ServerErrorException):
+            requests.run([('solr', lambda: time.sleep(1)), ('gaia', lambda: None)])
+        self.assertTrue(requests.cancelled.is_set())
+        with self.assertRaises(ServerErrorException):
+            requests.run([('solr', lambda: None)])
+
+    @override_settings(APIV2_COMBINED_SEARCH_MAX_TIMEOUT=5)
+    def test_parallel_requests_max_timeout(self):
+        requests = ParallelRequests(timeout=1000000)
+        self.assertEqual(requests.deadline - requests.start_time, 5)
+
+    @override_settings(APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS=2)
+    def test_parallel_requests_max_parallel_requests(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def request(index):
+            with lock:
+                running.append(index)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(index)
+            return index
+
+        requests = ParallelRequests(timeout=10)
+        self.assertEqual(requests.map([partial(request, index) for index in range(5)]), range(5))
+        self.assertEqual(max(max_running), 2)
+
+    def test_parallel_requests_error(self):
+        def fail():
+            raise BadRequestException(msg='Invalid filter')
+        requests = ParallelRequests(timeout=10)
+        with self.assertRaises(BadRequestException):
+            requests.run([('solr', lambda: None), ('gaia', fail)])
+
+    @mock.patch('apiv2.combined_search_strategies.Solr')
+    @mock.patch('apiv2.combined_search_strategies.get_solr_results')
+    @mock.patch('apiv2.combined_search_strategies.get_gaia_results')
+    def test_filter_both_id_blocks(self, get_gaia_results, get_solr_results, solr):
+        self.search_form.cleaned_data['target'] = '.lowlevel.pitch.mean:100'
+        get_gaia_results.return_value = (self.gaia_ids, len(self.gaia_ids), {}, None)
+        get_solr_results.side_effect = self.fake_get_solr_results
+        results, count, _, _, note, _, _ = filter_both(self.search_form)
+        # 1000 gaia ids are checked in 3 blocks, the order of gaia results is kept
+        self.assertEqual(get_solr_results.call_count, 3)
+        self.assertEqual(count, 500)
+        self.assertEqual(results, range(2, 31, 2))
+        self.assertIn('solr', note)
+        self.assertIn('3 requests', note)
+
+    @mock.patch('apiv2.combined_search_strategies.get_solr_results')
+    @mock.patch('apiv2.combined_search_strategies.get_gaia_results')
+    def test_merge_optimized_solr_pages(self, get_gaia_results, get_solr_results):
+        get_gaia_results.return_value = (self.gaia_ids, len(self.gaia_ids), {}, 'Gaia note.')
+        get_solr_results.side_effect = self.fake_get_solr_results
+        results, count, _, _, note, params_for_next_page, debug_note = merge_optimized(
+            self.search_form, extra_parameters={'cs_solr_page_size': 5, 'cs_parallel_requests': 2})
+        self.assertEqual(results, range(2, 31, 2))
+        self.assertEqual(params_for_next_page, {'cs_lrsidp': 15})
+        self.assertEqual(debug_note, 'Found enough results in 3 solr requests')
+        # The first solr page is requested together with gaia, the next ones in groups of two
+        self.assertEqual(get_solr_results.call_count, 3)
+        self.assertTrue(note.startswith('Gaia note. Search timings:'))
+
+        # Results don't depend on the number of parallel requests
+        parallel_results = merge_optimized(
+            self.search_form, extra_parameters={'cs_solr_page_size': 5, 'cs_parallel_requests': 5})
+        self.assertEqual(parallel_results[0], results)
+        self.assertEqual(parallel_results[5], params_for_next_page)
+
+    @override_settings(APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS=2)
+    @mock.patch('apiv2.combined_search_strategies.get_solr_results')
+    @mock.patch('apiv2.combined_search_strategies.get_gaia_results')
+    def test_merge_optimized_max_parallel_requests(self, get_gaia_results, get_solr_results):
+        get_gaia_results.return_value = (self.gaia_ids, len(self.gaia_ids), {}, None)
+        get_solr_results.side_effect = self.fake_get_solr_results
+        _, _, _, _, _, params_for_next_page, debug_note = merge_optimized(
+            self.search_form, extra_parameters={'cs_solr_page_size': 5, 'cs_parallel_requests': 1000})
+        self.assertEqual(params_for_next_page, {'cs_lrsidp': 15})
+        # Only two more pages are requested after the first one, as in test_merge_optimized_solr_pages
+        self.assertEqual(get_solr_results.call_count, 3)
@@ -68,6 +68,7 @@ from sounds.models import Sound, Pack, License
 from utils.downloads import download_sounds
 from utils.filesystem import generate_tree
 from utils.nginxsendfile import sendfile, prepare_sendfile_arguments_for_sound_download
+from utils.sound_loader import get_sound_loader
 from utils.tags import clean_and_split_tags
 
 api_logger = logging.getLogger("api")
@@ -135,7 +136,7 @@ class TextSearch(GenericAPIView):
         # Get analysis data and serialize sound results
         ids = [id for id in page['object_list']]
         get_analysis_data_for_queryset_or_sound_ids(self, sound_ids=ids)
-        sounds_dict = Sound.objects.dict_ids(sound_ids=ids)
+        sounds_dict = get_sound_loader(request).dict_ids(sound_ids=ids)
 
         sounds = []
         for i, sid in enumerate(ids):
@@ -225,7 +226,7 @@ class ContentSearch(GenericAPIView):
         # Get analysis data and serialize sound results
         ids = [id for id in page['object_list']]
         get_analysis_data_for_queryset_or_sound_ids(self, sound_ids=ids)
-        sounds_dict = Sound.objects.dict_ids(sound_ids=ids)
+        sounds_dict = get_sound_loader(request).dict_ids(sound_ids=ids)
 
         sounds = []
         for i, sid in enumerate(ids):
@@ -293,7 +294,11 @@ class CombinedSearch(GenericAPIView):
         extra_parameters = dict()
         for key, value in request.query_params.items():
             if key.startswith('cs_'):
-                extra_parameters[key] = int(value)
+                try:
+                    extra_parameters[key] = int(value)
+                except ValueError:
+                    raise BadRequestException(msg='Invalid value for parameter \'%s\', an integer is expected.' % key,
+                                              resource=self)
 
         analysis_file = None
         if self.analysis_file:
@@ -345,7 +350,7 @@ class CombinedSearch(GenericAPIView):
         # Get analysis data and serialize sound results
         ids = results
         get_analysis_data_for_queryset_or_sound_ids(self, sound_ids=ids)
-        sounds_dict = Sound.objects.dict_ids(sound_ids=ids)
+        sounds_dict = get_sound_loader(request).dict_ids(sound_ids=ids)
 
         sounds = []
         for i, sid in enumerate(ids):
@@ -20,45 +20,78 @@
 #     See AUTHORS file.
 #
 
-from follow.models import FollowingUserItem, FollowingQueryItem
+from follow.models import FollowingUserItem, FollowingQueryItem, following_user_ids_cache_key, \
+    follower_user_ids_cache_key, following_tags_cache_key
 import sounds
-from search.views import search_prepare_query, search_prepare_sort
+from search.views import search_prepare_query, search_prepare_sort, search_process_filter
 from django.conf import settings
-from utils.search.solr import Solr, SolrResponseInterpreter
+from django.core.cache import cache
+from utils.search.solr import Solr
 from search.forms import SEARCH_SORT_OPTIONS_WEB
 # from utils.search.solr import Solr, SolrQuery, SolrException, SolrResponseInterpreter, SolrResponseInterpreterPaginator
 import urllib
 
 SOLR_QUERY_LIMIT_PARAM = 3
+STREAM_FILTERS_PER_SOLR_REQUEST = 40
+FOLLOW_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 
 
-def get_users_following(user):
+def get_users_following(user, limit=None):
     items = FollowingUserItem.objects.select_related('user_to__profile').filter(user_from=user)
-    return [item.user_to for item in items]
+    return [item.user_to for item in items[:limit]]
 
 
-def get_users_followers(user):
+def get_users_followers(user, limit=None):
     items = FollowingUserItem.objects.select_related('user_from__profile').filter(user_to=user)
-    return [item.user_from for item in items]
+    return [item.user_from for item in items[:limit]]
 
 
-def get_tags_following(user):
+def get_tags_following(user, limit=None):
     items = FollowingQueryItem.objects.filter(user=user)
-    return [item.query for item in items]
+    return [item.query for item in items[:limit]]
+
+
+def get_following_user_ids(user_id):
+    """
+    Returns the set of ids of the users followed by the given user. Sets of ids are cached and invalidated when
+    following relations change (see follow.models), so checking relations and counting them does not need to load
+    User objects.
+    """
+    return cache.get_or_set(following_user_ids_cache_key(user_id), lambda: frozenset(
+        FollowingUserItem.objects.filter(user_from_id=user_id).values_list('user_to_id', flat=True)),
+        FOLLOW_GRAPH_CACHE_TIMEOUT)
+
+
+def get_follower_user_ids(user_id):
+    """
+    Returns the set of ids of the users following the given user (cached as in get_following_user_ids).
+    """
+    return cache.get_or_set(follower_user_ids_cache_key(user_id), lambda: frozenset(
+        FollowingUserItem.objects.filter(user_to_id=user_id).values_list('user_from_id', flat=True)),
+        FOLLOW_GRAPH_CACHE_TIMEOUT)
+
+
+def get_following_tags_set(user_id):
+    """
+    Returns the set of tag queries (tags separated by spaces) followed by the given user (cached as in
+    get_following_user_ids).
+    """
+    return cache.get_or_set(following_tags_cache_key(user_id), lambda: frozenset(
+        FollowingQueryItem.objects.filter(user_id=user_id).values_list('query', flat=True)),
+        FOLLOW_GRAPH_CACHE_TIMEOUT)
 
 
 def is_user_following_user(user_from, user_to):
-    return user_to in get_users_following(user=user_from)
+    return user_to.id in get_following_user_ids(user_from.id)
 
 
 def is_user_following_tag(user, slash_tag):
-    tags_following = get_tags_following(user)
     space_tag = slash_tag.replace("/", " ")
-    return space_tag in tags_following
+    return space_tag in get_following_tags_set(user.id)
 
 
 def is_user_being_followed_by_user(user_from, user_to):
-    return user_to in get_users_followers(user_from)
+    return user_to.id in get_follower_user_ids(user_from.id)
 
 
 def get_vars_for_account_view(user):
@@ -71,19 +104,14 @@ def get_vars_for_home_view(user):
 
 def get_vars_for_views_helper(user, clip):
 
-    following = get_users_following(user)
-    followers = get_users_followers(user)
-    following_tags = get_tags_following(user)
-
-    following_count = len(following)
-    followers_count = len(followers)
-    following_tags_count = len(following_tags)
+    following_count = len(get_following_user_ids(user.id))
+    followers_count = len(get_follower_user_ids(user.id))
+    following_tags_count = len(get_following_tags_set(user.id))
 
     # show only the first 21 (3 rows) followers and following users and 5 following tags
-    if clip:
-        following = following[:21]
-        followers = followers[:21]
-        following_tags = following_tags[:5]
+    following = get_users_following(user, limit=21 if clip else None)
+    followers = get_users_followers(user, limit=21 if clip else None)
+    following_tags = get_tags_following(user, limit=5 if clip else None)
 
     space_tags = following_tags
     split_tags = [tag.split(" ") for tag in space_tags]
@@ -96,96 +124,119 @@ def get_vars_for_views_helper(user, clip):
     return following, followers, following_tags, following_count, followers_count, following_tags_count
 
 
-def get_stream_sounds(user, time_lapse):
-
-    solr = Solr(settings.SOLR_URL)
-
-    sort_str = search_prepare_sort("created desc", SEARCH_SORT_OPTIONS_WEB)
-
-    #
-    # USERS FOLLOWING
-    #
-
-    users_following = get_users_following(user)
-
-    users_sounds = []
-    for user_following in users_following:
-
-        filter_str = "username:" + user_following.username + " created:" + time_lapse
-
-        query = search_prepare_query(
-            "",
-            filter_str,
-            sort_str,
-            1,
-            SOLR_QUERY_LIMIT_PARAM,
-            grouping=False,
-            include_facets=False
-        )
-
-        result = SolrResponseInterpreter(solr.select(unicode(query)))
+def get_users_following_batch(users):
+    """
+    Returns a dictionary with the list of users followed by each of the given users (keyed by user id).
+    """
+    users_following = dict((user.id, []) for user in users)
+    items = FollowingUserItem.objects.select_related('user_to__profile').filter(user_from__in=users)
+    for item in items:
+        users_following[item.user_from_id].append(item.user_to)
+    return users_following
 
-        if result.num_rows != 0:
 
-            more_count = max(0, result.num_found - SOLR_QUERY_LIMIT_PARAM)
+def get_tags_following_batch(users):
+    """
+    Returns a dictionary with the list of tag queries followed by each of the given users (keyed by user id).
+    """
+    tags_following = dict((user.id, []) for user in users)
+    for user_id, query in FollowingQueryItem.objects.filter(user__in=users).values_list('user_id', 'query'):
+        tags_following[user_id].append(query)
+    return tags_following
 
-            # the sorting only works if done like this!
-            more_url_params = [urllib.quote(filter_str), urllib.quote(sort_str[0])]
 
-            # this is the same link but for the email has to be "quoted"
-            more_url = u"?f=" + filter_str + u"&s=" + sort_str[0]
-            # more_url_quoted = urllib.quote(more_url)
+def get_stream_filter_for_user(username, time_lapse):
+    return "username:" + username + " created:" + time_lapse
 
-            sound_ids = [element['id'] for element in result.docs]
-            sound_objs = sounds.models.Sound.objects.filter(id__in=sound_ids).select_related('license', 'user')
-            new_count = more_count + len(sound_ids)
-            users_sounds.append(((user_following, False), sound_objs, more_url_params, more_count, new_count))
 
-    #
-    # TAGS FOLLOWING
-    #
+def get_stream_filter_for_tags(tags, time_lapse):
+    tag_filter_query = ""
+    for tag in tags:
+        tag_filter_query += "tag:" + tag + " "
+    return tag_filter_query + " created:" + time_lapse
 
-    tags_following = get_tags_following(user)
-
-    tags_sounds = []
-    for tag_following in tags_following:
-
-        tags = tag_following.split(" ")
-        tag_filter_query = ""
-        for tag in tags:
-            tag_filter_query += "tag:" + tag + " "
-
-        tag_filter_str = tag_filter_query + " created:" + time_lapse
 
+def get_stream_filters_results(filter_strs):
+    """
+    Gets the SOLR_QUERY_LIMIT_PARAM most recent sounds matching each of the given filters. Every filter is sent as a
+    group query so that a single Solr request returns the results of STREAM_FILTERS_PER_SOLR_REQUEST filters (requests
+    are GET requests, so the number of filters per request is limited by the length of the URL).
+    :param list filter_strs: filters (in search page filter syntax) of the streams
+    :return: dict with the list of sound ids and the number of matching sounds of every filter
+    """
+    solr = Solr(settings.SOLR_URL)
+    sort_str = search_prepare_sort("created desc", SEARCH_SORT_OPTIONS_WEB)
+    results = dict()
+    filter_strs = list(set(filter_strs))
+    for i in range(0, len(filter_strs), STREAM_FILTERS_PER_SOLR_REQUEST):
+        filter_strs_chunk = filter_strs[i:i + STREAM_FILTERS_PER_SOLR_REQUEST]
+        group_queries = [search_process_filter(filter_str) for filter_str in filter_strs_chunk]
         query = search_prepare_query(
             "",
-            tag_filter_str,
+            "",
             sort_str,
             1,
             SOLR_QUERY_LIMIT_PARAM,
             grouping=False,
             include_facets=False
         )
+        query.set_group_options(group_query=group_queries, group_limit=SOLR_QUERY_LIMIT_PARAM, group_num_groups=False)
+        response = solr.select(unicode(query))
+        for filter_str, group_query in zip(filter_strs_chunk, group_queries):
+            doclist = response['grouped'][group_query]['doclist']
+            results[filter_str] = ([element['id'] for element in doclist['docs']], doclist['numFound'])
+    return results
+
+
+def get_stream_sounds_batch(users_time_lapses):
+    """
+    Gets the stream sounds (see get_stream_sounds) of several users at once. Users and tags followed by all the users
+    are loaded with two queries, the streams of all users are computed with as few Solr requests as possible (streams
+    followed by several users with the same time lapse are only computed once) and all the sounds are loaded with a
+    single bulk query.
+    :param list users_time_lapses: list of (user, time lapse) tuples
+    :return: dict with the (users_sounds, tags_sounds) of every user (keyed by user id)
+    """
+    users = [user for user, _ in users_time_lapses]
+    users_following = get_users_following_batch(users)
+    tags_following = get_tags_following_batch(users)
+
+    streams = []
+    for user, time_lapse in users_time_lapses:
+        users_streams = [((user_following, False), get_stream_filter_for_user(user_following.username, time_lapse))
+                         for user_following in users_following[user.id]]
+        tags_streams = [(tag_following.split(" "), get_stream_filter_for_tags(tag_following.split(" "), time_lapse))
+                        for tag_following in tags_following[user.id]]
+        streams.append((user, users_streams, tags_streams))
+
+    results = get_stream_filters_results(
+        [filter_str for _, users_streams, tags_streams in streams for _, filter_str in users_streams + tags_streams])
+    sound_objs_by_id = sounds.models.Sound.objects.dict_ids(
+        list(set(sound_id for sound_ids, _ in results.values() for sound_id in sound_ids)))
 
-        result = SolrResponseInterpreter(solr.select(unicode(query)))
+    sort_str = search_prepare_sort("created desc", SEARCH_SORT_OPTIONS_WEB)
 
-        if result.num_rows != 0:
+    def get_stream_sounds_list(followed_streams):
+        stream_sounds = []
+        for followed, filter_str in followed_streams:
+            sound_ids, num_found = results[filter_str]
+            if sound_ids:
+                more_count = max(0, num_found - SOLR_QUERY_LIMIT_PARAM)
 
-            more_count = max(0, result.num_found - SOLR_QUERY_LIMIT_PARAM)
+                # the sorting only works if done like this!
+                more_url_params = [urllib.quote(filter_str), urllib.quote(sort_str[0])]
 
-            # the sorting only works if done like this!
-            more_url_params = [urllib.quote(tag_filter_str), urllib.quote(sort_str[0])]
+                sound_objs = [sound_objs_by_id[sound_id] for sound_id in sound_ids if sound_id in sound_objs_by_id]
+                new_count = more_count + len(sound_ids)
+                stream_sounds.append((followed, sound_objs, more_url_params, more_count, new_count))
+        return stream_sounds
 
-            # this is the same link but for the email has to be "quoted"
-            more_url = u"?f=" + tag_filter_str + u"&s=" + sort_str[0]
-            # more_url_quoted = urllib.quote(more_url)
+    return dict((user.id, (get_stream_sounds_list(users_streams), get_stream_sounds_list(tags_streams)))
+                for user, users_streams, tags_streams in streams)
 
-            sound_ids = [element['id'] for element in result.docs]
-            sound_objs = sounds.models.Sound.objects.filter(id__in=sound_ids)
-            new_count = more_count + len(sound_ids)
-            tags_sounds.append((tags, sound_objs, more_url_params, more_count, new_count))
 
-    return users_sounds, tags_sounds
+def get_stream_sounds(user, time_lapse):
+    return get_stream_sounds_batch([(user, time_lapse)])[user.id]
 
 
 def build_time_lapse(date_from, date_to):
@@ -22,7 +22,6 @@ import json
 import logging
 
 from django.conf import settings
-from django.contrib.auth.models import User
 
 from accounts.models import Profile, EmailPreferenceType
 from follow import follow_utils
@@ -56,37 +55,56 @@ class Command(LoggingBaseCommand):
 
         users_enabled_notifications = Profile.objects.filter(user_id__in=user_ids).exclude(
             last_stream_email_sent__gt=date_today_minus_notification_timedelta).order_by(
-            "-last_attempt_of_sending_stream_email")[:settings.MAX_EMAILS_PER_COMMAND_RUN]
+            "-last_attempt_of_sending_stream_email").select_related('user')[:settings.MAX_EMAILS_PER_COMMAND_RUN]
+        users_enabled_notifications = list(users_enabled_notifications)
 
         n_emails_sent = 0
-        for profile in users_enabled_notifications:
+        for i in range(0, len(users_enabled_notifications), settings.STREAM_EMAILS_BATCH_SIZE):
+            profiles = users_enabled_notifications[i:i + settings.STREAM_EMAILS_BATCH_SIZE]
+            n_emails_sent += self.send_stream_emails(profiles)
 
-            username = profile.user.username
+        self.log_end({'n_users_notified': n_emails_sent})
+
+    def send_stream_emails(self, profiles):
+        """
+        Sends the stream emails of a batch of users. Streams of all the users of the batch are computed together (see
+        follow_utils.get_stream_sounds_batch).
+        :return: number of emails sent
+        """
+        for profile in profiles:
             profile.last_attempt_of_sending_stream_email = datetime.datetime.now()
 
-            # Variable names use the terminology "week" because settings.NOTIFICATION_TIMEDELTA_PERIOD defaults to a
-            # week, but a more generic terminology could be used
-            week_first_day = profile.last_stream_email_sent
-            week_last_day = datetime.datetime.now()
+        # Variable names use the terminology "week" because settings.NOTIFICATION_TIMEDELTA_PERIOD defaults to a
+        # week, but a more generic terminology could be used
+        week_last_day = datetime.datetime.now()
+
+        # Set date range from which to get upload notifications
+        time_lapses = [follow_utils.build_time_lapse(profile.last_stream_email_sent, week_last_day)
+                       for profile in profiles]
+        try:
+            streams = follow_utils.get_stream_sounds_batch(
+                [(profile.user, time_lapse) for profile, time_lapse in zip(profiles, time_lapses)])
+        except Exception as e:
+            # If error occur do not send the emails
+            for profile in profiles:
+                console_logger.info("could not get new sounds data for {0}".format(profile.user.username))
+                profile.save()  # Save last_attempt_of_sending_stream_email
+            return 0
 
+        n_emails_sent = 0
+        for profile in profiles:
+
+            user = profile.user
+            username = user.username
+
+            week_first_day = profile.last_stream_email_sent
             week_first_day_str = week_first_day.strftime("%d %b").lstrip("0")
             week_last_day_str = week_last_day.strftime("%d %b").lstrip("0")
 
             extra_email_subject = unicode(week_first_day_str) + u' to ' + unicode(week_last_day_str)
 
-            # Set date range from which to get upload notifications
-            time_lapse = follow_utils.build_time_lapse(week_first_day, week_last_day)
-
             # construct message
-            user = User.objects.get(username=username)
-            try:
-                users_sounds, tags_sounds = follow_utils.get_stream_sounds(user, time_lapse)
-            except Exception as e:
-                # If error occur do not send the email
-                console_logger.info("could not get new sounds data for {0}".format(username))
-                profile.save()  # Save last_attempt_of_sending_stream_email
-                continue
-
+            users_sounds, tags_sounds = streams[user.id]
             if not users_sounds and not tags_sounds:
                 console_logger.info("no news sounds for {0}".format(username))
                 profile.save()  # Save last_attempt_of_sending_stream_email
@@ -115,4 +133,4 @@ class Command(LoggingBaseCommand):
             profile.last_stream_email_sent = datetime.datetime.now()
             profile.save()
 
-        self.log_end({'n_users_notified': n_emails_sent})
+        return n_emails_sent
@@ -21,7 +21,10 @@
 #
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 
 class FollowingUserItem(models.Model):
@@ -49,3 +52,30 @@ class FollowingQueryItem(models.Model):
     class Meta:
         verbose_name_plural = 'Tags'
         unique_together = ("user", "query")
+
+
+def following_user_ids_cache_key(user_id):
+    return 'following-user-ids-%i' % user_id
+
+
+def follower_user_ids_cache_key(user_id):
+    return 'follower-user-ids-%i' % user_id
+
+
+def following_tags_cache_key(user_id):
+    return 'following-tags-%i' % user_id
+
+
+@receiver(post_save, sender=FollowingUserItem)
+@receiver(post_delete, sender=FollowingUserItem)
+def invalidate_follow_user_caches(sender, instance, **kwargs):
+    """Invalidate the cached sets of followed and following users (see follow_utils.get_following_user_ids)"""
+    cache.delete_many([following_user_ids_cache_key(instance.user_from_id),
+                       follower_user_ids_cache_key(instance.user_to_id)])
+
+
+@receiver(post_save, sender=FollowingQueryItem)
+@receiver(post_delete, sender=FollowingQueryItem)
+def invalidate_follow_tags_cache(sender, instance, **kwargs):
+    """Invalidate the cached set of followed tags (see follow_utils.get_following_tags_set)"""
+    cache.delete(following_tags_cache_key(instance.user_id))
@@ -19,10 +19,16 @@
 # Authors:
 #     See AUTHORS file.
 #
+import datetime
+import urlparse
+
+import mock
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.client import Client
 from accounts.models import Profile
 from django.contrib.auth.models import User
+from follow import follow_utils
 from follow.models import FollowingUserItem, FollowingQueryItem
 
 
@@ -31,6 +37,7 @@ class FollowTestCase(TestCase):
     fixtures = ['users', 'follow']
 
     def setUp(self):
+        cache.clear()  # Cached follow relations of fixture users could be left from other tests
         self.user = User.objects.create_user("testuser", password="testpass")
         self.client.login(username='testuser', password='testpass')
 
@@ -147,3 +154,51 @@ class FollowTestCase(TestCase):
         # Stream should return OK
         resp = self.client.get("/home/stream/")
         self.assertEqual(resp.status_code, 200)
+
+    def test_follow_graph_cache(self):
+        user2 = User.objects.get(id=2)
+        self.assertFalse(follow_utils.is_user_following_user(self.user, user2))
+        self.assertFalse(follow_utils.is_user_being_followed_by_user(user2, self.user))
+        self.assertFalse(follow_utils.is_user_following_tag(self.user, 'field-recording/another_tag'))
+        followers_count = len(follow_utils.get_follower_user_ids(user2.id))
+
+        # Cached sets are updated when following relations change
+        self.client.get("/follow/follow_user/User2/")
+        self.client.get("/follow/follow_tags/field-recording/another_tag/")
+        self.assertTrue(follow_utils.is_user_following_user(self.user, user2))
+        self.assertTrue(follow_utils.is_user_being_followed_by_user(user2, self.user))
+        self.assertTrue(follow_utils.is_user_following_tag(self.user, 'field-recording/another_tag'))
+        self.assertEqual(len(follow_utils.get_follower_user_ids(user2.id)), followers_count + 1)
+
+        self.client.get("/follow/unfollow_user/User2/")
+        self.client.get("/follow/unfollow_tags/field-recording/another_tag/")
+        self.assertFalse(follow_utils.is_user_following_user(self.user, user2))
+        self.assertFalse(follow_utils.is_user_being_followed_by_user(user2, self.user))
+        self.assertFalse(follow_utils.is_user_following_tag(self.user, 'field-recording/another_tag'))
+
+    @mock.patch('follow.follow_utils.Solr.select')
+    def test_get_stream_sounds_batch(self, select):
+        def select_response(query_string):
+            # Every group query matches 5 sounds, the most recent one is sound 1
+            group_queries = urlparse.parse_qs(query_string.encode('utf-8'))['group.query']
+            return {'grouped': dict((group_query.decode('utf-8'), {'doclist': {'numFound': 5, 'docs': [{'id': 1}]}})
+                                    for group_query in group_queries)}
+        select.side_effect = select_response
+
+        users = User.objects.filter(id__in=[2, 3, 4])
+        time_lapse = follow_utils.build_time_lapse(datetime.datetime(2015, 5, 1), datetime.datetime(2015, 5, 8))
+        streams = follow_utils.get_stream_sounds_batch([(user, time_lapse) for user in users])
+
+        # Streams of all users are computed with a single Solr request
+        self.assertEqual(select.call_count, 1)
+        users_sounds, tags_sounds = streams[3]
+        self.assertEqual([user for (user, _), _, _, _, _ in users_sounds], [User.objects.get(id=2)])
+        self.assertEqual(tags_sounds, [])
+        users_sounds, tags_sounds = streams[2]
+        self.assertItemsEqual([user.id for (user, _), _, _, _, _ in users_sounds], [3, 4])
+        self.assertItemsEqual([tags for tags, _, _, _, _ in tags_sounds],
+                              [['field-recording'], ['field-recording', 'binaural']])
+        _, sound_objs, _, more_count, new_count = tags_sounds[0]
+        self.assertEqual(sound_objs, [])  # Sound 1 does not exist
+        self.assertEqual(more_count, 2)
+        self.assertEqual(new_count, 3)
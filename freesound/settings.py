@@ -297,6 +297,7 @@ LOG_DOWNLOADS = False
 # Followers notifications
 MAX_EMAILS_PER_COMMAND_RUN = 5000
 NOTIFICATION_TIMEDELTA_PERIOD = datetime.timedelta(days=7)
+STREAM_EMAILS_BATCH_SIZE = 500  # Number of users whose streams are computed together
 
 
 # -------------------------------------------------------------------------------
@@ -389,6 +390,19 @@ SOLR_DYNAMIC_FIELDS_SUFFIX_MAP = {
 SOLR_URL = "http://search:8080/fs2/"
 SOLR_FORUM_URL = "http://search:8080/forum/"
 
+# If enabled, changes to sounds are sent as events to the Solr indexing worker (gm_worker_solr_indexing) which updates
+# the index after coalescing the events received within SOLR_INDEX_EVENTS_COALESCE_WINDOW seconds
+SOLR_INDEX_EVENTS_ENABLED = False
+SOLR_INDEX_EVENTS_COALESCE_WINDOW = 5
+
+# Search results are cached until the index changes (see utils.search.search_cache) or SEARCH_RESULTS_CACHE_TIME
+# seconds pass. Results computed less than SEARCH_RESULTS_CACHE_VISIBILITY_DELAY seconds after a change of the index
+# are only cached until then, as changes are not visible until Solr's next soft commit (autoSoftCommit is 1 second in
+# the fs2 solrconfig.xml).
+SEARCH_RESULTS_CACHE_TIME = 60 * 5
+SEARCH_RESULTS_CACHE_VISIBILITY_DELAY = 2
+SEARCH_RESULTS_CACHE_LOCK_TIMEOUT = 10
+
 ENABLE_QUERY_SUGGESTIONS = False  # Only for BW
 DEFAULT_SEARCH_WEIGHTS = {
     'id': 4,
@@ -462,12 +476,26 @@ GEARMAN_JOB_SERVERS = ["gearmand:4730"]
 
 STEREOFY_PATH = '/usr/local/bin/stereofy'
 
+# If enabled, processing and analysis outputs are stored by md5 in PROCESSING_ARTIFACTS_PATH and sounds with the same
+# contents as a previously processed sound (e.g. deleted and uploaded again) reuse them instead of computing them again.
+# Stored outputs no sound links to anymore are removed with the clean_processing_artifacts management command.
+REUSE_PROCESSING_ARTIFACTS = False
+
+# Max number of preview encoders (lame, oggenc) run concurrently when processing a sound
+PROCESSING_MAX_PARALLEL_PREVIEW_ENCODES = 4
+
 # Min free disk space percentage for worker (worker will raise exception if not enough free disk space is available)
 WORKER_MIN_FREE_DISK_SPACE_PERCENTAGE = 0.05
 
 # General timeout for processing/analysis workers (in seconds)
 WORKER_TIMEOUT = 60 * 60
 
+# When processing/analysis workers run several slots (see gm_worker_processing --slots), sounds longer than
+# WORKER_LARGE_JOB_DURATION seconds never take all the slots and shorter sounds are run first, unless a job has been
+# waiting for more than WORKER_MAX_QUEUE_WAIT seconds
+WORKER_LARGE_JOB_DURATION = 10 * 60
+WORKER_MAX_QUEUE_WAIT = 30 * 60
+
 ESSENTIA_EXECUTABLE = '/usr/local/bin/essentia_streaming_extractor_freesound'
 ESSENTIA_STATS_OUT_FORMAT = 'yaml'
 ESSENTIA_FRAMES_OUT_FORMAT = 'yaml'
@@ -505,6 +533,15 @@ APIV2 = {
     'MAX_PAGE_SIZE': 150,
 }
 
+# Maximum time (in seconds) that a combined search can spend querying solr and gaia (can be changed per request with
+# the 'cs_timeout' parameter)
+APIV2_COMBINED_SEARCH_TIMEOUT = 30
+
+# Upper bounds for the 'cs_timeout' and 'cs_parallel_requests' parameters given by clients. Parallel requests to solr
+# and gaia are also sent in groups of at most APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS requests.
+APIV2_COMBINED_SEARCH_MAX_TIMEOUT = 60
+APIV2_COMBINED_SEARCH_MAX_PARALLEL_REQUESTS = 8
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'apiv2.pagination.CustomPagination',
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
@@ -651,6 +688,7 @@ CSV_PATH = os.path.join(DATA_PATH, "csv/")
 ANALYSIS_PATH = os.path.join(DATA_PATH, "analysis/")
 FILE_UPLOAD_TEMP_DIR = os.path.join(DATA_PATH, "tmp_uploads/")
 PROCESSING_TEMP_DIR = os.path.join(DATA_PATH, "tmp_processing/")
+PROCESSING_ARTIFACTS_PATH = os.path.join(DATA_PATH, "processing_artifacts/")
 
 # URLs (depend on DATA_URL potentially re-defined in local_settings.py)
 AVATARS_URL = DATA_URL + "avatars/"
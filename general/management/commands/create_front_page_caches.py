@@ -26,6 +26,9 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.core.cache import cache
 
+from search.forms import SEARCH_SORT_OPTIONS_WEB
+from search.views import search_prepare_query, search_prepare_sort, search_prepare_facets_query, \
+    perform_solr_query
 from sounds.models import Download, Pack, Sound
 from utils.management_commands import LoggingBaseCommand
 
@@ -56,6 +59,18 @@ class Command(LoggingBaseCommand):
                             'swoosh', 'rain', 'fire']
         cache.set("popular_searches", popular_searches,  cache_time)
 
+        # Warm the search results cache with the first page of popular searches (the search view makes a facet-free
+        # query for the page and a separate facets query, both are prepared with the same default parameters as the
+        # view so cache keys match)
+        for search_query in popular_searches:
+            query = search_prepare_query(search_query, '', search_prepare_sort(None, SEARCH_SORT_OPTIONS_WEB), 1,
+                                         settings.SOUNDS_PER_PAGE, grouping="1", include_facets=False)
+            facets_query = search_prepare_facets_query(search_query, '')
+            try:
+                perform_solr_query(query, 1, facets_query=facets_query)
+            except Exception as e:
+                commands_logger.error('Could not warm search results cache for query "%s" (%s)' % (search_query, e))
+
         # TODO: we have to decide how do we determine "trending searches" and how often these are updated. Depending on
         # this we'll have to change the frequency with which we run create_front_page_caches management command
 
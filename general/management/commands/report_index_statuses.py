@@ -19,6 +19,7 @@
 #
 
 import logging
+import time
 
 from sounds.models import Sound
 from utils.management_commands import LoggingBaseCommand
@@ -48,7 +49,9 @@ class Command(LoggingBaseCommand):
 
         # Get all solr ids
         console_logger.info("Getting solr ids...")
+        start_time = time.time()
         solr_ids = get_all_sound_ids_from_solr()
+        console_logger.info("Got %i solr ids in %.2f seconds" % (len(solr_ids), time.time() - start_time))
 
         # Get ell gaia ids
         console_logger.info("Getting gaia ids...")
@@ -56,12 +59,11 @@ class Command(LoggingBaseCommand):
 
         console_logger.info("Getting freesound db data...")
         # Get all moderated and processed sound ids
-        queryset = Sound.objects.filter(processing_state='OK', moderation_state='OK').order_by('id').only("id")
-        fs_mp = [sound.id for sound in queryset]
+        fs_mp = list(Sound.objects.filter(processing_state='OK', moderation_state='OK')
+                     .order_by('id').values_list('id', flat=True))
         # Get ell moderated, processed and analysed sounds
-        queryset = Sound.objects.filter(processing_state='OK', moderation_state='OK', analysis_state='OK')\
-            .order_by('id').only("id")
-        fs_mpa = [sound.id for sound in queryset]
+        fs_mpa = list(Sound.objects.filter(processing_state='OK', moderation_state='OK', analysis_state='OK')
+                      .order_by('id').values_list('id', flat=True))
 
         in_solr_not_in_fs = list(set(solr_ids).intersection(set(set(solr_ids).difference(fs_mp))))
         in_fs_not_in_solr = list(set(fs_mp).intersection(set(set(fs_mp).difference(solr_ids))))
@@ -37,6 +37,8 @@ urlpatterns = [
     url(r'^ajax_sounds_stats/$', monitor.views.sounds_stats_ajax, name='monitor-sounds-stats-ajax'),
     url(r'^ajax_users_stats/$', monitor.views.users_stats_ajax, name='monitor-users-stats-ajax'),
     url(r'^ajax_active_users_stats/$', monitor.views.active_users_stats_ajax, name='monitor-active-users-stats-ajax'),
+    url(r'^ajax_solr_connection_pool_stats/$', monitor.views.solr_connection_pool_stats_ajax,
+        name='monitor-solr-connection-pool-stats-ajax'),
     url(r'^ajax_moderator_stats/$', monitor.views.moderator_stats_ajax, name='monitor-moderator-stats-ajax'),
 
 ]
@@ -36,6 +36,7 @@ from django.urls import reverse
 import tickets
 from sounds.models import Sound
 from tickets import TICKET_STATUS_CLOSED
+from utils.search.solr import default_connection_pool
 
 
 @login_required
@@ -188,6 +189,13 @@ def totals_stats_ajax(request):
     return JsonResponse(totals_stats or {})
 
 
+@login_required
+@user_passes_test(lambda u: u.is_staff, login_url='/')
+def solr_connection_pool_stats_ajax(request):
+    # NOTE: the connection pool is per process, so these are the stats of the worker process serving the request
+    return JsonResponse(default_connection_pool.stats())
+
+
 @login_required
 @user_passes_test(lambda u: u.is_staff, login_url='/')
 def process_sounds(request):
@@ -30,6 +30,8 @@ from django.db.models.functions import Coalesce
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from utils.search.search_general import send_sound_index_event
+
 
 class SoundRating(models.Model):
     user = models.ForeignKey(User)
@@ -56,6 +58,7 @@ def post_delete_rating(sender, instance, **kwargs):
             rating = avg_rating['average_rating']
             instance.sound.avg_rating = rating
             instance.sound.save()
+        send_sound_index_event(instance.sound_id, counter_fields=['avg_rating', 'num_ratings'])
     except ObjectDoesNotExist:
         pass
 
@@ -73,3 +76,4 @@ def update_num_ratings_on_post_save(sender, instance, created, **kwargs):
         rating = avg_rating['average_rating']
         instance.sound.avg_rating = rating
         instance.sound.save()
+    send_sound_index_event(instance.sound_id, counter_fields=['avg_rating', 'num_ratings'])
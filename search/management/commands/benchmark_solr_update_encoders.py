@@ -0,0 +1,74 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from sounds.models import Sound
+from utils.search.search_general import convert_to_solr_document
+from utils.search.solr import BaseSolrAddEncoder, SolrJsonUpdateEncoder
+
+console_logger = logging.getLogger("console")
+
+
+class Command(BaseCommand):
+    help = 'Compare encoding time and payload size of the XML and JSON Solr update encoders using real sound ' \
+           'documents. No requests are sent to Solr.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', '--num-sounds',
+            action='store',
+            dest='num_sounds',
+            default=1000,
+            type=int,
+            help='Number of sounds to encode in every batch (default 1000).')
+
+        parser.add_argument(
+            '-r', '--repetitions',
+            action='store',
+            dest='repetitions',
+            default=10,
+            type=int,
+            help='Number of times each batch is encoded (default 10).')
+
+    def handle(self, *args, **options):
+        sound_ids = list(Sound.objects.filter(processing_state="OK", moderation_state="OK")
+                         .order_by('-id').values_list('id', flat=True)[:options['num_sounds']])
+        documents = [convert_to_solr_document(s) for s in Sound.objects.bulk_query_solr(sound_ids)]
+        console_logger.info("Encoding %i sound documents %i times", len(documents), options['repetitions'])
+
+        xml_encoder = BaseSolrAddEncoder()
+        json_encoder = SolrJsonUpdateEncoder()
+        benchmarks = [
+            # The XML path needs a separate request for deleting the documents before adding them
+            ('XML add', lambda: xml_encoder.encode(documents)),
+            ('XML delete + add', lambda: xml_encoder.encode_delete_by_ids(sound_ids) + xml_encoder.encode(documents)),
+            ('JSON add', lambda: json_encoder.encode(documents)),
+            ('JSON delete + add', lambda: json_encoder.encode_update(docs=documents, delete_ids=sound_ids)),
+        ]
+        for name, encode in benchmarks:
+            start = time.time()
+            for _ in range(options['repetitions']):
+                payload = encode()
+            elapsed = (time.time() - start) / options['repetitions']
+            console_logger.info("%s: %.2f ms per batch, %.1f KB payload", name, elapsed * 1000, len(payload) / 1024.0)
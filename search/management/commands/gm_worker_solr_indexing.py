@@ -0,0 +1,126 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import json
+import logging
+import time
+
+import gearman
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from utils.search.search_general import update_sounds_in_solr
+
+workers_logger = logging.getLogger("workers")
+
+
+class SoundIndexEventsBuffer(object):
+    """
+    Collects sound index events and coalesces repeated events for the same sound. A sound that needs a full update
+    is only re-indexed once per flush regardless of how many events were received, and counter-only changes are merged
+    into a single atomic update (or dropped if a full update is also pending for the same sound).
+    """
+
+    def __init__(self):
+        self.full_update_ids = set()
+        self.counter_updates = {}
+        self.first_event_time = None
+
+    def __len__(self):
+        return len(self.full_update_ids.union(self.counter_updates.keys()))
+
+    def add(self, sound_id, counter_fields=None):
+        if self.first_event_time is None:
+            self.first_event_time = time.time()
+        if counter_fields is None:
+            self.full_update_ids.add(sound_id)
+        else:
+            self.counter_updates.setdefault(sound_id, set()).update(counter_fields)
+
+    def is_due(self, window):
+        return self.first_event_time is not None and time.time() - self.first_event_time >= window
+
+    def flush(self):
+        full_update_ids, counter_updates = self.full_update_ids, self.counter_updates
+        self.__init__()
+        return full_update_ids, counter_updates
+
+
+class SolrIndexingGearmanWorker(gearman.GearmanWorker):
+
+    def __init__(self, host_list, window):
+        super(SolrIndexingGearmanWorker, self).__init__(host_list)
+        self.window = window
+        self.events = SoundIndexEventsBuffer()
+
+    def after_poll(self, any_activity):
+        # Called by gearman after every poll (at least once every poll_timeout seconds), this is where we flush the
+        # events collected during the coalescing window
+        if self.events.is_due(self.window):
+            self.flush_events()
+        return True
+
+    def flush_events(self):
+        num_events = len(self.events)
+        full_update_ids, counter_updates = self.events.flush()
+        start_time = time.time()
+        close_old_connections()
+        try:
+            num_indexed, num_counters_updated, num_deleted = update_sounds_in_solr(full_update_ids, counter_updates)
+            workers_logger.info("Updated sounds in solr index (%s)" % json.dumps(
+                {'task_name': 'sound_index_event', 'n_sounds': num_events, 'n_indexed': num_indexed,
+                 'n_counters_updated': num_counters_updated, 'n_deleted': num_deleted,
+                 'work_time': round(time.time() - start_time, 3)}))
+        except Exception as e:
+            # Sounds stay marked as is_index_dirty so they will eventually be indexed by post_dirty_sounds_to_solr
+            workers_logger.error("Unexpected error while updating sounds in solr index (%s)" % json.dumps(
+                {'task_name': 'sound_index_event', 'n_sounds': num_events, 'error': str(e),
+                 'work_time': round(time.time() - start_time, 3)}))
+
+
+class Command(BaseCommand):
+    help = 'Run the Solr indexing worker. The worker receives sound change events (see ' \
+           'utils.search.search_general.send_sound_index_event), coalesces the events received within a time window ' \
+           'and updates the index accordingly: sounds whose counters changed (num_downloads, avg_rating, num_ratings) ' \
+           'are updated using Solr atomic updates while other changes trigger the re-indexing of the full document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-w', '--window',
+            action='store',
+            dest='window',
+            default=settings.SOLR_INDEX_EVENTS_COALESCE_WINDOW,
+            type=float,
+            help='Seconds during which events are collected before updating the index (default %s).'
+                 % settings.SOLR_INDEX_EVENTS_COALESCE_WINDOW)
+
+    def handle(self, *args, **options):
+        gm_worker = SolrIndexingGearmanWorker(settings.GEARMAN_JOB_SERVERS, options['window'])
+
+        def task_sound_index_event(gearman_worker, gearman_job):
+            job_data = json.loads(gearman_job.data)
+            gearman_worker.events.add(job_data['sound_id'], job_data.get('counter_fields'))
+            return ''  # Gearman requires return value to be a string
+
+        gm_worker.register_task('sound_index_event', task_sound_index_event)
+        workers_logger.info('Started worker with tasks: sound_index_event')
+        # Use a poll timeout shorter than the coalescing window so that after_poll is called often enough
+        gm_worker.work(poll_timeout=max(options['window'] / 2.0, 0.1))
@@ -23,7 +23,8 @@ import logging
 from django.core.management.base import BaseCommand
 
 from sounds.models import Sound
-from utils.search.search_general import add_all_sounds_to_solr, delete_sounds_from_solr, get_all_sound_ids_from_solr
+from utils.search.search_general import add_all_sounds_to_solr, add_all_sounds_to_solr_pipelined, \
+    delete_sounds_from_solr, get_all_sound_ids_from_solr
 
 console_logger = logging.getLogger("console")
 
@@ -37,12 +38,41 @@ class Command(BaseCommand):
            'case there is a specific need of re-indexing all sounds without marking them as is_index_dirty and ' \
            'using the "post_dirty_sounds_to_solr" command.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-p', '--pipelined',
+            action='store_true',
+            dest='pipelined',
+            default=False,
+            help='Stream sound ids from the DB and index several slices of sounds in parallel.')
+
+        parser.add_argument(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            default=4,
+            type=int,
+            help='Number of slices to index in parallel when using --pipelined (default 4).')
+
+        parser.add_argument(
+            '-c', '--checkpoint',
+            action='store',
+            dest='checkpoint',
+            default=None,
+            help='When using --pipelined, path to a file where indexing progress is saved. If the command is '
+                 'interrupted, running it again with the same checkpoint file resumes indexing where it stopped.')
+
     def handle(self, *args, **options):
 
         # Get all sounds moderated and processed ok and add them to solr (also delete them before re-indexing)
         sounds_to_index = Sound.objects.filter(processing_state="OK", moderation_state="OK")
         console_logger.info("Re-indexing %d sounds to solr", sounds_to_index.count())
-        add_all_sounds_to_solr(sounds_to_index, mark_index_clean=True, delete_if_existing=True)
+        if options['pipelined']:
+            add_all_sounds_to_solr_pipelined(sounds_to_index, num_workers=options['workers'],
+                                             mark_index_clean=True, delete_if_existing=True,
+                                             checkpoint_path=options['checkpoint'])
+        else:
+            add_all_sounds_to_solr(sounds_to_index, mark_index_clean=True, delete_if_existing=True)
 
         # Delete all sounds in solr which are not found in the Freesound DB
         solr_ids = get_all_sound_ids_from_solr()
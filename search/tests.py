@@ -18,13 +18,28 @@
 #     See AUTHORS file.
 #
 
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
 from django.urls import reverse
-from sounds.models import Sound
-from search.views import search_process_filter
-from utils.search.solr import SolrResponseInterpreter, SolrResponseInterpreterPaginator
+from search.management.commands.gm_worker_solr_indexing import SoundIndexEventsBuffer
+from sounds.models import Sound, Download
+from search.views import search_process_filter, search_prepare_query, perform_solr_query
+from utils.search.search_cache import bump_search_results_cache_generation, get_search_results_cache_key, \
+    get_search_results_cache_timeout
+from utils.search.search_general import add_all_sounds_to_solr_pipelined, update_sounds_in_solr, \
+    get_all_sound_ids_from_solr
+from utils.test_helpers import create_user_and_sounds
+from utils.search.solr import Solr, SolrConnectionPool, SolrResponseInterpreter, SolrResponseInterpreterPaginator, \
+    SolrException, SolrJsonUpdateEncoder, SolrQuery
+import datetime
+import httplib
+import json
 import mock
 import copy
+import os
+import tempfile
+import urlparse
 
 
 solr_select_returned_data = {
@@ -143,6 +158,39 @@ class SearchPageTests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(len(resp.context['filter_query_split']), 2)
 
+    @mock.patch('search.views.perform_solr_query')
+    def test_search_page_facets_query(self, perform_solr_query):
+        perform_solr_query.return_value = self.perform_solr_query_response
+
+        # Results are retrieved with a facet-free query and facets with a separate query which returns no documents
+        self.client.get(reverse('sounds-search'), {'q': 'dogs', 'page': 2})
+        query, current_page = perform_solr_query.call_args[0]
+        facets_query = perform_solr_query.call_args[1]['facets_query']
+        self.assertEqual(current_page, 2)
+        self.assertNotIn('facet.field', query.params)
+        self.assertEqual(query.params['start'], 15)
+        self.assertIn('tag', facets_query.params['facet.field'])
+        self.assertEqual(facets_query.params['rows'], 0)
+        self.assertEqual(facets_query.params['start'], 0)
+
+        # Facets are not needed in AJAX results
+        self.client.get(reverse('sounds-search'), {'q': 'dogs', 'ajax': '1'})
+        self.assertIsNone(perform_solr_query.call_args[1]['facets_query'])
+
+    @mock.patch('general.management.commands.create_front_page_caches.render_to_string', return_value='')
+    @mock.patch('general.management.commands.create_front_page_caches.perform_solr_query')
+    @mock.patch('search.views.perform_solr_query')
+    def test_front_page_caches_warm_search_queries(self, perform_solr_query, warm_perform_solr_query, _):
+        perform_solr_query.return_value = self.perform_solr_query_response
+
+        # The queries used to warm the search results cache of popular searches are the ones made by the search view
+        self.client.get(reverse('sounds-search'), {'q': 'wind'})
+        call_command('create_front_page_caches')
+        warmed_queries = [(unicode(args[0]), args[1], unicode(kwargs['facets_query']))
+                          for args, kwargs in warm_perform_solr_query.call_args_list]
+        args, kwargs = perform_solr_query.call_args
+        self.assertIn((unicode(args[0]), args[1], unicode(kwargs['facets_query'])), warmed_queries)
+
 
 class SearchProcessFilter(TestCase):
 
@@ -162,3 +210,388 @@ class SearchProcessFilter(TestCase):
 
 
 
+
+
+class SolrConnectionPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = SolrConnectionPool(max_connections_per_host=1, idle_timeout=30)
+
+    @staticmethod
+    def make_connection(will_close=False, data='{}'):
+        conn = mock.Mock()
+        conn.getresponse.return_value = mock.Mock(status=200, reason='OK', will_close=will_close)
+        conn.getresponse.return_value.read.return_value = data
+        return conn
+
+    @mock.patch('httplib.HTTPConnection')
+    def test_connections_are_reused(self, http_connection):
+        conn = self.make_connection()
+        http_connection.return_value = conn
+        solr = Solr('http://fakehost:8080/fs2/', pool=self.pool)
+        for _ in range(3):
+            self.assertEqual(solr._request(query_string='q=dogs').read(), '{}')
+
+        # Only one connection is opened and it is used for all requests
+        self.assertEqual(http_connection.call_count, 1)
+        self.assertEqual(conn.request.call_count, 3)
+        stats = self.pool.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    @mock.patch('httplib.HTTPConnection')
+    def test_connection_closed_by_server_is_not_reused(self, http_connection):
+        http_connection.side_effect = lambda *args, **kwargs: self.make_connection(will_close=True)
+        solr = Solr('http://fakehost:8080/fs2/', pool=self.pool)
+        solr._request(query_string='q=dogs')
+        solr._request(query_string='q=dogs')
+        self.assertEqual(http_connection.call_count, 2)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    @mock.patch('httplib.HTTPConnection')
+    def test_stale_connection_is_retried(self, http_connection):
+        stale_conn = self.make_connection()
+        fresh_conn = self.make_connection()
+        http_connection.side_effect = [stale_conn, fresh_conn]
+        solr = Solr('http://fakehost:8080/fs2/', pool=self.pool)
+        solr._request(query_string='q=dogs')
+
+        # Next time the pooled connection is used the server has closed it
+        stale_conn.getresponse.side_effect = httplib.BadStatusLine('')
+        self.assertEqual(solr._request(query_string='q=dogs').read(), '{}')
+        self.assertTrue(stale_conn.close.called)
+        self.assertEqual(fresh_conn.request.call_count, 1)
+        self.assertEqual(self.pool.stats()['retries'], 1)
+
+    @mock.patch('httplib.HTTPConnection')
+    def test_idle_connections_expire(self, http_connection):
+        http_connection.side_effect = lambda *args, **kwargs: self.make_connection()
+        solr = Solr('http://fakehost:8080/fs2/', pool=self.pool)
+        with mock.patch('time.time', return_value=1000):
+            solr._request(query_string='q=dogs')
+        with mock.patch('time.time', return_value=1000 + self.pool.idle_timeout + 1):
+            solr._request(query_string='q=dogs')
+        self.assertEqual(http_connection.call_count, 2)
+        self.assertEqual(self.pool.stats()['evictions'], 1)
+
+    @mock.patch('httplib.HTTPConnection')
+    def test_max_connections_per_host(self, http_connection):
+        conn1 = self.make_connection()
+        conn2 = self.make_connection()
+        http_connection.side_effect = [conn1, conn2]
+        # Two connections in use at the same time but only one can be kept idle in the pool
+        c1, _ = self.pool._get('fakehost', 8080)
+        c2, _ = self.pool._get('fakehost', 8080)
+        self.pool._release('fakehost', 8080, c1)
+        self.pool._release('fakehost', 8080, c2)
+        self.assertTrue(conn2.close.called)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+
+class AddAllSoundsToSolrPipelinedTest(TestCase):
+
+    fixtures = ['licenses', 'users', 'sounds_with_tags']
+
+    def setUp(self):
+        self.sound_ids = sorted(Sound.objects.values_list('id', flat=True))
+        self.checkpoint_path = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+    @mock.patch('utils.search.search_general._index_sounds_slice')
+    def test_all_sounds_indexed(self, index_sounds_slice):
+        num_indexed = add_all_sounds_to_solr_pipelined(Sound.objects.all(), slice_size=3, num_workers=2,
+                                                       checkpoint_path=self.checkpoint_path)
+        self.assertEqual(num_indexed, len(self.sound_ids))
+        indexed_ids = sorted(sid for call in index_sounds_slice.call_args_list for sid in call[0][0])
+        self.assertEqual(indexed_ids, self.sound_ids)
+        self.assertTrue(all(len(call[0][0]) <= 3 for call in index_sounds_slice.call_args_list))
+        # Checkpoint file is removed once indexing finishes
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    @mock.patch('utils.search.search_general._index_sounds_slice')
+    def test_resume_from_checkpoint(self, index_sounds_slice):
+        last_indexed_id = self.sound_ids[len(self.sound_ids) / 2]
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump({'last_indexed_id': last_indexed_id}, f)
+        num_indexed = add_all_sounds_to_solr_pipelined(Sound.objects.all(), slice_size=3, num_workers=2,
+                                                       checkpoint_path=self.checkpoint_path)
+        indexed_ids = sorted(sid for call in index_sounds_slice.call_args_list for sid in call[0][0])
+        self.assertEqual(indexed_ids, [sid for sid in self.sound_ids if sid > last_indexed_id])
+        self.assertEqual(num_indexed, len(indexed_ids))
+
+    @mock.patch('utils.search.search_general._index_sounds_slice')
+    def test_error_keeps_checkpoint(self, index_sounds_slice):
+        failing_id = self.sound_ids[4]
+
+        def index_slice(sound_ids, **kwargs):
+            if failing_id in sound_ids:
+                raise SolrException('Solr is down')
+        index_sounds_slice.side_effect = index_slice
+
+        with self.assertRaises(SolrException):
+            add_all_sounds_to_solr_pipelined(Sound.objects.all(), slice_size=3, num_workers=1,
+                                             checkpoint_path=self.checkpoint_path)
+        # With a single worker, slices are indexed in order so the checkpoint is the last id of the first slice
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f)['last_indexed_id'], self.sound_ids[2])
+
+
+class SolrJsonUpdateEncoderTest(SimpleTestCase):
+
+    def test_encode_values(self):
+        encoder = SolrJsonUpdateEncoder()
+        encoded = json.loads(encoder.encode([{
+            'id': 5,
+            'created': datetime.datetime(2020, 1, 2, 3, 4, 5),
+            'tag': ['dog', 'bark'],
+            'is_explicit': False,
+            'description': u'caf\xe9'
+        }]))
+        self.assertEqual(encoded, [{
+            'id': 5,
+            'created': '2020-01-02T03:04:05.000Z',
+            'tag': ['dog', 'bark'],
+            'is_explicit': False,
+            'description': u'caf\xe9'
+        }])
+
+    def test_encode_utf8_byte_strings(self):
+        encoder = SolrJsonUpdateEncoder()
+        encoded = json.loads(encoder.encode([{
+            'username': u'Jos\xe9'.encode('utf-8'),
+            'tag': [u'caf\xe9'.encode('utf-8'), 'dog'],
+            'num_downloads': {'set': 'caf\xc3\xa9'},
+        }]))
+        self.assertEqual(encoded, [{
+            'username': u'Jos\xe9',
+            'tag': [u'caf\xe9', u'dog'],
+            'num_downloads': {'set': u'caf\xe9'},
+        }])
+
+    def test_encode_non_finite_floats(self):
+        # NaN and infinite values are not valid JSON, they are left out (or removed in atomic updates)
+        encoder = SolrJsonUpdateEncoder()
+        message = encoder.encode([{
+            'id': 1,
+            'duration': float('nan'),
+            'ac_loudness': float('-inf'),
+            'ac_tempo': [120.0, float('inf')],
+            'avg_rating': {'set': float('nan')},
+        }])
+        self.assertEqual(json.loads(message), [{'id': 1, 'ac_tempo': [120.0], 'avg_rating': {'set': None}}])
+        self.assertNotIn('NaN', message)
+        self.assertNotIn('Infinity', message)
+
+    def test_encode_update(self):
+        encoder = SolrJsonUpdateEncoder()
+        message = encoder.encode_update(docs=[{'id': 1}, {'id': 2}], delete_ids=[1, 2, 3])
+        # Deletes go before adds and every document has its own "add" command
+        self.assertEqual(message, '{"delete": ["1", "2", "3"], "add": {"doc": {"id": 1}}, "add": {"doc": {"id": 2}}}')
+
+    @mock.patch('utils.search.solr.Solr._request')
+    def test_update_single_request(self, request):
+        Solr('http://fakehost:8080/fs2/', encoder=SolrJsonUpdateEncoder()).update(docs=[{'id': 1}], delete_ids=[1])
+        request.assert_called_once_with(message='{"delete": ["1"], "add": {"doc": {"id": 1}}}',
+                                        content_type='application/json')
+
+    @mock.patch('utils.search.solr.Solr._request')
+    def test_update_xml_encoder(self, request):
+        # The XML encoder can not combine deletes and adds, so two requests are made
+        Solr('http://fakehost:8080/fs2/').update(docs=[{'id': 1}], delete_ids=[1])
+        self.assertEqual(request.call_args_list, [
+            mock.call(message='<delete><id>1</id></delete>', content_type='text/xml'),
+            mock.call(message='<add><doc><field name="id">1</field></doc></add>', content_type='text/xml'),
+        ])
+
+
+class SolrIdSeekPagingTest(SimpleTestCase):
+
+    def test_set_id_seek_options(self):
+        query = SolrQuery()
+        query.set_query_options(start=4000, rows=15, sort=['created desc'], filter_query='tag:dog')
+        query.set_id_seek_options(after_id=1234, rows=100)
+        self.assertEqual(query.params['sort'], 'id asc')
+        self.assertEqual(query.params['start'], 0)
+        self.assertEqual(query.params['rows'], 100)
+        self.assertEqual(query.params['fq'], ['tag:dog', 'id:{1234 TO *]'])
+
+    def fake_select(self, all_ids, requested_queries):
+        def select(query_string):
+            requested_queries.append(query_string)
+            params = dict(urlparse.parse_qsl(query_string))
+            after_id = int(params['fq'].split('{')[1].split(' ')[0]) if 'fq' in params else 0
+            docs = [{'id': sid} for sid in all_ids if sid > after_id][:int(params['rows'])]
+            return {'response': {'docs': docs, 'numFound': len(all_ids), 'start': 0}, 'responseHeader': {'QTime': 1}}
+        return select
+
+    def test_iterate_ids(self):
+        all_ids = range(1, 26)
+        requested_queries = []
+        solr = Solr('http://fakehost:8080/fs2/')
+        with mock.patch.object(solr, 'select', side_effect=self.fake_select(all_ids, requested_queries)):
+            self.assertEqual(list(solr.iterate_ids(SolrQuery(), page_size=10)), all_ids)
+        # Three pages are requested, all of them starting at the first result
+        self.assertEqual(len(requested_queries), 3)
+        self.assertTrue(all('start=0' in query for query in requested_queries))
+
+    @mock.patch('utils.search.search_general.SOLR_IDS_PAGE_SIZE', 10)
+    def test_get_all_sound_ids_from_solr(self):
+        all_ids = range(1, 26)
+        requested_queries = []
+        with mock.patch('utils.search.solr.Solr.select', side_effect=self.fake_select(all_ids, requested_queries)):
+            self.assertEqual(get_all_sound_ids_from_solr(), all_ids)
+            self.assertEqual(len(requested_queries), 3)
+            self.assertEqual(get_all_sound_ids_from_solr(limit=5), all_ids[:5])
+
+
+class SoundIndexEventsTest(TestCase):
+
+    fixtures = ['licenses']
+
+    def setUp(self):
+        self.user, _, sounds = create_user_and_sounds(num_sounds=3, processing_state='OK', moderation_state='OK')
+        self.sound_ok1, self.sound_ok2, self.sound_not_ok = sounds
+        self.sound_not_ok.moderation_state = 'PE'
+        self.sound_not_ok.save()
+
+    @mock.patch('sounds.models.send_sound_index_event')
+    def test_download_sends_counter_event(self, send_sound_index_event):
+        Download.objects.create(user=self.user, sound=self.sound_ok1, license=self.sound_ok1.license)
+        send_sound_index_event.assert_called_once_with(self.sound_ok1.id, counter_fields=['num_downloads'])
+
+    @mock.patch('sounds.models.send_sound_index_event')
+    def test_mark_index_dirty_sends_full_event(self, send_sound_index_event):
+        self.sound_ok1.mark_index_dirty()
+        send_sound_index_event.assert_called_once_with(self.sound_ok1.id)
+
+    def test_add_comment_sends_event_after_save(self):
+        # The event must be sent once the new num_comments is saved, otherwise the worker could index the old value
+        num_comments = self.sound_ok1.num_comments
+        saved_num_comments = []
+        with mock.patch('sounds.models.send_sound_index_event', side_effect=lambda sound_id: saved_num_comments.append(
+                Sound.objects.get(id=sound_id).num_comments)) as send_sound_index_event:
+            self.sound_ok1.add_comment(self.user, 'Test comment')
+        send_sound_index_event.assert_called_once_with(self.sound_ok1.id)
+        self.assertEqual(saved_num_comments, [num_comments + 1])
+
+    @mock.patch('utils.search.search_general.bump_search_results_cache_generation')
+    @mock.patch('utils.search.search_general.delete_sounds_from_solr')
+    @mock.patch('utils.search.search_general._index_sounds_slice')
+    @mock.patch('utils.search.solr.Solr.add')
+    def test_update_sounds_in_solr(self, solr_add, index_sounds_slice, delete_sounds_from_solr,
+                                   bump_search_results_cache_generation):
+        num_indexed, num_counters_updated, num_deleted = update_sounds_in_solr(
+            full_update_ids={self.sound_ok1.id, self.sound_not_ok.id},
+            counter_updates={self.sound_ok1.id: {'num_downloads'}, self.sound_ok2.id: {'num_ratings', 'avg_rating'}})
+        self.assertEqual((num_indexed, num_counters_updated, num_deleted), (1, 1, 1))
+
+        # Only the sound without a full update gets an atomic update
+        solr_add.assert_called_once_with([{'id': self.sound_ok2.id, 'avg_rating': {'set': 0.0},
+                                           'num_ratings': {'set': 0}}])
+        # Counter updates change the sorting of search results, so cached results are invalidated
+        bump_search_results_cache_generation.assert_called_once_with()
+        index_sounds_slice.assert_called_once_with([self.sound_ok1.id], mark_index_clean=True,
+                                                   delete_if_existing=True)
+        # Sounds which are not moderated/processed OK are removed from the index
+        delete_sounds_from_solr.assert_called_once_with([self.sound_not_ok.id])
+
+    @mock.patch('utils.search.search_general._index_sounds_slice')
+    @mock.patch('utils.search.solr.Solr.add')
+    def test_update_sounds_in_solr_atomic_update_fails(self, solr_add, index_sounds_slice):
+        solr_add.side_effect = SolrException('Document is missing mandatory uniqueKey field')
+        num_indexed, num_counters_updated, _ = update_sounds_in_solr(
+            full_update_ids=set(), counter_updates={self.sound_ok2.id: {'num_downloads'}})
+        self.assertEqual((num_indexed, num_counters_updated), (1, 0))
+        index_sounds_slice.assert_called_once_with([self.sound_ok2.id], mark_index_clean=True,
+                                                   delete_if_existing=True)
+
+
+class SoundIndexEventsBufferTest(SimpleTestCase):
+
+    def test_coalesce_events(self):
+        events = SoundIndexEventsBuffer()
+        self.assertFalse(events.is_due(0))
+        events.add(1, ['num_downloads'])
+        events.add(1, ['num_downloads'])
+        events.add(1, ['avg_rating', 'num_ratings'])
+        events.add(2)
+        events.add(2, ['num_downloads'])
+        events.add(2)
+        self.assertEqual(len(events), 2)
+        self.assertTrue(events.is_due(0))
+        full_update_ids, counter_updates = events.flush()
+        self.assertEqual(full_update_ids, {2})
+        self.assertEqual(counter_updates, {1: {'num_downloads', 'avg_rating', 'num_ratings'}, 2: {'num_downloads'}})
+        self.assertEqual(len(events), 0)
+        self.assertFalse(events.is_due(0))
+
+
+class SearchResultsCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.solr_response = copy.deepcopy(solr_select_returned_data)
+
+    def test_cache_key_normalization(self):
+        query1 = SolrQuery()
+        query1.set_query('dogs')
+        query1.add_facet_fields('tag', 'username')
+        query2 = SolrQuery()
+        query2.add_facet_fields('tag', 'username')
+        query2.set_query('dogs')
+        self.assertEqual(get_search_results_cache_key(query1), get_search_results_cache_key(query2))
+        query2.set_query('cats')
+        self.assertNotEqual(get_search_results_cache_key(query1), get_search_results_cache_key(query2))
+
+    @mock.patch('utils.search.solr.Solr.select')
+    def test_perform_solr_query_is_cached(self, solr_select):
+        solr_select.side_effect = lambda *args, **kwargs: copy.deepcopy(self.solr_response)
+        query = search_prepare_query('dogs', '', ['score desc'], 1, 15, grouping=True)
+        results1 = perform_solr_query(query, 1)
+        results2 = perform_solr_query(query, 1)
+        self.assertEqual(solr_select.call_count, 1)
+        self.assertEqual(results1[0], results2[0])  # non grouped number of matches
+        self.assertEqual(results1[1], results2[1])  # facets
+
+        # Different page is a different query
+        perform_solr_query(search_prepare_query('dogs', '', ['score desc'], 2, 15, grouping=True), 2)
+        self.assertEqual(solr_select.call_count, 2)
+
+        # When the index changes, cached results are not used anymore
+        bump_search_results_cache_generation()
+        perform_solr_query(query, 1)
+        self.assertEqual(solr_select.call_count, 3)
+
+    @override_settings(SEARCH_RESULTS_CACHE_TIME=300, SEARCH_RESULTS_CACHE_VISIBILITY_DELAY=2)
+    @mock.patch('utils.search.search_cache.time.time')
+    def test_results_computed_before_changes_are_visible(self, time_time):
+        time_time.return_value = 1000.0
+        self.assertEqual(get_search_results_cache_timeout(), 300)
+
+        # Results computed right after the index changes are only cached until Solr makes the changes visible
+        bump_search_results_cache_generation()
+        time_time.return_value = 1000.5
+        self.assertEqual(get_search_results_cache_timeout(), 2)
+        time_time.return_value = 1002.5
+        self.assertEqual(get_search_results_cache_timeout(), 300)
+
+    @mock.patch('utils.search.solr.Solr.select')
+    def test_solr_errors_are_not_cached(self, solr_select):
+        solr_select.side_effect = SolrException('error')
+        query = search_prepare_query('dogs', '', ['score desc'], 1, 15)
+        for _ in range(2):
+            with self.assertRaises(SolrException):
+                perform_solr_query(query, 1)
+        self.assertEqual(solr_select.call_count, 2)
+
+    @mock.patch('utils.search.solr.Solr.select')
+    def test_facets_query_is_shared_by_pages(self, solr_select):
+        solr_select.side_effect = lambda *args, **kwargs: copy.deepcopy(self.solr_response)
+        facets_query = search_prepare_query('dogs', '', None, 1, 0)
+        for page in [1, 2, 3]:
+            query = search_prepare_query('dogs', '', ['score desc'], page, 15, grouping=True, include_facets=False)
+            _, facets, _, _, _ = perform_solr_query(query, page, facets_query=facets_query)
+            self.assertIn('bitrate', facets)
+        # One query for each page plus a single facets query
+        self.assertEqual(solr_select.call_count, 4)
@@ -32,8 +32,10 @@ import sounds
 import forum
 from utils.frontend_handling import render
 from utils.logging_filters import get_client_ip
+from utils.search.search_cache import get_cached_search_results
 from utils.search.solr import Solr, SolrQuery, SolrResponseInterpreter, \
     SolrResponseInterpreterPaginator, SolrException
+from utils.sound_loader import get_sound_loader
 
 search_logger = logging.getLogger("search")
 
@@ -139,16 +141,52 @@ def search_prepare_query(search_query,
     return query
 
 
-def perform_solr_query(q, current_page):
+def search_prepare_facets_query(search_query,
+                                filter_query,
+                                id_weight=settings.DEFAULT_SEARCH_WEIGHTS['id'],
+                                tag_weight=settings.DEFAULT_SEARCH_WEIGHTS['tag'],
+                                description_weight=settings.DEFAULT_SEARCH_WEIGHTS['description'],
+                                username_weight=settings.DEFAULT_SEARCH_WEIGHTS['username'],
+                                pack_tokenized_weight=settings.DEFAULT_SEARCH_WEIGHTS['pack_tokenized'],
+                                original_filename_weight=settings.DEFAULT_SEARCH_WEIGHTS['original_filename']):
+    """
+    Prepares the query used to compute the facets of a search (see perform_solr_query). It returns no documents and
+    does not depend on the page, sorting or grouping options, so its results are shared by all pages of the search.
+    """
+    return search_prepare_query(search_query,
+                                filter_query,
+                                None,
+                                1,
+                                0,
+                                id_weight,
+                                tag_weight,
+                                description_weight,
+                                username_weight,
+                                pack_tokenized_weight,
+                                original_filename_weight)
+
+
+def perform_solr_query(q, current_page, facets_query=None):
     """
     This util function performs the query to Solr and returns needed parameters to continue with the view.
     The main reason to have this util function is to facilitate mocking in unit tests for this view.
+    Results are cached (see utils.search.search_cache) so repeated queries do not reach Solr until the index changes.
+    If facets_query is given, facets are taken from the results of that query instead of from the results of q. This
+    allows q to be a facet-free query, and as facets_query does not depend on the page being requested, facets are
+    only computed once for all pages of the same search.
     """
-    solr = Solr(settings.SOLR_URL)
-    results = SolrResponseInterpreter(solr.select(unicode(q)))
+    def compute_results(query):
+        solr = Solr(settings.SOLR_URL)
+        return SolrResponseInterpreter(solr.select(unicode(query)))
+
+    results = get_cached_search_results(q, lambda: compute_results(q))
+    if facets_query is not None:
+        facets = get_cached_search_results(facets_query, lambda: compute_results(facets_query)).facets
+    else:
+        facets = results.facets
     paginator = SolrResponseInterpreterPaginator(results, settings.SOUNDS_PER_PAGE)
     page = paginator.page(current_page)
-    return results.non_grouped_number_of_matches, results.facets, paginator, page, results.docs
+    return results.non_grouped_number_of_matches, facets, paginator, page, results.docs
 
 
 def search(request):
@@ -271,8 +309,22 @@ def search(request):
                                  username_weight,
                                  pack_tokenized_weight,
                                  original_filename_weight,
-                                 grouping=grouping
+                                 grouping=grouping,
+                                 include_facets=False
                                  )
+    # Facets are computed with a separate query which returns no documents and does not depend on the page, sorting
+    # or grouping options so it can be cached and reused for all the pages of the same search. Facets are not
+    # displayed in AJAX results so we don't need to compute them in that case.
+    facets_query = None
+    if request.GET.get("ajax", "") != "1":
+        facets_query = search_prepare_facets_query(search_query,
+                                                   filter_query,
+                                                   id_weight,
+                                                   tag_weight,
+                                                   description_weight,
+                                                   username_weight,
+                                                   pack_tokenized_weight,
+                                                   original_filename_weight)
     tvars = {
         'error_text': None,
         'filter_query': filter_query,
@@ -289,9 +341,12 @@ def search(request):
         tvars.update(advanced_search_params_dict)
 
     try:
-        non_grouped_number_of_results, facets, paginator, page, docs = perform_solr_query(query, current_page)
+        non_grouped_number_of_results, facets, paginator, page, docs = \
+            perform_solr_query(query, current_page, facets_query=facets_query)
         resultids = [d.get("id") for d in docs]
         resultsounds = sounds.models.Sound.objects.bulk_query_id(resultids)
+        # Results are displayed by ID in search_ajax.html, add them to the loader so that they are not loaded again
+        get_sound_loader(request).add_sounds(resultsounds)
         allsounds = {}
         for s in resultsounds:
             allsounds[s.id] = s
@@ -0,0 +1,138 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger('similarity')
+
+# Maximum number of elements of the distance matrices computed at once when assigning points to lists
+ASSIGN_CHUNK_SIZE = 10 ** 7
+
+
+class IVFIndex(object):
+    """
+    Inverted file index for approximate nearest neighbour search. Points are clustered with k-means and every point
+    is stored in the list of its nearest centroid. A query only computes distances to the points in the lists of its
+    num_probes nearest centroids, so num_probes sets the trade-off between recall and query time.
+    Lists store row numbers of the matrix the index was built from, the index does not keep a copy of the vectors.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows):
+        self.centroids = centroids
+        self.centroids_squared_norms = np.einsum('ij,ij->i', centroids, centroids)
+        # Rows of list i are list_rows[list_offsets[i]:list_offsets[i + 1]]
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def num_lists(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, vectors, num_lists=None, num_iterations=10, sample_size=100000, seed=0):
+        """
+        Builds the index running k-means on a sample of the vectors and assigning all vectors to their nearest
+        centroid. By default the number of lists is 4 * sqrt(number of vectors).
+        """
+        random_state = np.random.RandomState(seed)
+        if num_lists is None:
+            num_lists = int(4 * np.sqrt(len(vectors)))
+        num_lists = max(1, min(num_lists, len(vectors)))
+        sample = vectors[np.sort(random_state.choice(len(vectors), min(sample_size, len(vectors)), replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        centroids = sample[random_state.choice(len(sample), num_lists, replace=False)].copy()
+        for iteration in range(num_iterations):
+            assignments = cls._nearest_centroids(sample, centroids)
+            counts = np.bincount(assignments, minlength=num_lists)
+            non_empty = counts > 0
+            # Sum the points of every list at once by sorting them by list
+            order = np.argsort(assignments, kind='mergesort')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[non_empty] = sums / counts[non_empty][:, np.newaxis]
+            # Move centroids of empty lists to random points so that all lists are used
+            empty = np.flatnonzero(~non_empty)
+            if len(empty):
+                centroids[empty] = sample[random_state.choice(len(sample), len(empty), replace=False)]
+            logger.info('k-means iteration %i of %i (%i empty lists)' % (iteration + 1, num_iterations, len(empty)))
+
+        index = cls(centroids, np.zeros(num_lists + 1, dtype=np.int64), np.array([], dtype=np.int64))
+        index.assign_all(vectors)
+        return index
+
+    @staticmethod
+    def _nearest_centroids(vectors, centroids, centroids_squared_norms=None):
+        if centroids_squared_norms is None:
+            centroids_squared_norms = np.einsum('ij,ij->i', centroids, centroids)
+        chunk_size = max(1, ASSIGN_CHUNK_SIZE // len(centroids))
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            # Squared norms of the vectors don't change the nearest centroid
+            distances = centroids_squared_norms[np.newaxis, :] - 2 * np.dot(chunk, centroids.T)
+            assignments[start:start + chunk_size] = np.argmin(distances, axis=1)
+        return assignments
+
+    def assign_all(self, vectors):
+        """
+        Replaces the contents of the lists with the rows of the given matrix, keeping the current centroids. This is
+        used to update the index when the matrix changes (e.g. when saving an index with new and deleted points).
+        """
+        assignments = self._nearest_centroids(vectors, self.centroids, self.centroids_squared_norms)
+        self.list_rows = np.argsort(assignments, kind='mergesort').astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.num_lists))])\
+            .astype(np.int64)
+
+    def reassigned(self, vectors):
+        """
+        Returns a new index with the same centroids and the rows of the given matrix in its lists. Unlike assign_all,
+        this index is not modified, so it can still be used with the matrix it was built from.
+        """
+        index = IVFIndex(self.centroids, self.list_offsets, self.list_rows)
+        index.assign_all(vectors)
+        return index
+
+    def candidates(self, query, num_probes):
+        """
+        Returns the rows stored in the lists of the num_probes centroids nearest to the query.
+        """
+        num_probes = min(num_probes, self.num_lists)
+        distances = self.centroids_squared_norms - 2 * np.dot(self.centroids, query)
+        probes = np.argpartition(distances, num_probes - 1)[:num_probes]
+        return np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probes])
+
+    def save(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'list_offsets.npy'), self.list_offsets)
+        np.save(os.path.join(path, 'list_rows.npy'), self.list_rows)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(os.path.join(path, 'centroids.npy')):
+            return None
+        return cls(np.load(os.path.join(path, 'centroids.npy')),
+                   np.load(os.path.join(path, 'list_offsets.npy')),
+                   np.load(os.path.join(path, 'list_rows.npy'), mmap_mode='r'))
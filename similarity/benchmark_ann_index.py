@@ -0,0 +1,101 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+"""
+Measures recall@k and queries per second of the IVF index for several numbers of probes (see SIMILARITY_ANN_NUM_PROBES
+setting) compared with exact search. Uses the PCA vectors of the numpy similarity index, or random clustered points:
+
+    python benchmark_ann_index.py --probes 1,4,16,64
+    python benchmark_ann_index.py --synthetic 1000000 --dimensions 100
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import similarity_settings as sim_settings
+from ann_index import IVFIndex
+from numpy_wrapper import nearest_neighbours
+
+
+def load_pca_vectors():
+    path = os.path.join(sim_settings.INDEX_DIR, sim_settings.INDEX_NAME + '_numpy', 'pca.npy')
+    return np.load(path, mmap_mode='r')
+
+
+def synthetic_vectors(num_points, dimensions, num_clusters=1000, seed=0):
+    random_state = np.random.RandomState(seed)
+    centers = random_state.randn(num_clusters, dimensions).astype(np.float32)
+    vectors = centers[random_state.randint(num_clusters, size=num_points)]
+    return vectors + 0.5 * random_state.randn(num_points, dimensions).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the IVF index against exact search.')
+    parser.add_argument('--probes', default='1,2,4,8,16,32,64', help='Comma separated numbers of probes to test.')
+    parser.add_argument('--num-lists', type=int, default=None, help='Number of IVF lists.')
+    parser.add_argument('--num-queries', type=int, default=200, help='Number of queries.')
+    parser.add_argument('-k', type=int, default=15, help='Number of results per query.')
+    parser.add_argument('--synthetic', type=int, default=None, help='Use this number of random points.')
+    parser.add_argument('--dimensions', type=int, default=sim_settings.PCA_DIMENSIONS,
+                        help='Dimensions of the random points.')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dimensions)
+    else:
+        vectors = np.asarray(load_pca_vectors())
+    squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+    queries = vectors[np.random.RandomState(1).choice(len(vectors), args.num_queries, replace=False)]
+    print('%i points with %i dimensions, %i queries, k=%i' % (vectors.shape[0], vectors.shape[1], len(queries), args.k))
+
+    start = time.time()
+    index = IVFIndex.build(vectors, num_lists=args.num_lists)
+    print('Built IVF index with %i lists in %.1f seconds\n' % (index.num_lists, time.time() - start))
+
+    start = time.time()
+    exact = [set(nearest_neighbours(vectors, query, args.k, squared_norms=squared_norms)[0][0].tolist())
+             for query in queries]
+    elapsed = time.time() - start
+    print('%-12s %10s %12s %12s %14s' % ('probes', 'recall@%i' % args.k, 'ms/query', 'queries/s', 'candidates'))
+    print('%-12s %10.3f %12.2f %12.1f %14i' % ('exact', 1.0, 1000.0 * elapsed / len(queries), len(queries) / elapsed,
+                                                len(vectors)))
+
+    for num_probes in [int(probes) for probes in args.probes.split(',')]:
+        recalls = []
+        num_candidates = 0
+        start = time.time()
+        for query, exact_rows in zip(queries, exact):
+            candidates = np.sort(index.candidates(query, num_probes))
+            rows, _ = nearest_neighbours(vectors[candidates], query, args.k,
+                                         squared_norms=squared_norms[candidates])[0]
+            recalls.append(len(exact_rows.intersection(candidates[rows].tolist())) / float(len(exact_rows)))
+            num_candidates += len(candidates)
+        elapsed = time.time() - start
+        print('%-12i %10.3f %12.2f %12.1f %14i' % (num_probes, np.mean(recalls), 1000.0 * elapsed / len(queries),
+                                                    len(queries) / elapsed, num_candidates / len(queries)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+"""
+Compares query latency of the similarity backends (see SIMILARITY_BACKEND setting) using the configured index.
+
+    python benchmark_similarity_backends.py --backends gaia,numpy --num-queries 200
+    python benchmark_similarity_backends.py --export-gaia-index   # creates the numpy index from the gaia index
+
+When both backends are benchmarked, the overlap between the results of the numpy backend and gaia is also reported.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from similarity_server_utils import get_wrapper_class, parse_filter
+
+
+def export_gaia_index():
+    """
+    Creates the numpy index from the existing gaia index (raw descriptor values of all points).
+    """
+    gaia = get_wrapper_class('gaia')()
+    numpy_wrapper = get_wrapper_class('numpy')()
+    point_names = gaia.get_all_point_names()['result']
+    start = time.time()
+    for count, point_name in enumerate(point_names):
+        descriptors = gaia.get_sounds_descriptors([str(point_name)], normalization=False)['result']
+        if str(point_name) in descriptors:
+            numpy_wrapper.add_point_descriptors(descriptors[str(point_name)], point_name)
+        if count % 10000 == 0:
+            print('Exported %i of %i points (%.1f seconds)' % (count, len(point_names), time.time() - start))
+    numpy_wrapper.save_index()
+    print('Exported %i points in %.1f seconds' % (len(point_names), time.time() - start))
+
+
+def benchmark(name, function, arguments, num_queries=None):
+    num_queries = num_queries or len(arguments)
+    start = time.time()
+    results = [function(*args) for args in arguments]
+    elapsed = time.time() - start
+    print('%-40s %8.2f ms/query %10.1f queries/s' % (name, 1000.0 * elapsed / num_queries, num_queries / elapsed))
+    return results
+
+
+def result_ids(result, num_results):
+    return [item[0] for item in result['result']['results'][:num_results]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark similarity backends.')
+    parser.add_argument('--backends', default='gaia,numpy', help='Comma separated list of backends to compare.')
+    parser.add_argument('--num-queries', type=int, default=100, help='Number of queries of every type.')
+    parser.add_argument('--num-results', type=int, default=15, help='Number of results per query.')
+    parser.add_argument('--filter', default='.lowlevel.pitch.mean:[100 TO 300]',
+                        help='Filter used for the content search queries.')
+    parser.add_argument('--export-gaia-index', action='store_true',
+                        help='Create the numpy index from the gaia index instead of running the benchmark.')
+    args = parser.parse_args()
+
+    if args.export_gaia_index:
+        export_gaia_index()
+        return
+
+    all_results = dict()
+    point_names = None
+    for backend in args.backends.split(','):
+        start = time.time()
+        wrapper = get_wrapper_class(backend)()
+        print('\nLoaded %s index with %i points in %.2f seconds' % (backend, len(
+            wrapper.get_all_point_names()['result']), time.time() - start))
+        if point_names is None:
+            # Use the same query points for all backends
+            random.seed(0)
+            point_names = [str(name) for name in random.sample(wrapper.get_all_point_names()['result'],
+                                                               args.num_queries)]
+        filter_struct = parse_filter(args.filter, wrapper.descriptor_names['fixed-length'])
+
+        all_results[backend] = {
+            'similar sounds': benchmark(
+                '%s similar sounds' % backend, wrapper.search_dataset,
+                [(name, args.num_results, 'pca') for name in point_names]),
+            'target and filter': benchmark(
+                '%s target and filter' % backend, wrapper.api_search,
+                [('sound_id', name, filter_struct, 'pca', None, args.num_results, 0, None) for name in point_names]),
+            'in_ids': benchmark(
+                '%s target and in_ids' % backend, wrapper.api_search,
+                [('sound_id', name, None, 'pca', None, args.num_results, 0, point_names) for name in point_names]),
+        }
+        if hasattr(wrapper, 'search_dataset_batch'):
+            benchmark('%s similar sounds (batch)' % backend,
+                      lambda names: wrapper.search_dataset_batch(names, args.num_results), [(point_names, )],
+                      num_queries=len(point_names))
+
+    if 'gaia' in all_results and 'numpy' in all_results:
+        print('\nOverlap of numpy and gaia results (top %i):' % args.num_results)
+        for query_type in all_results['gaia'].keys():
+            overlaps = []
+            for gaia_result, numpy_result in zip(all_results['gaia'][query_type], all_results['numpy'][query_type]):
+                if gaia_result['error'] or numpy_result['error']:
+                    continue
+                gaia_ids = set(result_ids(gaia_result, args.num_results))
+                if gaia_ids:
+                    overlaps.append(len(gaia_ids.intersection(result_ids(numpy_result, args.num_results))) /
+                                    float(len(gaia_ids)))
+            if overlaps:
+                print('%-40s %8.3f' % (query_type, sum(overlaps) / len(overlaps)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+"""
+Builds the IVF index used for approximate similarity search from the files of the numpy similarity index (see
+SIMILARITY_BACKEND setting) and saves it next to them:
+
+    python build_ann_index.py --num-lists 4000
+
+Run it while the similarity server is not saving the index (e.g. on a copy of the index which is then deployed) and
+reload the similarity server afterwards. New and deleted points are handled incrementally by the server, so the IVF
+index only needs to be rebuilt when the distribution of the points changes significantly.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+
+from numpy_wrapper import NumpyWrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the IVF index of the numpy similarity index.')
+    parser.add_argument('--num-lists', type=int, default=None,
+                        help='Number of IVF lists (by default 4 * sqrt(number of points)).')
+    parser.add_argument('--num-iterations', type=int, default=10, help='Number of k-means iterations.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = NumpyWrapper().build_ann_index(num_lists=args.num_lists, num_iterations=args.num_iterations)
+    print(result['result'])
+
+
+if __name__ == '__main__':
+    main()
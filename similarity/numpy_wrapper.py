@@ -0,0 +1,934 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import time
+from numbers import Number
+
+import numpy as np
+import yaml
+
+import similarity_settings as sim_settings
+from ann_index import IVFIndex
+from similarity_server_utils import generate_structured_dict_from_layout, get_nested_dictionary_value, \
+    get_nested_descriptor_names, set_nested_dictionary_value
+
+logger = logging.getLogger('similarity')
+
+# Number of points used to decide which descriptors have a fixed length (and can be stored in the descriptors matrix)
+LAYOUT_SAMPLE_SIZE = 100
+
+
+def flatten_descriptors(data, prefix=''):
+    """
+    Converts the nested dictionary of an analysis file into a flat dictionary with gaia-like descriptor names as keys
+    (e.g. {'lowlevel': {'pitch': {'mean': 220.0}}} -> {'.lowlevel.pitch.mean': 220.0}).
+    """
+    flat = dict()
+    for key, value in data.items():
+        name = '%s.%s' % (prefix, key)
+        if isinstance(value, dict):
+            flat.update(flatten_descriptors(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def descriptor_length(value):
+    """
+    Returns the length of a numerical descriptor value (1 for numbers and the number of elements for lists of numbers),
+    or None if the value is not numerical (e.g. strings or lists of strings).
+    """
+    if isinstance(value, Number) and not isinstance(value, bool):
+        return 1
+    if isinstance(value, list) and value and all(isinstance(v, Number) and not isinstance(v, bool) for v in value):
+        return len(value)
+    return None
+
+
+def nearest_neighbours(matrix, queries, num_results, offset=0, mask=None, squared_norms=None):
+    """
+    Vectorized euclidean nearest neighbour search of several query points at once.
+    :param np.ndarray matrix: (N, D) matrix with one point per row.
+    :param np.ndarray queries: (Q, D) matrix with one query point per row.
+    :param int num_results: number of results to return for every query.
+    :param int offset: number of results to skip (for pagination).
+    :param np.ndarray mask: optional boolean array of length N, only points where mask is True are considered.
+    :param np.ndarray squared_norms: optional precomputed squared norms of the rows of matrix.
+    :return: list with a (row indices, distances) tuple of arrays for every query, sorted by distance.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if squared_norms is None:
+        squared_norms = np.einsum('ij,ij->i', matrix, matrix)
+    # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, computed for all points and queries with a single matrix product
+    squared_distances = squared_norms[np.newaxis, :] - 2 * np.dot(queries, matrix.T) + \
+        np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+    np.maximum(squared_distances, 0, out=squared_distances)
+    if mask is not None:
+        squared_distances[:, ~mask] = np.inf
+        num_candidates = int(mask.sum())
+    else:
+        num_candidates = matrix.shape[0]
+
+    end = min(offset + num_results, num_candidates)
+    results = []
+    for row in squared_distances:
+        if end <= offset:
+            results.append((np.array([], dtype=np.int64), np.array([], dtype=np.float32)))
+            continue
+        if end < len(row):
+            # Only sort the candidates which can be in the requested page
+            candidates = np.argpartition(row, end - 1)[:end]
+        else:
+            candidates = np.arange(len(row))
+        candidates = candidates[np.lexsort((candidates, row[candidates]))][offset:end]
+        results.append((candidates, np.sqrt(row[candidates])))
+    return results
+
+
+class AppendableArray(object):
+    """
+    Numpy array to which rows can be appended in amortized constant time. Rows are written to a buffer whose capacity
+    is doubled when it is full, and the array is a view of the rows written so far. The given array is used as the
+    initial buffer (it is not copied).
+    """
+
+    def __init__(self, array):
+        self.buffer = np.asarray(array)
+        self.size = len(self.buffer)
+
+    @property
+    def array(self):
+        return self.buffer[:self.size]
+
+    def append(self, row):
+        if self.size == len(self.buffer):
+            buffer = np.empty((max(2 * self.size, 16),) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+            buffer[:self.size] = self.buffer
+            self.buffer = buffer
+        self.buffer[self.size] = row
+        self.size += 1
+
+
+class NumpyWrapper(object):
+    """
+    Similarity index with the same interface as GaiaWrapper (see SIMILARITY_BACKEND setting) which stores descriptors
+    and PCA vectors in float32 numpy matrices which are memory-mapped from disk. Raw descriptor values are stored and
+    normalization (min-max scaling as done with gaia) is applied to the columns needed for every query. Points
+    added or deleted after the index is loaded are kept in memory until save_index is called, when a new version of the
+    matrices is written to disk. Caches of the matrices with all the points are updated incrementally when points are
+    added (or deleted from the stored points), so that adding a point does not take time proportional to the size of
+    the index.
+    Only fixed-length descriptors (numerical or string labels) are stored, so variable-length descriptors can't be
+    returned by get_sounds_descriptors.
+    If an IVF index has been built (see build_ann_index), similarity searches in the PCA space are approximate and
+    only compute distances to the points of the IVF lists nearest to the query (see SIMILARITY_ANN_NUM_PROBES).
+    """
+
+    def __init__(self, indexing_only_mode=False):
+        self.indexing_only_mode = indexing_only_mode
+        if not self.indexing_only_mode:
+            self.index_path = self.__get_index_path(sim_settings.INDEX_NAME)
+        else:
+            self.index_path = self.__get_index_path(sim_settings.INDEXING_SERVER_INDEX_NAME)
+        self.descriptor_names = {'all': [], 'fixed-length': [], 'variable-length': [], 'multidimensional': []}
+        self.layout = None  # list of (descriptor name, first column, length) of numerical fixed-length descriptors
+        self.label_names = []
+        self.coeffs = None  # normalization coefficients, same format as gaia's ({name: {'a': [...], 'b': [...]}})
+        self.pca_columns = None
+        self.pca_mean = None
+        self.pca_components = None
+        self.ann = None  # IVFIndex over the PCA vectors of the stored points
+
+        # Points stored on disk (memory-mapped) and points added since the index was loaded
+        self.ids = np.array([], dtype=np.int64)
+        self.descriptors = None
+        self.labels = None
+        self.pca = None
+        self.deleted = np.array([], dtype=bool)
+        self.num_deleted = 0
+        self.pending = []  # list of (id, descriptors row, labels row) tuples
+        self.sample_points = []  # list of (id, flat descriptors) tuples used to decide the layout
+        self.columns = {}
+        self.__invalidate_caches()
+
+        self.__load_index()
+
+    def __get_index_path(self, index_name):
+        return os.path.join(sim_settings.INDEX_DIR, index_name + '_numpy')
+
+    # INDEX STORAGE
+
+    def __load_index(self):
+        if not os.path.exists(sim_settings.INDEX_DIR):
+            os.makedirs(sim_settings.INDEX_DIR)
+        metadata_path = os.path.join(self.index_path, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            logger.info('Created new numpy index, size: 0 points')
+            return
+
+        metadata = json.load(open(metadata_path))
+        self.layout = [tuple(item) for item in metadata['layout']]
+        self.label_names = metadata['label_names']
+        self.coeffs = metadata['coeffs']
+        self.__calculate_descriptor_names(metadata['variable_length_names'])
+
+        def load(name):
+            path = os.path.join(self.index_path, name + '.npy')
+            if os.path.exists(path):
+                return np.load(path, mmap_mode='r')
+            return None
+
+        self.ids = np.array(load('ids'))
+        self.descriptors = load('descriptors')
+        self.labels = np.array(load('labels')) if self.label_names else None
+        self.pca = load('pca')
+        if self.pca is not None:
+            self.pca_columns = np.array(load('pca_columns'))
+            self.pca_mean = np.array(load('pca_mean'))
+            self.pca_components = np.array(load('pca_components'))
+            self.ann = IVFIndex.load(os.path.join(self.index_path, 'ann'))
+            if self.ann is not None and self.ann.list_offsets[-1] != len(self.ids):
+                logger.info('Ignoring IVF index as it does not match the stored points, rebuild it with '
+                            'build_ann_index.py')
+                self.ann = None
+        else:
+            self.ann = None
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+        self.num_deleted = 0
+        self.__invalidate_caches()
+
+        if self.size() >= sim_settings.SIMILARITY_MINIMUM_POINTS and not self.indexing_only_mode \
+                and self.pca is None:
+            # Index was created by the indexing server, compute normalization and PCA now
+            self.__prepare_index()
+        logger.info('Numpy index loaded, size: %i points (%i fixed-length desc., %i variable-length desc.)' %
+                    (self.size(), len(self.descriptor_names['fixed-length']),
+                     len(self.descriptor_names['variable-length'])))
+
+    def save_index(self, filename=None, msg=""):
+        tic = time.time()
+        path = self.index_path
+        if filename:
+            path = self.__get_index_path(filename)
+        logger.info('Saving index to (%s)...' % path + msg)
+        if self.layout is None:
+            self.__freeze_layout()
+
+        # Write all files to a temporary directory and replace the old index once everything has been written
+        ids, descriptors, labels, pca = self.__get_all_points()
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'ids.npy'), ids)
+        np.save(os.path.join(tmp_path, 'descriptors.npy'), descriptors)
+        if self.label_names:
+            np.save(os.path.join(tmp_path, 'labels.npy'), labels)
+        if pca is not None:
+            np.save(os.path.join(tmp_path, 'pca.npy'), pca)
+            np.save(os.path.join(tmp_path, 'pca_columns.npy'), self.pca_columns)
+            np.save(os.path.join(tmp_path, 'pca_mean.npy'), self.pca_mean)
+            np.save(os.path.join(tmp_path, 'pca_components.npy'), self.pca_components)
+            if self.ann is not None:
+                # Keep the IVF centroids and put new points in their lists (deleted points are not saved). Lists are
+                # assigned in a copy of the index because the saved rows are numbered differently than the rows of the
+                # loaded matrices, which are still used if the index is saved to another path
+                self.ann.reassigned(pca).save(os.path.join(tmp_path, 'ann'))
+        json.dump({'layout': self.layout,
+                   'label_names': self.label_names,
+                   'variable_length_names': self.descriptor_names['variable-length'],
+                   'coeffs': self.coeffs}, open(os.path.join(tmp_path, 'metadata.json'), 'w'))
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        if path == self.index_path:
+            # Reload so that the saved matrices are memory-mapped and pending points are released
+            self.pending = []
+            self.__load_index()
+        toc = time.time()
+        logger.info('Finished saving index (done in %.2f seconds, index has now %i points).' %
+                    ((toc - tic), self.size()))
+        return {'error': False, 'result': path}
+
+    def __get_all_points(self):
+        """
+        Returns ids, descriptors, labels and pca matrices with all the points of the index (stored and pending).
+        """
+        keep = ~self.deleted
+        num_columns = self.__num_columns()
+        ids = [self.ids[keep]]
+        descriptors = [np.asarray(self.descriptors[keep]) if self.descriptors is not None
+                       else np.zeros((0, num_columns), dtype=np.float32)]
+        labels = [np.asarray(self.labels[keep]) if self.labels is not None
+                  else np.zeros((0, len(self.label_names)), dtype=np.unicode_)]
+        if self.pending:
+            ids.append(np.array([item[0] for item in self.pending], dtype=np.int64))
+            descriptors.append(np.array([item[1] for item in self.pending], dtype=np.float32))
+            labels.append(np.array([item[2] for item in self.pending], dtype=np.unicode_))
+        pca = None
+        if self.pca_components is not None:
+            pca = self.__get_pca_matrix()[self.__get_valid_rows()]
+        return np.concatenate(ids), np.concatenate(descriptors).astype(np.float32), \
+            np.concatenate(labels) if self.label_names else None, pca
+
+    # LAYOUT, NORMALIZATION AND PCA
+
+    def __num_columns(self):
+        if not self.layout:
+            return 0
+        return self.layout[-1][1] + self.layout[-1][2]
+
+    def __freeze_layout(self):
+        """
+        Decides which descriptors are stored using the points added so far: numerical descriptors which have the same
+        length in all points are stored in the descriptors matrix, string descriptors are stored as labels and the
+        rest are considered variable-length descriptors.
+        """
+        lengths = dict()
+        label_names = set()
+        all_names = set()
+        counts = dict()
+        for _, flat in self.sample_points:
+            for name, value in flat.items():
+                all_names.add(name)
+                counts[name] = counts.get(name, 0) + 1
+                lengths.setdefault(name, set()).add(descriptor_length(value))
+                if isinstance(value, basestring):
+                    label_names.add(name)
+        # Descriptors must be present in all points
+        fixed_numerical_names = sorted([name for name, name_lengths in lengths.items()
+                                        if len(name_lengths) == 1 and None not in name_lengths
+                                        and counts[name] == len(self.sample_points)])
+        self.label_names = sorted([name for name in label_names if counts[name] == len(self.sample_points) and all(
+            isinstance(flat[name], basestring) for _, flat in self.sample_points)])
+        self.layout = []
+        column = 0
+        for name in fixed_numerical_names:
+            length = list(lengths[name])[0]
+            self.layout.append((name, column, length))
+            column += length
+        self.__calculate_descriptor_names(
+            sorted(all_names.difference(fixed_numerical_names).difference(self.label_names)))
+        self.__invalidate_caches()
+
+        sample_points = self.sample_points
+        self.sample_points = []
+        for point_id, flat in sample_points:
+            self.__add_flat_point(point_id, flat)
+
+    def __calculate_descriptor_names(self, variable_length_names):
+        fixed_length_names = sorted([name for name, _, _ in self.layout] + self.label_names)
+        self.descriptor_names = {'all': sorted(fixed_length_names + variable_length_names),
+                                 'fixed-length': fixed_length_names,
+                                 'variable-length': variable_length_names,
+                                 'multidimensional': [name for name, _, length in self.layout if length > 1]}
+        self.columns = dict([(name, (start, length)) for name, start, length in self.layout])
+
+    def __prepare_index(self):
+        """
+        Computes the normalization coefficients (min-max scaling of every dimension, like gaia's 'normalize' transform)
+        and the PCA transformation of the normalized PCA_DESCRIPTORS, and projects all points to the PCA space.
+        """
+        logger.info('Computing normalization and PCA of the numpy index.')
+        _, descriptors, _, _ = self.__get_all_points()
+        min_values = descriptors.min(axis=0)
+        ranges = descriptors.max(axis=0) - min_values
+        ranges[ranges == 0] = 1.0
+        a = (1.0 / ranges).astype(np.float32)
+        b = (-min_values * a).astype(np.float32)
+        self.coeffs = dict([(name, {'a': a[start:start + length].tolist(), 'b': b[start:start + length].tolist()})
+                            for name, start, length in self.layout])
+        self.__invalidate_caches()
+
+        self.pca_columns = self.__get_preset_columns('lowlevel', patterns=sim_settings.PCA_DESCRIPTORS)
+        normalized = descriptors[:, self.pca_columns] * a[self.pca_columns] + b[self.pca_columns]
+        self.pca_mean = normalized.mean(axis=0)
+        # Principal components are the right singular vectors of the centered data
+        _, _, components = np.linalg.svd(normalized - self.pca_mean, full_matrices=False)
+        self.pca_components = components[:sim_settings.PCA_DIMENSIONS].astype(np.float32)
+        # PCA vectors of all points will be computed from the descriptors when needed
+        self.pca = None
+        self.ann = None
+        self.__invalidate_caches()
+
+    def build_ann_index(self, num_lists=None, num_iterations=10):
+        """
+        Builds the IVF index used for approximate similarity search in the PCA space from all the points of the index
+        and saves the index. Points added or deleted afterwards are handled incrementally: new points are always
+        compared with the query until the next save_index, when they are assigned to the list of their nearest
+        centroid, and deleted points are excluded from the results. Centroids are only recomputed when the IVF index
+        is built again.
+        """
+        if self.pca_components is None:
+            return {'error': True, 'result': 'Can\'t build the IVF index before PCA has been computed.',
+                    'status_code': sim_settings.SERVER_ERROR_CODE}
+        tic = time.time()
+        pca = self.__get_pca_matrix()[self.__get_valid_rows()]
+        self.ann = IVFIndex.build(pca, num_lists=num_lists, num_iterations=num_iterations)
+        logger.info('Built IVF index with %i lists for %i points (done in %.2f seconds).' %
+                    (self.ann.num_lists, len(pca), time.time() - tic))
+        return self.save_index(msg=' (with new IVF index)')
+
+    def __project_pca(self, normalized_pca_descriptors):
+        return np.dot(normalized_pca_descriptors - self.pca_mean, self.pca_components.T).astype(np.float32)
+
+    def __normalization_arrays(self):
+        if self._normalization is None:
+            a = np.ones(self.__num_columns(), dtype=np.float32)
+            b = np.zeros(self.__num_columns(), dtype=np.float32)
+            if self.coeffs:
+                for name, start, length in self.layout:
+                    a[start:start + length] = self.coeffs[name]['a']
+                    b[start:start + length] = self.coeffs[name]['b']
+            self._normalization = (a, b)
+        return self._normalization
+
+    def __get_preset_columns(self, preset_name, patterns=None):
+        if patterns is None:
+            preset_file = yaml.safe_load(open(sim_settings.PRESET_DIR + preset_name + ".yaml"))
+            patterns = preset_file['distance']['parameters']['descriptorNames']
+        columns = []
+        for name, start, length in self.layout:
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                columns += range(start, start + length)
+        return np.array(columns, dtype=np.int64)
+
+    # MATRICES (stored points followed by pending points)
+
+    def __invalidate_caches(self):
+        # Caches are built when first needed, AppendableArray caches are then updated in __update_caches
+        self._all_ids = None
+        self._id_rows = None
+        self._pending_descriptors = None
+        self._pending_labels = None
+        self._valid_rows = None
+        self._normalization = None
+        self._pca_matrix = None
+        self._pca_squared_norms = None
+
+    def __update_caches(self, point_id, row):
+        """Updates the caches which have already been built with a point appended to the pending points."""
+        self._pending_labels = None
+        if self._all_ids is not None:
+            self._all_ids.append(point_id)
+        if self._id_rows is not None:
+            self._id_rows[point_id] = len(self.ids) + len(self.pending) - 1
+        if self._valid_rows is not None:
+            self._valid_rows.append(True)
+        if self._pending_descriptors is not None:
+            self._pending_descriptors.append(row)
+        if self._pca_matrix is not None:
+            a, b = self.__normalization_arrays()
+            vector = self.__project_pca(row[self.pca_columns] * a[self.pca_columns] + b[self.pca_columns])
+            self._pca_matrix.append(vector)
+            self._pca_squared_norms.append(np.dot(vector, vector))
+
+    def __get_all_ids(self):
+        if self._all_ids is None:
+            self._all_ids = AppendableArray(
+                np.concatenate([self.ids, np.array([item[0] for item in self.pending], dtype=np.int64)]))
+        return self._all_ids.array
+
+    def __get_row(self, point_name):
+        if self._id_rows is None:
+            # Later rows take precedence, but a point is never both stored (and not deleted) and pending
+            self._id_rows = dict((point_id, row) for row, point_id in enumerate(
+                self.ids.tolist() + [item[0] for item in self.pending]))
+        try:
+            row = self._id_rows.get(int(point_name))
+        except ValueError:
+            return None
+        if row is None or (row < len(self.deleted) and self.deleted[row]):
+            return None
+        return row
+
+    def __get_valid_rows(self):
+        if self._valid_rows is None:
+            self._valid_rows = AppendableArray(np.concatenate([~self.deleted, np.ones(len(self.pending), dtype=bool)]))
+        return self._valid_rows.array
+
+    def __get_pending_descriptors(self):
+        if self._pending_descriptors is None:
+            self._pending_descriptors = AppendableArray(np.array([item[1] for item in self.pending], dtype=np.float32)
+                                                        .reshape((len(self.pending), self.__num_columns())))
+        return self._pending_descriptors.array
+
+    def __get_columns(self, columns):
+        """Returns the raw values of the given descriptor columns for all rows (stored and pending)."""
+        stored = self.descriptors[:, columns] if self.descriptors is not None \
+            else np.zeros((0, len(columns)), dtype=np.float32)
+        return np.concatenate([stored, self.__get_pending_descriptors()[:, columns]])
+
+    def __get_normalized_columns(self, columns):
+        a, b = self.__normalization_arrays()
+        return self.__get_columns(columns) * a[columns] + b[columns]
+
+    def __get_label_column(self, index):
+        if self._pending_labels is None:
+            self._pending_labels = np.array([item[2] for item in self.pending], dtype=np.unicode_)\
+                .reshape((len(self.pending), len(self.label_names)))
+        stored = self.labels[:, index] if self.labels is not None else np.zeros(0, dtype=np.unicode_)
+        return np.concatenate([stored, self._pending_labels[:, index]])
+
+    def __set_pca_matrix(self, pca_matrix):
+        self._pca_matrix = AppendableArray(pca_matrix)
+        self._pca_squared_norms = AppendableArray(np.einsum('ij,ij->i', pca_matrix, pca_matrix))
+
+    def __get_pca_matrix(self):
+        if self._pca_matrix is None:
+            if self.pca_components is None:
+                return None
+            if self.pca is not None:
+                # Project only pending points, stored points already have their PCA vectors on disk
+                a, b = self.__normalization_arrays()
+                pending = self.__get_pending_descriptors()
+                normalized = pending[:, self.pca_columns] * a[self.pca_columns] + b[self.pca_columns]
+                self.__set_pca_matrix(np.concatenate([self.pca, self.__project_pca(normalized)]))
+            else:
+                self.__set_pca_matrix(self.__project_pca(self.__get_normalized_columns(self.pca_columns)))
+        return self._pca_matrix.array
+
+    def __get_pca_squared_norms(self):
+        self.__get_pca_matrix()
+        return self._pca_squared_norms.array
+
+    # POINTS
+
+    def size(self):
+        return len(self.ids) - self.num_deleted + len(self.pending) + len(self.sample_points)
+
+    def add_point(self, point_location, point_name):
+        if not os.path.exists(str(point_location)):
+            msg = 'Point with name %s could NOT be added because analysis file does not exist (%s).' % \
+                  (str(point_name), str(point_location))
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.SERVER_ERROR_CODE}
+
+        try:
+            loader = yaml.CLoader if hasattr(yaml, 'CLoader') else yaml.Loader
+            descriptors = yaml.load(open(str(point_location)), Loader=loader)
+        except Exception as e:
+            msg = 'Point with name %s could NOT be added (%s).' % (str(point_name), str(e))
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.SERVER_ERROR_CODE}
+        return self.add_point_descriptors(descriptors, point_name)
+
+    def add_point_descriptors(self, descriptors, point_name):
+        """
+        Adds a point to the index given its descriptors as a nested dictionary (as in the analysis files).
+        """
+        try:
+            flat = flatten_descriptors(descriptors)
+            self.__remove_point(point_name)
+            if self.layout is None:
+                self.sample_points.append((int(point_name), flat))
+                if len(self.sample_points) >= LAYOUT_SAMPLE_SIZE:
+                    self.__freeze_layout()
+            else:
+                self.__add_flat_point(int(point_name), flat)
+        except Exception as e:
+            msg = 'Point with name %s could NOT be added (%s).' % (str(point_name), str(e))
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.SERVER_ERROR_CODE}
+
+        msg = 'Added point with name %s. Index has now %i points.' % (str(point_name), self.size())
+        logger.info(msg)
+
+        # If when adding a new point we reach the minimum points for similarity, compute normalization and PCA and
+        # save the index. This will only happen once when the size of the index reaches SIMILARITY_MINIMUM_POINTS.
+        if self.size() == sim_settings.SIMILARITY_MINIMUM_POINTS and not self.indexing_only_mode \
+                and self.pca_components is None:
+            if self.layout is None:
+                self.__freeze_layout()
+            self.__prepare_index()
+            self.save_index(msg="(reaching %i points)" % sim_settings.SIMILARITY_MINIMUM_POINTS)
+
+        return {'error': False, 'result': msg}
+
+    def __add_flat_point(self, point_id, flat):
+        row = np.zeros(self.__num_columns(), dtype=np.float32)
+        for name, start, length in self.layout:
+            if name not in flat or descriptor_length(flat[name]) != length:
+                raise Exception('descriptor %s is missing or has an unexpected length' % name)
+            row[start:start + length] = flat[name]
+        labels = [unicode(flat.get(name, '')) for name in self.label_names]
+        self.pending.append((point_id, row, labels))
+        self.__update_caches(point_id, row)
+
+    def __remove_point(self, point_name):
+        """Removes a point from the index, returns False if the point does not exist."""
+        point_id = int(point_name)
+        for index, (sample_id, _) in enumerate(self.sample_points):
+            if sample_id == point_id:
+                del self.sample_points[index]
+                return True
+        row = self.__get_row(point_id)
+        if row is None:
+            return False
+        if row < len(self.ids):
+            self.deleted[row] = True
+            self.num_deleted += 1
+            if self._valid_rows is not None:
+                self._valid_rows.array[row] = False
+        else:
+            # Rows of the following pending points change, so caches are rebuilt (this only happens when a point added
+            # since the index was loaded is deleted or added again)
+            del self.pending[row - len(self.ids)]
+            self.__invalidate_caches()
+        return True
+
+    def delete_point(self, point_name):
+        if self.__remove_point(point_name):
+            logger.info('Deleted point with name %s. Index has now %i points.' % (str(point_name), self.size()))
+            return {'error': False, 'result': True}
+        else:
+            msg = 'Can\'t delete point with name %s because it does not exist.' % str(point_name)
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.NOT_FOUND_CODE}
+
+    def get_all_point_names(self):
+        point_names = sorted(self.__get_all_ids()[self.__get_valid_rows()].tolist() +
+                             [point_id for point_id, _ in self.sample_points])
+        logger.info('Getting all point names (%i points)' % len(point_names))
+        return {'error': False, 'result': point_names}
+
+    def contains(self, point_name):
+        logger.info('Checking if index has point with name %s' % str(point_name))
+        return {'error': False, 'result': self.__get_row(point_name) is not None or
+                                          any(str(point_id) == str(point_name) for point_id, _ in self.sample_points)}
+
+    def get_sounds_descriptors(self,
+                               point_names, descriptor_names=None, normalization=True, only_leaf_descriptors=False):
+        """
+        Returns a list with the descriptor values for all requested point names
+        """
+
+        logger.info('Getting descriptors for points %s' % ','.join([str(name) for name in point_names]))
+        if descriptor_names:
+            descriptor_names = [name if name[0] == '.' else '.' + name for name in descriptor_names]
+        else:
+            descriptor_names = self.descriptor_names['all'][:]
+        try:
+            structured_layout = generate_structured_dict_from_layout(self.descriptor_names['all'][:])
+            required_descriptor_names = []
+            for name in descriptor_names:
+                nested_descriptors = get_nested_dictionary_value(name.split('.')[1:], structured_layout)
+                if not nested_descriptors:
+                    required_descriptor_names.append(name)
+                elif only_leaf_descriptors:
+                    # only return descriptors if nested descriptors are statistics
+                    if set(nested_descriptors.keys()).intersection(
+                            ['min', 'max', 'dvar2', 'dmean2', 'dmean', 'var', 'dvar', 'mean']):
+                        required_descriptor_names += ['%s.%s' % (name, key) for key in nested_descriptors.keys()]
+                else:
+                    extra_names = []
+                    get_nested_descriptor_names(nested_descriptors, extra_names)
+                    required_descriptor_names += ['%s.%s' % (name, extra_name) for extra_name in extra_names]
+            required_descriptor_names = list(set(required_descriptor_names))
+        except:
+            return {'error': True,
+                    'result': 'Wrong descriptor names, unable to create layout.',
+                    'status_code': sim_settings.BAD_REQUEST_CODE}
+
+        a, b = self.__normalization_arrays()
+        data = dict()
+        for point_name in point_names:
+            row = self.__get_row(point_name)
+            if row is None:
+                continue
+            if row < len(self.ids):
+                values, labels = self.descriptors[row], self.labels[row] if self.labels is not None else []
+            else:
+                _, values, labels = self.pending[row - len(self.ids)]
+            if normalization:
+                values = values * a + b
+            required_layout = generate_structured_dict_from_layout(required_descriptor_names)
+            for descriptor_name in required_descriptor_names:
+                if descriptor_name in self.columns:
+                    start, length = self.columns[descriptor_name]
+                    value = float(values[start]) if length == 1 else values[start:start + length].tolist()
+                elif descriptor_name in self.label_names:
+                    value = labels[self.label_names.index(descriptor_name)]
+                else:
+                    value = None
+                set_nested_dictionary_value(descriptor_name[1:].split('.'), required_layout, value)
+            data[point_name] = required_layout
+
+        return {'error': False, 'result': data}
+
+    # SIMILARITY SEARCH and CONTENT SEARCH
+
+    def __check_index_size(self):
+        size = self.size()
+        if size < sim_settings.SIMILARITY_MINIMUM_POINTS or self.pca_components is None:
+            msg = 'Not enough datapoints in the dataset (%s < %s).' % (size, sim_settings.SIMILARITY_MINIMUM_POINTS)
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.SERVER_ERROR_CODE}
+
+    def __search(self, query, preset_name, num_results, offset, mask=None, columns=None):
+        """
+        Returns the ids and distances of the nearest neighbours of the query and the number of points considered.
+        If columns is given, distances are computed using these (normalized) descriptor columns, otherwise in the
+        space of the given preset.
+        """
+        valid_rows = self.__get_valid_rows()
+        mask = valid_rows if mask is None else mask & valid_rows
+        if columns is not None:
+            matrix, squared_norms = self.__get_normalized_columns(columns), None
+        elif preset_name == 'pca':
+            matrix, squared_norms = self.__get_pca_matrix(), self.__get_pca_squared_norms()
+        else:
+            matrix, squared_norms = self.__get_normalized_columns(self.__get_preset_columns(preset_name)), None
+        approximate = None
+        if query is not None and columns is None and preset_name == 'pca' and self.ann is not None \
+                and sim_settings.SIMILARITY_ANN_NUM_PROBES > 0 \
+                and offset + num_results <= sim_settings.SIMILARITY_ANN_MAX_RESULTS:
+            approximate = self.__ann_search(query, num_results, offset, mask)
+        if query is None:
+            # No target, return points in index order
+            rows = np.flatnonzero(mask)[offset:offset + num_results]
+            distances = np.zeros(len(rows))
+        elif approximate is not None:
+            rows, distances = approximate
+        else:
+            rows, distances = nearest_neighbours(matrix, query, num_results, offset=offset, mask=mask,
+                                                 squared_norms=squared_norms)[0]
+        ids = self.__get_all_ids()[rows]
+        return [[str(point_id), float(distance)] for point_id, distance in zip(ids, distances)], int(mask.sum())
+
+    def __ann_search(self, query, num_results, offset, mask):
+        """
+        Approximate nearest neighbours in the PCA space using the IVF index: distances are only computed to the stored
+        points in the lists nearest to the query and to points added since the index was loaded. Returns None if there
+        are not enough candidates to fill the requested page (e.g. with very selective filters), in which case exact
+        search must be used.
+        """
+        candidates = np.concatenate([self.ann.candidates(query, sim_settings.SIMILARITY_ANN_NUM_PROBES),
+                                     np.arange(len(self.ids), len(mask))])
+        # Sort candidates so that ties are broken by row as in exact search
+        candidates = np.sort(candidates[mask[candidates]])
+        if len(candidates) < offset + num_results:
+            return None
+        pca_matrix = self.__get_pca_matrix()
+        rows, distances = nearest_neighbours(pca_matrix[candidates], query, num_results, offset=offset,
+                                             squared_norms=self.__get_pca_squared_norms()[candidates])[0]
+        return candidates[rows], distances
+
+    def search_dataset(self, query_point, number_of_results, preset_name, offset=0):
+        preset_name = str(preset_name)
+        error = self.__check_index_size()
+        if error:
+            return error
+
+        logger.info('NN search for point with name %s (preset = %s)' % (query_point, preset_name))
+        row = self.__get_row(query_point)
+        if row is None:
+            msg = "Sound with id %s doesn't exist in the dataset." % query_point
+            logger.info(msg)
+            return {'error': True, 'result': msg, 'status_code': sim_settings.NOT_FOUND_CODE}
+        query = self.__get_point_vector(row, preset_name)
+        results, count = self.__search(query, preset_name, int(number_of_results), int(offset))
+        return {'error': False, 'result': {'results': results, 'count': count}}
+
+    def search_dataset_batch(self, query_points, number_of_results, preset_name='pca'):
+        """
+        Returns the nearest neighbours of several points of the index at once, computed with a single vectorized
+        distance computation. Points which don't exist in the index are not included in the results.
+        """
+        error = self.__check_index_size()
+        if error:
+            return error
+        rows = [row for row in [self.__get_row(point) for point in query_points] if row is not None]
+        if preset_name == 'pca':
+            matrix, squared_norms = self.__get_pca_matrix(), self.__get_pca_squared_norms()
+        else:
+            matrix, squared_norms = self.__get_normalized_columns(self.__get_preset_columns(preset_name)), None
+        neighbours = nearest_neighbours(matrix, matrix[rows], int(number_of_results),
+                                        mask=self.__get_valid_rows(), squared_norms=squared_norms)
+        all_ids = self.__get_all_ids()
+        return {'error': False, 'result': dict(
+            (str(all_ids[row]), [[str(all_ids[r]), float(d)] for r, d in zip(result_rows, distances)])
+            for row, (result_rows, distances) in zip(rows, neighbours))}
+
+    def __get_point_vector(self, row, preset_name):
+        if preset_name == 'pca':
+            return self.__get_pca_matrix()[row]
+        columns = self.__get_preset_columns(preset_name)
+        a, b = self.__normalization_arrays()
+        return self.__get_columns(columns)[row] * a[columns] + b[columns]
+
+    def __filter_mask(self, filter_struct):
+        """
+        Evaluates a filter parsed with similarity_server_utils.parse_filter and returns a boolean mask with the rows
+        that match it. AND has precedence over OR. Filter values are given in the original (not normalized) scale, as
+        raw descriptor values are stored.
+        """
+        tokens = list(filter_struct)
+        position = [0]
+
+        def next_token():
+            token = tokens[position[0]] if position[0] < len(tokens) else None
+            position[0] += 1
+            return token
+
+        def peek():
+            return tokens[position[0]] if position[0] < len(tokens) else None
+
+        def parse_or():
+            mask = parse_and()
+            while peek() == 'OR':
+                next_token()
+                mask = mask | parse_and()
+            return mask
+
+        def parse_and():
+            mask = parse_term()
+            while peek() == 'AND':
+                next_token()
+                mask = mask & parse_term()
+            return mask
+
+        def parse_term():
+            token = next_token()
+            if token == '(':
+                mask = parse_or()
+                if next_token() != ')':
+                    raise ValueError('Unbalanced parenthesis')
+                return mask
+            if isinstance(token, dict):
+                return self.__filter_clause_mask(token)
+            raise ValueError('Unexpected token in filter: %s' % token)
+
+        mask = parse_or()
+        if position[0] != len(tokens):
+            raise ValueError('Bad filter syntax')
+        return mask
+
+    def __filter_clause_mask(self, clause):
+        feature = clause['feature']
+        if clause['type'] == 'STRING':
+            value = clause['value'].strip('"')
+            return self.__get_label_column(self.label_names.index(feature)) == value
+        if '[' in feature:
+            # Multidimensional descriptor filtered by one of its dimensions (e.g. .lowlevel.mfcc.mean[3])
+            name = feature.split('[')[0]
+            columns = [self.columns[name][0] + int(feature.split('[')[1].split(']')[0])]
+        else:
+            start, length = self.columns[feature]
+            columns = range(start, start + length)
+        values = self.__get_columns(columns)
+        if clause['type'] == 'NUMBER':
+            return values[:, 0] == np.float32(clause['value'])
+        if clause['type'] == 'ARRAY':
+            return np.all(values == np.array(clause['value'], dtype=np.float32), axis=1)
+        mask = np.ones(values.shape[0], dtype=bool)
+        if clause['value']['min'] is not None:
+            mask &= values[:, 0] >= np.float32(clause['value']['min'])
+        if clause['value']['max'] is not None:
+            mask &= values[:, 0] <= np.float32(clause['value']['max'])
+        return mask
+
+    def api_search(self, target_type, target, filter, preset_name, metric_descriptor_names, num_results, offset,
+                   in_ids):
+        error = self.__check_index_size()
+        if error:
+            return error
+
+        columns = None
+        query = None
+        note = None
+        if target:
+            if target_type == 'sound_id':
+                row = self.__get_row(target)
+                if row is None:
+                    msg = "Sound with id %s doesn't exist in the dataset and can not be set as similarity target." \
+                          % target
+                    logger.info(msg)
+                    return {'error': True, 'result': msg, 'status_code': sim_settings.NOT_FOUND_CODE}
+                query = self.__get_point_vector(row, preset_name)
+
+            elif target_type == 'descriptor_values':
+                # Only numerical descriptors are used in the target, non numerical ones (like key) are only used as
+                # filters. Distance is computed using the descriptors present in the target.
+                a, b = self.__normalization_arrays()
+                columns, query = [], []
+                try:
+                    for name in sorted(metric_descriptor_names or target.keys()):
+                        if name in self.columns and name in target:
+                            start, length = self.columns[name]
+                            columns += range(start, start + length)
+                            query += np.atleast_1d(np.asarray(target[name], dtype=np.float32)).tolist()
+                    columns = np.array(columns, dtype=np.int64)
+                    query = np.array(query, dtype=np.float32) * a[columns] + b[columns]
+                except:
+                    return {'error': True, 'result': 'Invalid target (descriptor values could not be correctly parsed)',
+                            'status_code': sim_settings.BAD_REQUEST_CODE}
+
+            elif target_type == 'file':
+                # Map the analysis file to the preset space as done for the points of the index
+                try:
+                    flat = flatten_descriptors(target)
+                    values = np.zeros(self.__num_columns(), dtype=np.float32)
+                    for name, start, length in self.layout:
+                        values[start:start + length] = flat[name]
+                    a, b = self.__normalization_arrays()
+                    if preset_name == 'pca':
+                        normalized = values[self.pca_columns] * a[self.pca_columns] + b[self.pca_columns]
+                        query = self.__project_pca(normalized)
+                    else:
+                        preset_columns = self.__get_preset_columns(preset_name)
+                        query = values[preset_columns] * a[preset_columns] + b[preset_columns]
+                except Exception as e:
+                    logger.error('Unable to create point from uploaded file (%s)' % e)
+                    return {'error': True, 'result': 'Unable to create gaia point from uploaded file. Probably the '
+                                                     'file does not have the required layout. Are you using the '
+                                                     'correct version of Essentia\'s Freesound extractor?',
+                            'status_code': sim_settings.SERVER_ERROR_CODE}
+
+        mask = None
+        if filter:
+            try:
+                mask = self.__filter_mask(filter)
+            except Exception as e:
+                return {'error': True, 'result': 'Invalid filter.', 'status_code': sim_settings.BAD_REQUEST_CODE}
+        if in_ids:
+            in_ids_mask = np.in1d(self.__get_all_ids(), np.array([int(point_id) for point_id in in_ids]))
+            mask = in_ids_mask if mask is None else mask & in_ids_mask
+
+        log_message = 'Similarity search'
+        if target:
+            log_message += ' with target: %s (%s)' % (str(target) if target_type != 'file' else 'uploaded file',
+                                                      target_type)
+        if filter:
+            log_message += ' with filter: %s' % str(filter)
+        logger.info(log_message)
+
+        try:
+            results, count = self.__search(query, preset_name, num_results, offset, mask=mask, columns=columns)
+        except Exception as e:
+            return {'error': True, 'result': 'Similarity server error', 'status_code': sim_settings.SERVER_ERROR_CODE}
+
+        return {'error': False, 'result': {'results': results, 'count': count, 'note': note}}
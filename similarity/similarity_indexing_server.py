@@ -34,8 +34,8 @@ import graypy
 from twisted.internet import reactor
 from twisted.web import server, resource
 
-from gaia_wrapper import GaiaWrapper
 import similarity_settings as sim_settings
+from similarity_server_utils import get_wrapper_class
 
 
 def server_interface(resource):
@@ -51,7 +51,7 @@ class SimilarityServer(resource.Resource):
         resource.Resource.__init__(self)
         self.methods = server_interface(self)
         self.isLeaf = False
-        self.gaia = GaiaWrapper(indexing_only_mode=True)
+        self.gaia = get_wrapper_class(sim_settings.SIMILARITY_BACKEND)(indexing_only_mode=True)
         self.request = None
 
     def error(self,message):
@@ -72,7 +72,7 @@ class SimilarityServer(resource.Resource):
         return json.dumps(self.gaia.save_index(filename[0]))
 
     def reload_gaia_wrapper(self, request):
-        self.gaia = GaiaWrapper(indexing_only_mode=True)
+        self.gaia = get_wrapper_class(sim_settings.SIMILARITY_BACKEND)(indexing_only_mode=True)
         return json.dumps({'error': False, 'result': 'Gaia wrapper reloaded!'})
 
     def clear_memory(self, request):
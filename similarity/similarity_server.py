@@ -21,14 +21,13 @@
 from __future__ import print_function
 from twisted.web import server, resource
 from twisted.internet import reactor
-from gaia_wrapper import GaiaWrapper
 from similarity_settings import LISTEN_PORT, LOGFILE, DEFAULT_PRESET, DEFAULT_NUMBER_OF_RESULTS, INDEX_NAME, PRESETS, \
     BAD_REQUEST_CODE, NOT_FOUND_CODE, SERVER_ERROR_CODE, LOGSERVER_IP_ADDRESS, LOGSERVER_PORT, LOG_TO_STDOUT, \
-    LOG_TO_GRAYLOG, LOG_TO_FILE
+    LOG_TO_GRAYLOG, LOG_TO_FILE, SIMILARITY_BACKEND
 import logging
 import graypy
 from logging.handlers import RotatingFileHandler
-from similarity_server_utils import parse_filter, parse_target, parse_metric_descriptors
+from similarity_server_utils import parse_filter, parse_target, parse_metric_descriptors, get_wrapper_class
 import json
 import yaml
 import cloghandler
@@ -53,7 +52,7 @@ class SimilarityServer(resource.Resource):
         resource.Resource.__init__(self)
         self.methods = server_interface(self)
         self.isLeaf = False
-        self.gaia = GaiaWrapper()
+        self.gaia = get_wrapper_class(SIMILARITY_BACKEND)()
         self.request = None
 
     def error(self,message):
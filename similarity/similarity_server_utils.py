@@ -19,6 +19,18 @@
 #
 
 
+def get_wrapper_class(backend):
+    """
+    Returns the class implementing the similarity index for the given backend name (see SIMILARITY_BACKEND setting).
+    Wrappers are imported here so that gaia is only required when using the gaia backend.
+    """
+    if backend == 'numpy':
+        from numpy_wrapper import NumpyWrapper
+        return NumpyWrapper
+    from gaia_wrapper import GaiaWrapper
+    return GaiaWrapper
+
+
 def parse_filter(filter_string, layout_descriptor_names):
     ALLOWED_CONTENT_BASED_SEARCH_DESCRIPTORS = layout_descriptor_names
 
@@ -28,7 +28,14 @@ INDEXING_SERVER_INDEX_NAME = 'background_index'
 PRESET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets/')
 PRESETS = ['lowlevel', 'pca']
 DEFAULT_PRESET = "pca"
+# Implementation of the similarity index: 'gaia' (GaiaWrapper) or 'numpy' (NumpyWrapper, does not require gaia)
+SIMILARITY_BACKEND = 'gaia'
 SIMILARITY_MINIMUM_POINTS = 2000
+# Approximate nearest neighbour search (numpy backend only, see build_ann_index.py). Number of IVF lists scanned per
+# query: higher values give better recall and slower queries, 0 disables the ANN index and uses exact search.
+SIMILARITY_ANN_NUM_PROBES = 16
+# Requests for more results than this (e.g. combined search fetching all similar sounds) always use exact search
+SIMILARITY_ANN_MAX_RESULTS = 1000
 LOGFILE = '/var/log/freesound/similarity.log'
 LOGFILE_INDEXING_SERVER = '/var/log/freesound/similarity_indexing.log'
 LISTEN_PORT = 8008
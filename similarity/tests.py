@@ -0,0 +1,202 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+# Tests of the numpy similarity backend. Run them in the similarity container with: python -m unittest tests
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import similarity_settings as sim_settings
+from numpy_wrapper import NumpyWrapper, nearest_neighbours
+
+
+def random_descriptors(random_state):
+    return {
+        'lowlevel': {
+            'spectral_centroid': {'mean': float(random_state.rand()), 'var': float(random_state.rand())},
+            'mfcc': {'mean': random_state.rand(3).tolist()},
+        },
+        'tonal': {'key_key': random_state.choice(['A', 'C'])},
+        'rhythm': {'beats_position': random_state.rand(random_state.randint(1, 5)).tolist()},
+    }
+
+
+class NumpyWrapperTest(unittest.TestCase):
+
+    settings = {
+        'SIMILARITY_MINIMUM_POINTS': 20,
+        'PCA_DIMENSIONS': 3,
+        'SIMILARITY_ANN_NUM_PROBES': 16,
+        'INDEX_NAME': 'test_index',
+    }
+
+    def setUp(self):
+        self.original_settings = dict((name, getattr(sim_settings, name)) for name in
+                                      list(self.settings.keys()) + ['INDEX_DIR'])
+        for name, value in self.settings.items():
+            setattr(sim_settings, name, value)
+        self.index_dir = tempfile.mkdtemp()
+        sim_settings.INDEX_DIR = self.index_dir + '/'
+        self.random_state = np.random.RandomState(0)
+        self.points = dict()
+
+    def tearDown(self):
+        for name, value in self.original_settings.items():
+            setattr(sim_settings, name, value)
+        shutil.rmtree(self.index_dir)
+
+    def add_points(self, wrapper, point_ids):
+        for point_id in point_ids:
+            self.points[point_id] = random_descriptors(self.random_state)
+            self.assertFalse(wrapper.add_point_descriptors(self.points[point_id], point_id)['error'])
+
+    def search_ids(self, wrapper, point_id, num_results=10, preset_name='pca'):
+        result = wrapper.search_dataset(point_id, num_results, preset_name)
+        self.assertFalse(result['error'])
+        return [int(result_id) for result_id, _ in result['result']['results']]
+
+    def test_add_search_delete(self):
+        wrapper = NumpyWrapper()
+        # Normalization and PCA are computed (and the index saved) when the index reaches SIMILARITY_MINIMUM_POINTS
+        self.add_points(wrapper, range(1, 21))
+        self.assertIsNotNone(wrapper.pca)
+        self.add_points(wrapper, range(21, 31))
+        self.assertEqual(wrapper.size(), 30)
+        self.assertEqual(wrapper.get_all_point_names()['result'], range(1, 31))
+        self.assertTrue(wrapper.contains(25)['result'])
+
+        # Stored and pending points can be found, the nearest point is the point itself
+        self.assertEqual(self.search_ids(wrapper, 5)[0], 5)
+        self.assertEqual(self.search_ids(wrapper, 25)[0], 25)
+
+        # Variable-length descriptors are not stored
+        descriptors = wrapper.get_sounds_descriptors(
+            [25], descriptor_names=['.lowlevel.mfcc.mean', '.tonal.key_key'], normalization=False)['result'][25]
+        self.assertTrue(np.allclose(descriptors['lowlevel']['mfcc']['mean'],
+                                    self.points[25]['lowlevel']['mfcc']['mean']))
+        self.assertEqual(descriptors['tonal']['key_key'], self.points[25]['tonal']['key_key'])
+        self.assertEqual(wrapper.descriptor_names['variable-length'], ['.rhythm.beats_position'])
+
+        # Deleted points (stored and pending) are not returned
+        neighbour = self.search_ids(wrapper, 5)[1]
+        for point_id in [neighbour, 25]:
+            self.assertFalse(wrapper.delete_point(point_id)['error'])
+            self.assertFalse(wrapper.contains(point_id)['result'])
+            self.assertNotIn(point_id, self.search_ids(wrapper, 5, num_results=30))
+        self.assertEqual(wrapper.size(), 28)
+        self.assertEqual(wrapper.delete_point(25)['status_code'], sim_settings.NOT_FOUND_CODE)
+
+        # Points added again replace the previous ones
+        self.add_points(wrapper, [5, 25, 26])
+        self.assertEqual(wrapper.size(), 29)
+        self.assertEqual(self.search_ids(wrapper, 5)[0], 5)
+        self.assertEqual(self.search_ids(wrapper, 26)[0], 26)
+
+    def test_nearest_neighbours(self):
+        wrapper = NumpyWrapper()
+        self.add_points(wrapper, range(1, 31))
+
+        # Distances are computed with the normalized values (min-max scaling computed with the first 20 points)
+        values = np.array([self.points[point_id]['lowlevel']['mfcc']['mean'] for point_id in range(1, 31)])
+        min_values, max_values = values[:20].min(axis=0), values[:20].max(axis=0)
+        normalized = (values - min_values) / (max_values - min_values)
+        target = [0.5, 0.5, 0.5]
+        expected = np.argsort(np.sqrt(((normalized - (target - min_values) / (max_values - min_values)) ** 2)
+                                      .sum(axis=1)))[:10] + 1
+        result = wrapper.api_search('descriptor_values', {'.lowlevel.mfcc.mean': target}, None, 'pca', None, 10, 0,
+                                    None)
+        self.assertEqual([int(point_id) for point_id, _ in result['result']['results']], expected.tolist())
+        distances = [distance for _, distance in result['result']['results']]
+        self.assertEqual(distances, sorted(distances))
+
+        # Filters use the original (not normalized) values
+        result = wrapper.api_search('descriptor_values', {'.lowlevel.mfcc.mean': target}, [
+            {'feature': '.tonal.key_key', 'type': 'STRING', 'value': '"C"'}], 'pca', None, 30, 0, None)
+        self.assertEqual(sorted(int(point_id) for point_id, _ in result['result']['results']),
+                         [point_id for point_id in range(1, 31) if self.points[point_id]['tonal']['key_key'] == 'C'])
+
+        # Batched searches return the same results as single searches
+        batch = wrapper.search_dataset_batch([3, 22], 5)['result']
+        for point_id in [3, 22]:
+            self.assertEqual([int(result_id) for result_id, _ in batch[str(point_id)]],
+                             self.search_ids(wrapper, point_id, num_results=5))
+
+    def test_nearest_neighbours_function(self):
+        matrix = self.random_state.rand(50, 4).astype(np.float32)
+        queries = self.random_state.rand(3, 4).astype(np.float32)
+        mask = self.random_state.rand(50) > 0.3
+        for query, (rows, distances) in zip(queries, nearest_neighbours(matrix, queries, 5, offset=2, mask=mask)):
+            all_distances = np.sqrt(((matrix - query) ** 2).sum(axis=1))
+            expected = [row for row in np.argsort(all_distances) if mask[row]][2:7]
+            self.assertEqual(rows.tolist(), expected)
+            self.assertTrue(np.allclose(distances, all_distances[expected], atol=1e-5))
+
+    def test_persistence(self):
+        wrapper = NumpyWrapper()
+        self.add_points(wrapper, range(1, 26))
+        self.search_ids(wrapper, 1)
+        # Points added once the matrices used for searching have been computed are appended to them
+        self.add_points(wrapper, range(26, 31))
+        wrapper.delete_point(3)
+        results = dict((point_id, self.search_ids(wrapper, point_id)) for point_id in [1, 10, 25, 28])
+        self.assertFalse(wrapper.save_index()['error'])
+
+        # Points added after the index was loaded are stored, deleted points are removed
+        wrapper = NumpyWrapper()
+        self.assertEqual(len(wrapper.ids), 29)
+        self.assertEqual(wrapper.pending, [])
+        self.assertEqual(wrapper.get_all_point_names()['result'],
+                         [point_id for point_id in range(1, 31) if point_id != 3])
+        for point_id, point_results in results.items():
+            self.assertEqual(self.search_ids(wrapper, point_id), point_results)
+        descriptors = wrapper.get_sounds_descriptors([25], normalization=False)['result'][25]
+        self.assertTrue(np.allclose(descriptors['lowlevel']['spectral_centroid']['mean'],
+                                    self.points[25]['lowlevel']['spectral_centroid']['mean']))
+
+    def test_ann_index(self):
+        wrapper = NumpyWrapper()
+        self.add_points(wrapper, range(1, 41))
+        exact_results = dict((point_id, self.search_ids(wrapper, point_id)) for point_id in range(1, 41))
+        self.assertFalse(wrapper.build_ann_index(num_lists=4)['error'])
+        self.assertIsNotNone(wrapper.ann)
+        self.assertEqual(wrapper.ann.list_offsets[-1], 40)
+
+        # Probing all the lists gives exact results
+        for point_id in range(1, 41):
+            self.assertEqual(self.search_ids(wrapper, point_id), exact_results[point_id])
+
+        # Points added after the index was built are searched until they are assigned to the lists when saving
+        self.add_points(wrapper, range(41, 46))
+        wrapper.delete_point(1)
+        self.assertEqual(self.search_ids(wrapper, 43)[0], 43)
+        self.assertNotIn(1, self.search_ids(wrapper, 2, num_results=45))
+        results = dict((point_id, self.search_ids(wrapper, point_id)) for point_id in [2, 43])
+        wrapper.save_index()
+        self.assertEqual(wrapper.ann.list_offsets[-1], 44)
+        self.assertEqual(sorted(wrapper.ann.list_rows.tolist()), range(44))
+        for point_id, point_results in results.items():
+            self.assertEqual(self.search_ids(wrapper, point_id), point_results)
+
+        # With a single probe only the points of the nearest list (and pending points) are candidates
+        sim_settings.SIMILARITY_ANN_NUM_PROBES = 1
+        self.assertEqual(self.search_ids(wrapper, 43, num_results=1), [43])
@@ -0,0 +1,96 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from sounds.models import Sound
+from utils.locations import bulk_locations
+
+console_logger = logging.getLogger("console")
+
+# Locations used when building the Solr document of a sound (see convert_to_solr_document)
+SOLR_DOCUMENT_PATHS = ['display.wave.M.path', 'display.wave.L.path', 'display.spectral.M.path',
+                       'display.spectral.L.path', 'preview.LQ.mp3.path']
+
+# Locations used when serializing a sound in the API (see apiv2.serializers.AbstractSoundSerializer)
+API_SERIALIZER_PATHS = ['preview.%s.%s.url' % (quality, extension) for quality in ['HQ', 'LQ']
+                        for extension in ['mp3', 'ogg']] + \
+                       ['display.%s.%s.url' % (display_type, size) for display_type in
+                        ['wave', 'spectral', 'wave_bw', 'spectral_bw'] for size in ['M', 'L']] + \
+                       ['analysis.frames.url']
+
+
+class Command(BaseCommand):
+    help = 'Measure the time needed to compute the locations of sounds when serializing them. Sound objects are ' \
+           'created in memory, no database queries are made.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', '--num-sounds',
+            action='store',
+            dest='num_sounds',
+            default=10000,
+            type=int,
+            help='Number of sounds to serialize in every batch (default 10000).')
+
+        parser.add_argument(
+            '-r', '--repetitions',
+            action='store',
+            dest='repetitions',
+            default=5,
+            type=int,
+            help='Number of times each batch is serialized (default 5).')
+
+    def handle(self, *args, **options):
+        console_logger.info("Computing locations of %i sounds %i times", options['num_sounds'], options['repetitions'])
+        all_paths = sorted(Sound.locations.flat_templates.keys())
+
+        def new_sounds():
+            # Locations are cached in the sound objects, so every repetition uses new objects
+            return [Sound(id=sound_id, user_id=sound_id % 1000, type='wav')
+                    for sound_id in range(1, options['num_sounds'] + 1)]
+
+        def per_sound(paths):
+            return lambda sounds: [[sound.locations(path) for path in paths] for sound in sounds]
+
+        def bulk(paths):
+            return lambda sounds: [bulk_locations(sounds, path) for path in paths]
+
+        benchmarks = [
+            ('Solr document paths', per_sound(SOLR_DOCUMENT_PATHS)),
+            ('Solr document paths (bulk)', bulk(SOLR_DOCUMENT_PATHS)),
+            ('API serializer URLs', per_sound(API_SERIALIZER_PATHS)),
+            ('API serializer URLs (bulk)', bulk(API_SERIALIZER_PATHS)),
+            # All locations were computed the first time locations() was called before they were computed lazily
+            ('All locations', per_sound(all_paths)),
+        ]
+        for name, compute_locations in benchmarks:
+            elapsed = 0
+            for _ in range(options['repetitions']):
+                sounds = new_sounds()
+                start = time.time()
+                compute_locations(sounds)
+                elapsed += time.time() - start
+            elapsed /= options['repetitions']
+            console_logger.info("%s: %.2f ms per batch, %.2f us per sound", name, elapsed * 1000,
+                                elapsed * 1000000 / options['num_sounds'])
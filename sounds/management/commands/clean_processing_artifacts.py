@@ -0,0 +1,32 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+from utils.audioprocessing.processing_artifacts import remove_all_unreferenced_artifacts
+from utils.management_commands import LoggingBaseCommand
+
+
+class Command(LoggingBaseCommand):
+    help = 'Removes the stored processing and analysis outputs (see REUSE_PROCESSING_ARTIFACTS) which are not used ' \
+           'by the files of any sound anymore.'
+
+    def handle(self, *args, **options):
+        self.log_start()
+        num_removed = remove_all_unreferenced_artifacts()
+        self.log_end({'n_md5s_removed': num_removed})
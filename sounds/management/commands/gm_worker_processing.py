@@ -20,15 +20,20 @@
 
 import json
 import logging
+import multiprocessing
 import os
+import shutil
 import signal
 import sys
+import tempfile
 import time
 
 import gearman
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 
+from sounds.models import Sound
 from utils.audioprocessing.freesound_audio_analysis import FreesoundAudioAnalyzer
 from utils.audioprocessing.freesound_audio_processing import FreesoundAudioProcessor
 
@@ -82,6 +87,207 @@ def check_if_free_space(directory=settings.PROCESSING_TEMP_DIR,
                               "aborting task as there might not be enough space for temp files")
 
 
+def analyze_sound(job_data):
+    return FreesoundAudioAnalyzer(sound_id=job_data['sound_id']).analyze()
+
+
+def process_sound(job_data):
+    return FreesoundAudioProcessor(sound_id=job_data['sound_id'])\
+        .process(skip_displays=job_data.get('skip_displays', False), skip_previews=job_data.get('skip_previews', False))
+
+
+def set_analysis_failure(job_data, message):
+    FreesoundAudioAnalyzer(sound_id=job_data['sound_id']).set_failure(message)
+
+
+def set_processing_failure(job_data, message):
+    FreesoundAudioProcessor(sound_id=job_data['sound_id']).set_failure(message)
+
+
+TASKS = {
+    # task name: (description and gerund used in log messages, function running the task given the job data,
+    # function setting the failure state of the sound given the job data and an error message)
+    'analyze_sound': ('analysis', 'analyzing', analyze_sound, set_analysis_failure),
+    'process_sound': ('processing', 'processing', process_sound, set_processing_failure),
+}
+
+
+def run_task(task_name, job_data, queue_time=None):
+    """
+    Runs an analysis or processing task and logs its result.
+    :param str task_name: name of the task (one of TASKS)
+    :param dict job_data: data of the gearman job
+    :param float queue_time: seconds the job waited before starting (only known when running with several slots)
+    """
+    description, gerund, task_function, _ = TASKS[task_name]
+    sound_id = job_data['sound_id']
+    log_data = {'task_name': task_name, 'sound_id': sound_id}
+    if queue_time is not None:
+        log_data['queue_time'] = round(queue_time, 3)
+
+    workers_logger.info("Starting %s of sound (%s)" % (description, json.dumps(log_data)))
+    start_time = time.time()
+    try:
+        check_if_free_space()
+        result = task_function(job_data)
+        workers_logger.info("Finished %s of sound (%s)" % (description, json.dumps(dict(
+            log_data, result='success' if result else 'failure', work_time=round(time.time() - start_time)))))
+
+    except WorkerException as e:
+        workers_logger.error("WorkerException while %s sound (%s)" % (gerund, json.dumps(dict(
+            log_data, error=str(e), work_time=round(time.time() - start_time)))))
+
+    except Exception as e:
+        workers_logger.error("Unexpected error while %s sound (%s)" % (gerund, json.dumps(dict(
+            log_data, error=str(e), work_time=round(time.time() - start_time)))))
+
+
+def run_task_in_slot(task_name, job_data, queue_time, tmp_directory):
+    # Run in a new process group so that the encoders and extractors started by the task are also terminated if the
+    # task times out
+    os.setpgrp()
+    # Temporary files of the task are created in the directory of the slot, which the supervisor removes when the task
+    # ends (temporary directories are not removed by the task if it is killed)
+    settings.PROCESSING_TEMP_DIR = tmp_directory
+    run_task(task_name, job_data, queue_time)
+
+
+class SizeAwareJobQueue(object):
+    """
+    Queue of jobs waiting for a free slot. Jobs of shorter sounds are run first so that they are not blocked behind
+    long sounds, and jobs of long sounds (longer than large_job_duration seconds) never take all the slots so that
+    there is always a slot for short ones. Jobs waiting for more than max_queue_wait seconds are run first (in arrival
+    order) so that long sounds are not starved either.
+    """
+
+    def __init__(self, num_slots, large_job_duration, max_queue_wait):
+        self.max_large_jobs = max(1, num_slots - 1)
+        self.large_job_duration = large_job_duration
+        self.max_queue_wait = max_queue_wait
+        self.jobs = []  # (arrival time, estimated duration, job data) in arrival order
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def is_large(self, duration):
+        return duration >= self.large_job_duration
+
+    def add(self, job_data, duration, now=None):
+        self.jobs.append((now if now is not None else time.time(), duration, job_data))
+
+    def pop(self, num_running_large_jobs, now=None):
+        """
+        Returns the (arrival time, estimated duration, job data) of the next job to run given the number of running
+        large jobs, or None if no job can be run.
+        """
+        now = now if now is not None else time.time()
+        candidates = [job for job in self.jobs
+                      if not self.is_large(job[1]) or num_running_large_jobs < self.max_large_jobs]
+        if not candidates:
+            return None
+        if now - candidates[0][0] >= self.max_queue_wait:
+            job = candidates[0]
+        else:
+            job = min(candidates, key=lambda job: job[1])
+        self.jobs.remove(job)
+        return job
+
+
+def estimate_sound_duration(sound_id):
+    """
+    Returns the duration of the sound in seconds. Duration is only known once a sound has been processed, otherwise
+    it is estimated from the filesize as if it was 16 bit stereo PCM at 44.1kHz (so compressed files are
+    underestimated).
+    """
+    try:
+        duration, filesize = Sound.objects.filter(id=sound_id).values_list('duration', 'filesize')[0]
+    except IndexError:
+        return 0
+    return duration if duration else filesize / (44100.0 * 2 * 2)
+
+
+class SlotsSupervisorGearmanWorker(gearman.GearmanWorker):
+    """
+    Gearman worker which runs up to num_slots jobs at the same time, every job in a child process. Jobs received from
+    gearman are queued in a SizeAwareJobQueue and started when there is a free slot. Timeouts are enforced per slot
+    by killing the child process of the job (and the processes it started), so no signals are used in the job. As a
+    killed job can't clean up, the supervisor sets the failure state of its sound and removes the temporary directory
+    where the job created its files. The worker stops taking jobs from gearman
+    while max_queued_jobs jobs are waiting (jobs in this queue are lost if the supervisor is stopped).
+    """
+
+    stats_interval = 60
+
+    def __init__(self, host_list, task_name, num_slots, timeout, max_queued_jobs):
+        super(SlotsSupervisorGearmanWorker, self).__init__(host_list)
+        self.task_name = task_name
+        self.num_slots = num_slots
+        self.timeout = timeout
+        self.max_queued_jobs = max_queued_jobs
+        self.queue = SizeAwareJobQueue(num_slots, settings.WORKER_LARGE_JOB_DURATION, settings.WORKER_MAX_QUEUE_WAIT)
+        self.running_jobs = {}  # {process: (start time, estimated duration, job data, temporary directory)}
+        self.last_stats_time = time.time()
+
+    def set_failure(self, job_data, error):
+        try:
+            TASKS[self.task_name][3](job_data, error)
+        except Exception as e:
+            workers_logger.error("Unexpected error while setting failure state of sound (%s)" % json.dumps(
+                {'task_name': self.task_name, 'sound_id': job_data['sound_id'], 'error': str(e)}))
+
+    def add_job(self, job_data):
+        self.queue.add(job_data, estimate_sound_duration(job_data['sound_id']))
+        self.schedule()
+        while len(self.queue) >= self.max_queued_jobs:
+            time.sleep(0.5)
+            self.schedule()
+
+    def after_poll(self, any_activity):
+        # Called by gearman after every poll (at least once every poll_timeout seconds)
+        self.schedule()
+        return True
+
+    def schedule(self):
+        now = time.time()
+        for process, (start_time, duration, job_data, tmp_directory) in self.running_jobs.items():
+            if process.is_alive() and now - start_time > self.timeout:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    process.terminate()
+                process.join()
+                error = '%s of sound %s timed out' % (TASKS[self.task_name][0].capitalize(), job_data['sound_id'])
+                workers_logger.error("WorkerException while %s sound (%s)" % (TASKS[self.task_name][1], json.dumps(
+                    {'task_name': self.task_name, 'sound_id': job_data['sound_id'], 'error': error,
+                     'work_time': round(now - start_time)})))
+                self.set_failure(job_data, error)
+            if not process.is_alive():
+                process.join()
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+                del self.running_jobs[process]
+
+        while len(self.running_jobs) < self.num_slots:
+            num_running_large_jobs = len([job for job in self.running_jobs.values() if self.queue.is_large(job[1])])
+            job = self.queue.pop(num_running_large_jobs, now)
+            if job is None:
+                break
+            arrival_time, duration, job_data = job
+            tmp_directory = tempfile.mkdtemp(prefix='slot_', dir=settings.PROCESSING_TEMP_DIR)
+            # Database connections can't be shared with the child processes
+            connections.close_all()
+            process = multiprocessing.Process(target=run_task_in_slot,
+                                              args=(self.task_name, job_data, now - arrival_time, tmp_directory))
+            process.start()
+            self.running_jobs[process] = (now, duration, job_data, tmp_directory)
+
+        if now - self.last_stats_time >= self.stats_interval:
+            self.last_stats_time = now
+            workers_logger.info("Worker slots status (%s)" % json.dumps(
+                {'task_name': self.task_name, 'n_slots': self.num_slots, 'n_running': len(self.running_jobs),
+                 'n_queued': len(self.queue),
+                 'max_queue_time': round(now - min(job[0] for job in self.queue.jobs)) if self.queue.jobs else 0}))
+
+
 class Command(BaseCommand):
     help = 'Run the sound processing worker'
 
@@ -92,12 +298,34 @@ class Command(BaseCommand):
             dest='queue',
             default='process_sound',
             help='Register this function (default: process_sound)')
+        parser.add_argument(
+            '--slots',
+            action='store',
+            dest='slots',
+            default=1,
+            type=int,
+            help='Number of jobs run at the same time, each one in a child process (default: 1, run jobs in this '
+                 'process one after the other)')
 
     def handle(self, *args, **options):
         task_name = 'task_%s' % options['queue']
         if task_name not in dir(self):
             sys.exit(1)
 
+        if options['slots'] > 1:
+            gm_worker = SlotsSupervisorGearmanWorker(
+                settings.GEARMAN_JOB_SERVERS, options['queue'], options['slots'], settings.WORKER_TIMEOUT,
+                max_queued_jobs=2 * options['slots'])
+
+            def task_add_job(gearman_worker, gearman_job):
+                gearman_worker.add_job(json.loads(gearman_job.data))
+                return ''  # Gearman requires return value to be a string
+
+            gm_worker.register_task(options['queue'], task_add_job)
+            workers_logger.info('Started worker with tasks: %s (%i slots)' % (task_name, options['slots']))
+            gm_worker.work(poll_timeout=1.0)
+            return
+
         task_func = lambda x, y: getattr(Command, task_name)(self, x, y)
         gm_worker = gearman.GearmanWorker(settings.GEARMAN_JOB_SERVERS)
         gm_worker.register_task(options['queue'], task_func)
@@ -105,72 +333,15 @@ class Command(BaseCommand):
         gm_worker.work()
 
     def task_analyze_sound(self, gearman_worker, gearman_job):
-        task_name = 'analyze_sound'
         job_data = json.loads(gearman_job.data)
-        sound_id = job_data['sound_id']
-        set_timeout_alarm(settings.WORKER_TIMEOUT, 'Analysis of sound %s timed out' % sound_id)
-
-        workers_logger.info("Starting analysis of sound (%s)" % json.dumps(
-            {'task_name': task_name, 'sound_id': sound_id}))
-        start_time = time.time()
-        try:
-            check_if_free_space()
-            result = FreesoundAudioAnalyzer(sound_id=sound_id).analyze()
-            if result:
-                workers_logger.info("Finished analysis of sound (%s)" % json.dumps(
-                    {'task_name': task_name, 'sound_id': sound_id, 'result': 'success',
-                     'work_time': round(time.time() - start_time)}))
-            else:
-                workers_logger.info("Finished analysis of sound (%s)" % json.dumps(
-                    {'task_name': task_name, 'sound_id': sound_id, 'result': 'failure',
-                     'work_time': round(time.time() - start_time)}))
-
-        except WorkerException as e:
-            workers_logger.error("WorkerException while analyzing sound (%s)" % json.dumps(
-                {'task_name': task_name, 'sound_id': sound_id, 'error': str(e),
-                 'work_time': round(time.time() - start_time)}))
-
-        except Exception as e:
-            workers_logger.error("Unexpected error while analyzing sound (%s)" % json.dumps(
-                {'task_name': task_name, 'sound_id': sound_id, 'error': str(e),
-                 'work_time': round(time.time() - start_time)}))
-
+        set_timeout_alarm(settings.WORKER_TIMEOUT, 'Analysis of sound %s timed out' % job_data['sound_id'])
+        run_task('analyze_sound', job_data)
         cancel_timeout_alarm()
         return ''  # Gearman requires return value to be a string
 
     def task_process_sound(self, gearman_worker, gearman_job):
-        task_name = 'process_sound'
         job_data = json.loads(gearman_job.data)
-        sound_id = job_data['sound_id']
-        skip_previews = job_data.get('skip_previews', False)
-        skip_displays = job_data.get('skip_displays', False)
-        set_timeout_alarm(settings.WORKER_TIMEOUT, 'Processing of sound %s timed out' % sound_id)
-
-        workers_logger.info("Starting processing of sound (%s)" % json.dumps({
-            'task_name': task_name, 'sound_id': sound_id}))
-        start_time = time.time()
-        try:
-            check_if_free_space()
-            result = FreesoundAudioProcessor(sound_id=sound_id)\
-                .process(skip_displays=skip_displays, skip_previews=skip_previews)
-            if result:
-                workers_logger .info("Finished processing of sound (%s)" % json.dumps(
-                    {'task_name': task_name, 'sound_id': sound_id, 'result': 'success',
-                     'work_time': round(time.time() - start_time)}))
-            else:
-                workers_logger.info("Finished processing of sound (%s)" % json.dumps(
-                    {'task_name': task_name, 'sound_id': sound_id, 'result': 'failure',
-                     'work_time': round(time.time() - start_time)}))
-
-        except WorkerException as e:
-            workers_logger.error("WorkerException while processing sound (%s)" % json.dumps(
-                {'task_name': task_name, 'sound_id': sound_id, 'error': str(e),
-                 'work_time': round(time.time() - start_time)}))
-
-        except Exception as e:
-            workers_logger.error("Unexpected error while processing sound (%s)" % json.dumps(
-                {'task_name': task_name, 'sound_id': sound_id, 'error': str(e),
-                 'work_time': round(time.time() - start_time)}))
-
+        set_timeout_alarm(settings.WORKER_TIMEOUT, 'Processing of sound %s timed out' % job_data['sound_id'])
+        run_task('process_sound', job_data)
         cancel_timeout_alarm()
         return ''  # Gearman requires return value to be a string
@@ -37,10 +37,10 @@ from django.utils.text import Truncator
 from general.models import OrderedModel, SocialModel
 from geotags.models import GeoTag
 from tags.models import TaggedItem, Tag
-from utils.cache import invalidate_template_cache
+from utils.cache import get_template_cache_version, bump_template_cache_version, bump_template_cache_versions
 from utils.text import slugify
-from utils.locations import locations_decorator
-from utils.search.search_general import delete_sound_from_solr
+from utils.locations import lazy_locations_decorator, path_location, url_location, LocationTemplate
+from utils.search.search_general import delete_sound_from_solr, send_sound_index_event
 from utils.similarity_utilities import delete_sound_from_gaia
 from utils.mail import send_mail_template
 from utils.tags import clean_and_split_tags
@@ -479,6 +479,10 @@ class SoundManager(models.Manager):
         where = "sound.id = ANY(%s)"
         return self.bulk_query(where, "", "", (sound_ids, ))
 
+    def invalidate_template_caches(self, sound_ids):
+        """Invalidate the cached template fragments of many sounds at once (see Sound.invalidate_template_caches)"""
+        bump_template_cache_versions('sound', sound_ids)
+
     def dict_ids(self, sound_ids):
         return {sound_obj.id: sound_obj for sound_obj in self.bulk_query_id(sound_ids)}
 
@@ -493,6 +497,61 @@ class PublicSoundManager(models.Manager):
         return super(PublicSoundManager, self).get_queryset().filter(moderation_state="OK", processing_state="OK")
 
 
+def sound_display_locations(name, extension):
+    return dict(
+        M=dict(
+            path=path_location('DISPLAYS_PATH', "%(id_folder)s/%(id)d_%(user_id)d_" + name + "_M." + extension),
+            url=url_location('DISPLAYS_URL', "%(id_folder)s/%(id)d_%(user_id)d_" + name + "_M." + extension)
+        ),
+        L=dict(
+            path=path_location('DISPLAYS_PATH', "%(id_folder)s/%(id)d_%(user_id)d_" + name + "_L." + extension),
+            url=url_location('DISPLAYS_URL', "%(id_folder)s/%(id)d_%(user_id)d_" + name + "_L." + extension)
+        )
+    )
+
+
+def sound_preview_locations(quality, extension):
+    filename = "%(id)d_%(user_id)d-" + quality + "." + extension
+    return dict(
+        path=path_location('PREVIEWS_PATH', "%(id_folder)s/" + filename),
+        url=url_location('PREVIEWS_URL', "%(id_folder)s/" + filename),
+        filename=LocationTemplate(filename),
+    )
+
+
+# Templates of the locations of the files of a sound (see Sound.locations)
+SOUND_LOCATIONS = dict(
+    path=path_location('SOUNDS_PATH', "%(id_folder)s/%(id)d_%(user_id)d.%(type)s"),
+    sendfile_url=url_location('SOUNDS_SENDFILE_URL', "%(id_folder)s/%(id)d_%(user_id)d.%(type)s"),
+    preview=dict(
+        HQ=dict(
+            mp3=sound_preview_locations("hq", "mp3"),
+            ogg=sound_preview_locations("hq", "ogg"),
+        ),
+        LQ=dict(
+            mp3=sound_preview_locations("lq", "mp3"),
+            ogg=sound_preview_locations("lq", "ogg"),
+        )
+    ),
+    display=dict(
+        spectral=sound_display_locations("spec", "jpg"),
+        wave=sound_display_locations("wave", "png"),
+        spectral_bw=sound_display_locations("spec_bw", "jpg"),
+        wave_bw=sound_display_locations("wave_bw", "png"),
+    ),
+    analysis=dict(
+        statistics=dict(
+            path=path_location('ANALYSIS_PATH', "%(id_folder)s/%(id)d_%(user_id)d_statistics.%(stats_format)s"),
+            url=url_location('ANALYSIS_URL', "%(id_folder)s/%(id)d_%(user_id)d_statistics.%(stats_format)s")
+        ),
+        frames=dict(
+            path=path_location('ANALYSIS_PATH', "%(id_folder)s/%(id)d_%(user_id)d_frames.%(frames_format)s"),
+            url=url_location('ANALYSIS_URL', "%(id_folder)s/%(id)d_%(user_id)d_frames.%(frames_format)s")
+        )
+    )
+)
+
+
 class Sound(SocialModel):
     user = models.ForeignKey(User, related_name="sounds")
     created = models.DateTimeField(db_index=True, auto_now_add=True)
@@ -606,110 +665,16 @@ class Sound(SocialModel):
         username_slug = slugify(self.user.username)
         return "%d__%s__%s.%s" % (self.id, username_slug, filename_slug, self.type)
 
-    @locations_decorator()
+    @lazy_locations_decorator(SOUND_LOCATIONS)
     def locations(self):
-        id_folder = str(self.id/1000)
-        sound_user_id = self.user_id
-        return dict(
-            path=os.path.join(settings.SOUNDS_PATH, id_folder, "%d_%d.%s" % (self.id, sound_user_id, self.type)),
-            sendfile_url=settings.SOUNDS_SENDFILE_URL + "%s/%d_%d.%s" % (id_folder, self.id, sound_user_id, self.type),
-            preview=dict(
-                HQ=dict(
-                    mp3=dict(
-                        path=os.path.join(settings.PREVIEWS_PATH, id_folder, "%d_%d-hq.mp3" % (self.id, sound_user_id)),
-                        url=settings.PREVIEWS_URL + "%s/%d_%d-hq.mp3" % (id_folder, self.id, sound_user_id),
-                        filename="%d_%d-hq.mp3" % (self.id, sound_user_id),
-                    ),
-                    ogg=dict(
-                        path=os.path.join(settings.PREVIEWS_PATH, id_folder, "%d_%d-hq.ogg" % (self.id, sound_user_id)),
-                        url=settings.PREVIEWS_URL + "%s/%d_%d-hq.ogg" % (id_folder, self.id, sound_user_id),
-                        filename="%d_%d-hq.ogg" % (self.id, sound_user_id),
-                    )
-                ),
-                LQ=dict(
-                    mp3=dict(
-                        path=os.path.join(settings.PREVIEWS_PATH, id_folder, "%d_%d-lq.mp3" % (self.id, sound_user_id)),
-                        url=settings.PREVIEWS_URL + "%s/%d_%d-lq.mp3" % (id_folder, self.id, sound_user_id),
-                        filename="%d_%d-lq.mp3" % (self.id, sound_user_id),
-                    ),
-                    ogg=dict(
-                        path=os.path.join(settings.PREVIEWS_PATH, id_folder, "%d_%d-lq.ogg" % (self.id, sound_user_id)),
-                        url=settings.PREVIEWS_URL + "%s/%d_%d-lq.ogg" % (id_folder, self.id, sound_user_id),
-                        filename="%d_%d-lq.ogg" % (self.id, sound_user_id),
-                    ),
-                )
-            ),
-            display=dict(
-                spectral=dict(
-                    M=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_spec_M.jpg" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_spec_M.jpg" % (id_folder, self.id, sound_user_id)
-                    ),
-                    L=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_spec_L.jpg" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_spec_L.jpg" % (id_folder, self.id, sound_user_id)
-                    )
-                ),
-                wave=dict(
-                    M=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_wave_M.png" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_wave_M.png" % (id_folder, self.id, sound_user_id)
-                    ),
-                    L=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_wave_L.png" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_wave_L.png" % (id_folder, self.id, sound_user_id)
-                    )
-                ),
-                spectral_bw=dict(
-                    M=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_spec_bw_M.jpg" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_spec_bw_M.jpg" % (id_folder, self.id, sound_user_id)
-                    ),
-                    L=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_spec_bw_L.jpg" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_spec_bw_L.jpg" % (id_folder, self.id, sound_user_id)
-                    )
-                ),
-                wave_bw=dict(
-                    M=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_wave_bw_M.png" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_wave_bw_M.png" % (id_folder, self.id, sound_user_id)
-                    ),
-                    L=dict(
-                        path=os.path.join(settings.DISPLAYS_PATH, id_folder, "%d_%d_wave_bw_L.png" % (self.id,
-                                                                                                   sound_user_id)),
-                        url=settings.DISPLAYS_URL + "%s/%d_%d_wave_bw_L.png" % (id_folder, self.id, sound_user_id)
-                    )
-                )
-            ),
-            analysis=dict(
-                statistics=dict(
-                    path=os.path.join(settings.ANALYSIS_PATH, id_folder, "%d_%d_statistics.%s" % (
-                        self.id, sound_user_id, settings.ESSENTIA_STATS_OUT_FORMAT)),
-                    url=settings.ANALYSIS_URL + "%s/%d_%d_statistics.%s" % (
-                        id_folder, self.id, sound_user_id, settings.ESSENTIA_STATS_OUT_FORMAT)
-                ),
-                frames=dict(
-                    path=os.path.join(settings.ANALYSIS_PATH, id_folder, "%d_%d_frames.%s" % (
-                        self.id, sound_user_id, settings.ESSENTIA_FRAMES_OUT_FORMAT)),
-                    url=settings.ANALYSIS_URL + "%s/%d_%d_frames.%s" % (
-                        id_folder, self.id, sound_user_id, settings.ESSENTIA_FRAMES_OUT_FORMAT)
-                )
-            )
-        )
+        return dict(id_folder=str(self.id/1000), id=self.id, user_id=self.user_id, type=self.type,
+                    stats_format=settings.ESSENTIA_STATS_OUT_FORMAT, frames_format=settings.ESSENTIA_FRAMES_OUT_FORMAT)
 
     def get_preview_abs_url(self):
-        return 'https://%s%s' % (Site.objects.get_current().domain, self.locations()['preview']['LQ']['mp3']['url'])
+        return 'https://%s%s' % (Site.objects.get_current().domain, self.locations('preview.LQ.mp3.url'))
 
     def get_thumbnail_abs_url(self, size='M'):
-        return 'https://%s%s' % (Site.objects.get_current().domain, self.locations()['display']['wave'][size]['url'])
+        return 'https://%s%s' % (Site.objects.get_current().domain, self.locations('display.wave.%s.url' % size))
 
     def get_large_thumbnail_abs_url(self):
         return self.get_thumbnail_abs_url(size='L')
@@ -877,6 +842,7 @@ class Sound(SocialModel):
             self.moderation_state = new_state
             self.moderation_date = datetime.datetime.now()
             self.save()
+            send_sound_index_event(self.id)
 
             if new_state != 'OK':
                 # If the moderation state changed and now the sound is not moderated OK, delete it from indexes
@@ -911,6 +877,7 @@ class Sound(SocialModel):
             self.processing_date = datetime.datetime.now()
             self.processing_log = processing_log
             self.save(update_fields=['processing_state', 'processing_date', 'processing_log', 'is_index_dirty'])
+            send_sound_index_event(self.id)
 
             if new_state == 'FA':
                 # Sound became processing failed, delete it from indexes
@@ -1003,9 +970,15 @@ class Sound(SocialModel):
         # NOTE: see comments in https://github.com/MTG/freesound/issues/750
 
     def mark_index_dirty(self, commit=True):
+        """
+        Marks the sound as index dirty. If commit=True, the sound is saved and the indexing worker is notified. If
+        commit=False, the caller must call send_sound_index_event after saving the sound so that the worker does not
+        index the data from before the changes.
+        """
         self.is_index_dirty = True
         if commit:
             self.save()
+            send_sound_index_event(self.id)
 
     def add_comment(self, user, comment):
         comment = Comment(sound=self, user=user, comment=comment)
@@ -1013,6 +986,7 @@ class Sound(SocialModel):
         self.num_comments = F('num_comments') + 1
         self.mark_index_dirty(commit=False)
         self.save()
+        send_sound_index_event(self.id)
 
     def post_delete_comment(self, commit=True):
         """ When a comment is deleted this method is called to update num_comments """
@@ -1020,6 +994,7 @@ class Sound(SocialModel):
         self.mark_index_dirty(commit=False)
         if commit:
             self.save()
+            send_sound_index_event(self.id)
 
     def compute_crc(self, commit=True):
         crc = 0
@@ -1106,21 +1081,13 @@ class Sound(SocialModel):
         delete_sound_from_solr(self.id)
         delete_sound_from_gaia(self)
 
-    def invalidate_template_caches(self):
-        for is_explicit in [True, False]:
-            invalidate_template_cache("sound_header", self.id, is_explicit)
-
-        for display_random_link in [True, False]:
-            invalidate_template_cache("sound_footer_top", self.id, display_random_link)
+    def get_template_cache_version(self):
+        return get_template_cache_version('sound', self.id)
 
-        invalidate_template_cache("sound_footer_bottom", self.id)
-
-        for is_authenticated in [True, False]:
-            for is_explicit in [True, False]:
-                invalidate_template_cache("display_sound", self.id, is_authenticated, is_explicit)
-                for bw_player_size in ['small', 'middle', 'big_no_info', 'small_no_info']:
-                    invalidate_template_cache(
-                        "bw_display_sound", self.id, is_authenticated, is_explicit, bw_player_size)
+    def invalidate_template_caches(self):
+        # The version of the sound is part of the keys of all its cached template fragments (display_sound,
+        # bw_display_sound, sound_header, sound_footer_top and sound_footer_bottom)
+        bump_template_cache_version('sound', self.id)
 
     class Meta(SocialModel.Meta):
         ordering = ("-created", )
@@ -1370,6 +1337,7 @@ class Pack(SocialModel):
             return -1
 
     def remove_sounds_from_pack(self):
+        Sound.objects.invalidate_template_caches(Sound.objects.filter(pack_id=self.id).values_list('id', flat=True))
         Sound.objects.filter(pack_id=self.id).update(pack=None)
         self.process()
 
@@ -1439,6 +1407,7 @@ def update_num_downloads_on_delete(**kwargs):
         Sound.objects.filter(id=download.sound_id).update(num_downloads=F('num_downloads') - 1)
         accounts.models.Profile.objects.filter(user_id=download.user_id).update(
             num_sound_downloads=F('num_sound_downloads') - 1)
+        send_sound_index_event(download.sound_id, counter_fields=['num_downloads'])
 
 
 @receiver(post_save, sender=Download)
@@ -1449,6 +1418,7 @@ def update_num_downloads_on_insert(**kwargs):
             Sound.objects.filter(id=download.sound_id).update(num_downloads=F('num_downloads') + 1)
             accounts.models.Profile.objects.filter(user_id=download.user_id).update(
                 num_sound_downloads=F('num_sound_downloads') + 1)
+            send_sound_index_event(download.sound_id, counter_fields=['num_downloads'])
 
 
 class PackDownload(models.Model):
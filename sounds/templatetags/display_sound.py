@@ -24,6 +24,7 @@ from django import template
 from django.conf import settings
 
 from sounds.models import Sound
+from utils.sound_loader import get_sound_loader
 
 register = template.Library()
 
@@ -47,9 +48,11 @@ def display_sound(context, sound, player_size='small'):
 
     """
 
-    def get_sound_using_bulk_query_id(sound_id):
-        """Get a sound from the DB using the Sound.objects.bulk_query_id method which returns a Sound object with
-        some extra properties loaded.
+    def get_sound_using_sound_loader(sound_id):
+        """Get a sound using the SoundLoader of the request, which retrieves it from the DB with the
+        Sound.objects.bulk_query_id method (that returns a Sound object with some extra properties loaded) together
+        with all other sounds registered in the loader. Sounds already loaded in the same request are not retrieved
+        again.
 
         Args:
             sound_id (int): ID of the sound to retrieve.
@@ -59,13 +62,10 @@ def display_sound(context, sound, player_size='small'):
 
         """
         try:
-            return Sound.objects.bulk_query_id([int(sound_id)])[0]
-        except ValueError:
+            return sound_loader.get(sound_id)
+        except (ValueError, TypeError):
             # 'sound' is not an integer
             return None
-        except IndexError:
-            # No sound with given ID exists (Sound.objects.bulk_query_id returns empty qs)
-            return None
 
     def sound_object_retrieved_using_bulk_query_id(sound):
         """Checeks whether the given Sound object has the extra properties that are loaded if the object was
@@ -83,25 +83,27 @@ def display_sound(context, sound, player_size='small'):
         """
         return hasattr(sound, 'tag_array')
 
+    request = context['request']
+    sound_loader = get_sound_loader(request)
     if isinstance(sound, Sound):
         if sound_object_retrieved_using_bulk_query_id(sound):
             sound_obj = sound
+            sound_loader.add_sounds([sound_obj])
         else:
             # If 'sound' is a Sound instance but has not been retrieved using bulk_query_id, we would need to make
             # some extra DB queries to get the metadata that must be rendered. Instead, we retreive again
             # the sound using the bulk_query_id method which will get all needed maetadaata in only one query.
-            sound_obj = get_sound_using_bulk_query_id(sound.id)
+            sound_obj = get_sound_using_sound_loader(sound.id)
     else:
         # If 'sound' argument is not a Sound instance then we assume it is a sound ID and we retreive the
         # corresponding object from the DB.
-        sound_obj = get_sound_using_bulk_query_id(sound)
+        sound_obj = get_sound_using_sound_loader(sound)
 
     if sound_obj is None:
         return {
             'sound': None,
         }
     else:
-        request = context['request']
         return {
             'sound':        sound_obj,
             'sound_tags':   sound_obj.tag_array,
@@ -113,10 +115,35 @@ def display_sound(context, sound, player_size='small'):
                             (not request.user.is_authenticated or not request.user.profile.is_adult),
             'is_authenticated': request.user.is_authenticated(),
             'player_size': player_size,
+            'template_cache_version': sound_loader.get_template_cache_version(sound_obj),
             'min_num_ratings': settings.MIN_NUMBER_RATINGS,
         }
 
 
+@register.simple_tag(takes_context=True)
+def prefetch_sounds(context, sounds):
+    """This templatetag registers the sounds that will be displayed with the display_sound templatetag in the
+    SoundLoader of the request, so that all of them are retrieved from the DB with a single query. It is meant to be
+    used inside cached template fragments, so that sounds are only registered if the fragment is rendered.
+
+    Args:
+        context (django.template.Context): an object with contextual information for rendering a template. This
+          argument is automatically added by Django when calling the templatetag inside a template.
+        sounds (iterable): sound IDs or Sound objects of the sounds that will be displayed.
+
+    Returns:
+        list: list with the given sounds, which can be stored in a variable using "as" so that querysets are
+          only evaluated once, e.g. {% prefetch_sounds latest_sounds as latest_sounds %}
+
+    """
+    sounds = list(sounds)
+    sound_loader = get_sound_loader(context['request'])
+    sound_loader.add_sounds([sound for sound in sounds if isinstance(sound, Sound) and hasattr(sound, 'tag_array')])
+    sound_loader.add([sound.id if isinstance(sound, Sound) else sound for sound in sounds
+                      if not isinstance(sound, Sound) or not hasattr(sound, 'tag_array')])
+    return sounds
+
+
 @register.inclusion_tag('sounds/display_sound.html', takes_context=True)
 def display_sound_small(context, sound):
     return display_sound(context, sound, player_size='small')
@@ -0,0 +1,124 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import os
+import shutil
+import signal
+import tempfile
+
+import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from sounds.management.commands.gm_worker_processing import SizeAwareJobQueue, SlotsSupervisorGearmanWorker
+from sounds.models import Sound
+from utils.test_helpers import create_user_and_sounds
+
+
+class SizeAwareJobQueueTest(SimpleTestCase):
+
+    def test_short_sounds_first(self):
+        queue = SizeAwareJobQueue(num_slots=2, large_job_duration=600, max_queue_wait=1800)
+        queue.add({'sound_id': 1}, 1200, now=0)
+        queue.add({'sound_id': 2}, 30, now=1)
+        queue.add({'sound_id': 3}, 5, now=2)
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=10)[2], {'sound_id': 3})
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=10)[2], {'sound_id': 2})
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=10)[2], {'sound_id': 1})
+        self.assertIsNone(queue.pop(num_running_large_jobs=0, now=10))
+
+    def test_large_sounds_leave_a_slot_free(self):
+        queue = SizeAwareJobQueue(num_slots=2, large_job_duration=600, max_queue_wait=1800)
+        queue.add({'sound_id': 1}, 1200, now=0)
+        self.assertIsNone(queue.pop(num_running_large_jobs=1, now=10))
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=10)[2], {'sound_id': 1})
+
+        # With a single slot large sounds can always run
+        queue = SizeAwareJobQueue(num_slots=1, large_job_duration=600, max_queue_wait=1800)
+        queue.add({'sound_id': 1}, 1200, now=0)
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=10)[2], {'sound_id': 1})
+
+    def test_long_waiting_jobs_first(self):
+        queue = SizeAwareJobQueue(num_slots=2, large_job_duration=600, max_queue_wait=1800)
+        queue.add({'sound_id': 1}, 300, now=0)
+        queue.add({'sound_id': 2}, 5, now=1000)
+        self.assertEqual(queue.pop(num_running_large_jobs=0, now=2000)[2], {'sound_id': 1})
+
+
+class FakeProcess(object):
+    """Child process of a slot which never ends by itself, it creates a file in the temporary directory of the slot"""
+
+    def __init__(self, target, args):
+        self.args = args
+        self.pid = 12345
+        self.alive = False
+
+    def start(self):
+        self.alive = True
+        tmp_directory = tempfile.mkdtemp(prefix='processing_', dir=self.args[3])
+        open(os.path.join(tmp_directory, 'sound.wav'), 'w').close()
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+    def join(self):
+        pass
+
+
+class SlotsSupervisorGearmanWorkerTest(TestCase):
+
+    fixtures = ['licenses']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        _, _, sounds = create_user_and_sounds(num_sounds=1)
+        self.sound = sounds[0]
+        self.sound.set_processing_ongoing_state('PR')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('sounds.management.commands.gm_worker_processing.connections')
+    @mock.patch('sounds.management.commands.gm_worker_processing.multiprocessing.Process', FakeProcess)
+    @mock.patch('sounds.management.commands.gm_worker_processing.time')
+    def test_timed_out_job(self, time, connections):
+        with override_settings(PROCESSING_TEMP_DIR=self.tmp_dir):
+            worker = SlotsSupervisorGearmanWorker(
+                ['localhost:4730'], 'process_sound', num_slots=2, timeout=10, max_queued_jobs=4)
+            worker.queue.add({'sound_id': self.sound.id}, 5, now=0)
+            time.time.return_value = 100
+            worker.schedule()
+            process, = worker.running_jobs.keys()
+            self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+
+            # The process group of the job is killed once the timeout is reached, then the supervisor fails the
+            # sound and removes the temporary directory of the slot
+            time.time.return_value = 200
+            with mock.patch('os.killpg', side_effect=lambda pid, sig: process.terminate()) as killpg:
+                worker.schedule()
+            killpg.assert_called_once_with(process.pid, signal.SIGKILL)
+            self.assertEqual(worker.running_jobs, {})
+            self.assertEqual(os.listdir(self.tmp_dir), [])
+            sound = Sound.objects.get(id=self.sound.id)
+            self.assertEqual(sound.processing_state, 'FA')
+            self.assertEqual(sound.processing_ongoing_state, 'FI')
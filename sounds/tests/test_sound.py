@@ -640,24 +640,30 @@ class SoundTemplateCacheTests(TestCase):
         self.sound.change_moderation_state("OK")
         self.user = user
 
+    # Cache keys include the current version of the sound (see Sound.invalidate_template_caches), so they are
+    # represented as (fragment name, variables) tuples and computed when checking the cache
     def _get_sound_view_cache_keys(self, is_explicit=False, display_random_link=False):
-        return ([get_template_cache_key('sound_footer_bottom', self.sound.id),
-                get_template_cache_key('sound_header', self.sound.id, is_explicit)] +
+        return ([('sound_footer_bottom', ()),
+                ('sound_header', (is_explicit, ))] +
                 self._get_sound_view_footer_top_cache_keys(display_random_link))
 
     def _get_sound_view_footer_top_cache_keys(self, display_random_link=False):
-        return [get_template_cache_key('sound_footer_top', self.sound.id, display_random_link)]
+        return [('sound_footer_top', (display_random_link, ))]
 
     def _get_sound_display_cache_keys(self, is_authenticated=True, is_explicit=False):
-        return [get_template_cache_key('display_sound', self.sound.id, is_authenticated, is_explicit)]
+        return [('display_sound', (is_authenticated, is_explicit))]
+
+    def _get_cache_key(self, cache_key):
+        fragment_name, variables = cache_key
+        return get_template_cache_key(fragment_name, self.sound.id, self.sound.get_template_cache_version(), *variables)
 
     def _assertCacheAbsent(self, cache_keys):
         for cache_key in cache_keys:
-            self.assertIsNone(cache.get(cache_key))
+            self.assertIsNone(cache.get(self._get_cache_key(cache_key)))
 
     def _assertCachePresent(self, cache_keys):
         for cache_key in cache_keys:
-            self.assertIsNotNone(cache.get(cache_key))
+            self.assertIsNotNone(cache.get(self._get_cache_key(cache_key)))
 
     def _get_sound_url(self, viewname, username=None, sound_id=None):
         return reverse(viewname, args=[username or self.sound.user.username, sound_id or self.sound.id])
@@ -670,7 +676,7 @@ class SoundTemplateCacheTests(TestCase):
 
     def _print_cache(self, cache_keys):
         print(locmem._caches[''].keys())
-        print(cache_keys)
+        print([self._get_cache_key(cache_key) for cache_key in cache_keys])
 
     # Make sure the sound name and description are updated
     def test_update_description(self):
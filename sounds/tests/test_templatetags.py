@@ -113,6 +113,30 @@ class DisplaySoundTemplatetagTestCase(TestCase):
             }))
             #  If the template could not be rendered, the test will have failed by that time, no need to assert anything
 
+    @override_settings(TEMPLATES=[settings.TEMPLATES[0]])
+    def test_display_sound_with_prefetched_sounds(self):
+        """Test that when displaying several sounds registered with the prefetch_sounds templatetag, all of them are
+        retrieved with only one DB query, and sounds already loaded in the request are not retrieved again.
+        """
+        request = HttpRequest()
+        request.user = AnonymousUser()
+        sound_ids = list(Sound.objects.order_by('id').values_list('id', flat=True)[0:5])
+        template = Template("{% load display_sound %}{% prefetch_sounds sound_ids as sound_ids %}"
+                            "{% for sound_id in sound_ids %}{% display_sound sound_id %}{% endfor %}")
+        with self.assertNumQueries(1):
+            template.render(Context({
+                'sound_ids': sound_ids + [-1],
+                'request': request,
+                'media_url': 'http://example.org/'
+            }))
+        with self.assertNumQueries(0):
+            template.render(Context({
+                'sound_ids': sound_ids,
+                'request': request,
+                'media_url': 'http://example.org/'
+            }))
+        self.assertEqual(request.sound_loader.ordered_ids(sound_ids + [-1]), Sound.objects.ordered_ids(sound_ids))
+
     def test_display_sound_wrapper_view(self):
         response = self.client.get(reverse('sound-display', args=[self.sound.user.username, 921]))  # Non existent ID
         self.assertEqual(response.status_code, 404)
@@ -61,6 +61,7 @@ from utils.nginxsendfile import sendfile, prepare_sendfile_arguments_for_sound_d
 from utils.pagination import paginate
 from utils.search.search_general import get_random_sound_from_solr
 from utils.similarity_utilities import get_similar_sounds
+from utils.sound_loader import get_sound_loader
 from utils.text import remove_control_chars
 from utils.username import redirect_if_old_username_or_404
 
@@ -114,7 +115,7 @@ def sounds(request):
     popular_packs = Pack.objects.select_related('user').filter(created__gte=last_week).exclude(is_deleted=True).order_by("-num_downloads")[0:5]
     random_sound_id = get_sound_of_the_day_id()
     if random_sound_id:
-        random_sound = Sound.objects.bulk_query_id([random_sound_id])[0]
+        random_sound = get_sound_loader(request).get(random_sound_id)
     else:
         random_sound = None
     tvars = {
@@ -194,9 +195,15 @@ def front_page(request):
 
     num_latest_sounds = 5 if not using_beastwhoosh(request) else 9
     latest_sounds = Sound.objects.latest_additions(num_sounds=num_latest_sounds, period_days=2)
+    sound_loader = get_sound_loader(request)
+    if using_beastwhoosh(request):
+        # Latest and trending sounds are not displayed in cached template fragments, so they are loaded together with
+        # the random sound (in the old interface latest sounds are registered in the template with prefetch_sounds)
+        latest_sounds = list(latest_sounds)
+        sound_loader.add([sound.id for sound in latest_sounds] + (trending_sound_ids or []))
     random_sound_id = get_sound_of_the_day_id()
     if random_sound_id:
-        random_sound = Sound.objects.bulk_query_id([random_sound_id])[0]
+        random_sound = sound_loader.get(random_sound_id)
     else:
         random_sound = None
 
@@ -281,9 +288,7 @@ def sound(request, username, sound_id):
     display_random_link = request.GET.get('random_browsing', False)
     is_following = False
     if request.user.is_authenticated:
-        users_following = follow_utils.get_users_following(request.user)
-        if sound.user in users_following:
-            is_following = True
+        is_following = follow_utils.is_user_following_user(request.user, sound.user)
     is_explicit = sound.is_explicit and (not request.user.is_authenticated or not request.user.profile.is_adult)
 
     tvars = {
@@ -293,6 +298,7 @@ def sound(request, username, sound_id):
         'display_random_link': display_random_link,
         'is_following': is_following,
         'is_explicit': is_explicit,  # if the sound should be shown blurred, already checks for adult profile
+        'template_cache_version': sound.get_template_cache_version(),
         'sizes': settings.IFRAME_PLAYER_SIZE,
         'min_num_ratings': settings.MIN_NUMBER_RATINGS,
         'path': request.build_absolute_uri()  # used as "next" parameter for follow/unfollow user links in BW
@@ -540,7 +546,8 @@ def pack_edit(request, username, pack_id):
     pack = get_object_or_404(Pack, id=pack_id)
     if pack.user.username.lower() != username.lower():
         raise Http404
-    pack_sounds = ",".join([str(s.id) for s in pack.sounds.all()])
+    pack_sound_ids = [s.id for s in pack.sounds.all()]
+    pack_sounds = ",".join([str(sound_id) for sound_id in pack_sound_ids])
 
     if not (request.user.has_perm('pack.can_change') or pack.user == request.user):
         raise PermissionDenied
@@ -551,6 +558,8 @@ def pack_edit(request, username, pack_id):
         if form.is_valid():
             form.save()
             pack.sounds.all().update(is_index_dirty=True)
+            # Sounds added to or removed from the pack show the pack in their templates
+            Sound.objects.invalidate_template_caches(set(pack_sound_ids) | form.cleaned_data['pack_sounds'])
             return HttpResponseRedirect(pack.get_absolute_url())
     else:
         form = PackEditForm(instance=pack, initial=dict(pack_sounds=pack_sounds))
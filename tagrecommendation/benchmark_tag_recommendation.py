@@ -0,0 +1,88 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+"""
+Measures the latency of TagRecommender.recommend_tags for different numbers of input tags, using the similarity
+matrix of one of the classes in RECOMMENDATION_DATA_DIR or a random similarity matrix:
+
+    python benchmark_tag_recommendation.py --class-name CFX
+    python benchmark_tag_recommendation.py --num-tags 5000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from tagRecommendation import TagRecommender
+from tagRecommendation.tag_recommendation_utils import load_most_similar
+from tagrecommendation_settings import RECOMMENDATION_DATA_DIR
+from utils import loadFromJson
+
+
+def load_class_data(class_name, metric='cosine'):
+    database = loadFromJson(RECOMMENDATION_DATA_DIR + 'Current_database_and_class_names.json')['database']
+    path = RECOMMENDATION_DATA_DIR + database + '_%s_SIMILARITY_MATRIX_' % class_name + metric + '_SUBSET'
+    if os.path.exists(path + '_NEIGHBOURS_INDPTR.npy'):
+        return {'TAG_NAMES': np.load(path + '_TAG_NAMES.npy'), 'MOST_SIMILAR': load_most_similar(path)}
+    return {'TAG_NAMES': np.load(path + '_TAG_NAMES.npy'), 'SIMILARITY_MATRIX': np.load(path + '.npy')}
+
+
+def random_data(num_tags, density=0.05, seed=0):
+    random_state = np.random.RandomState(seed)
+    similarity_matrix = random_state.rand(num_tags, num_tags).astype(np.float32)
+    similarity_matrix[random_state.rand(num_tags, num_tags) > density] = 0
+    similarity_matrix = np.maximum(similarity_matrix, similarity_matrix.T)
+    np.fill_diagonal(similarity_matrix, 1.0)
+    return {'TAG_NAMES': np.array(['tag%i' % i for i in range(num_tags)]), 'SIMILARITY_MATRIX': similarity_matrix}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tag recommendation latency.')
+    parser.add_argument('--class-name', default=None, help='Use the data of this class instead of random data.')
+    parser.add_argument('--num-tags', type=int, default=3000, help='Number of tags of the random data.')
+    parser.add_argument('--input-tags', default='1,2,5,10,20,50', help='Comma separated numbers of input tags.')
+    parser.add_argument('--num-queries', type=int, default=200, help='Number of recommendations per input size.')
+    args = parser.parse_args()
+
+    data = load_class_data(args.class_name) if args.class_name else random_data(args.num_tags)
+    start = time.time()
+    recommender = TagRecommender()
+    recommender.load_data(data=data, dataset=args.class_name or 'random', metric='cosine')
+    print('%s loaded in %.2f seconds\n' % (recommender, time.time() - start))
+
+    tag_names = [tag.decode('utf-8') for tag in data['TAG_NAMES']]
+    random.seed(0)
+    print('%-12s %12s %12s' % ('input tags', 'ms/query', 'queries/s'))
+    for num_input_tags in [int(n) for n in args.input_tags.split(',')]:
+        queries = [random.sample(tag_names, min(num_input_tags, len(tag_names))) for _ in range(args.num_queries)]
+        start = time.time()
+        for input_tags in queries:
+            recommender.recommend_tags(input_tags)
+        elapsed = time.time() - start
+        print('%-12i %12.3f %12.1f' % (num_input_tags, 1000.0 * elapsed / len(queries), len(queries) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,10 @@
 #
 
 
+import os
+
 from tagRecommendation import TagRecommender
+from tagRecommendation.tag_recommendation_utils import load_most_similar
 from communityDetection import CommunityDetector
 from tagrecommendation_settings import RECOMMENDATION_DATA_DIR
 from utils import loadFromJson
@@ -69,10 +72,16 @@ class CommunityBasedTagRecommender():
             self.recommenders[class_name] = TagRecommender()
             self.recommenders[class_name].set_heuristic(self.recommendation_heuristic)
 
+            path = RECOMMENDATION_DATA_DIR + self.dataset + '_%s_SIMILARITY_MATRIX_' % class_name + self.metric + '_SUBSET'
             data = {
-                'TAG_NAMES': load(RECOMMENDATION_DATA_DIR + self.dataset + '_%s_SIMILARITY_MATRIX_' % class_name + self.metric + '_SUBSET_TAG_NAMES.npy'),
-                'SIMILARITY_MATRIX': load(RECOMMENDATION_DATA_DIR + self.dataset + '_%s_SIMILARITY_MATRIX_' % class_name + self.metric + '_SUBSET.npy'),
+                'TAG_NAMES': load(path + '_TAG_NAMES.npy'),
             }
+            if os.path.exists(path + '_NEIGHBOURS_INDPTR.npy'):
+                # Sparse most similar tags (memory-mapped), the dense similarity matrix is not needed
+                data['MOST_SIMILAR'] = load_most_similar(path)
+            else:
+                # Data generated before sparse files were written
+                data['SIMILARITY_MATRIX'] = load(path + '.npy', mmap_mode='r')
 
             self.recommenders[class_name].load_data(
                 data=data,
@@ -82,8 +91,24 @@ class CommunityBasedTagRecommender():
 
             print self.recommenders[class_name]
 
+    def update_recommenders_data(self, recommenders_data):
+        # Replace the data of class recommenders with data computed by IncrementalTagRecommendationModel
+        for class_name, data in recommenders_data.items():
+            if class_name in self.recommenders:
+                self.recommenders[class_name].load_data(
+                    data=data,
+                    dataset="%s-%s" % (self.dataset, class_name),
+                    metric=self.metric
+                )
+
     def recommend_tags(self, input_tags, max_number_of_tags=None):
         com_name = self.communityDetector.detectCommunity(input_tags)
         rec = self.recommenders[com_name].recommend_tags(input_tags)
 
-        return rec[0:max_number_of_tags], com_name
\ No newline at end of file
+        return rec[0:max_number_of_tags], com_name
+
+    def recommend_tags_batch(self, input_tags_list, max_number_of_tags=None):
+        # Same as recommend_tags for several lists of input tags, classifying all of them at once
+        com_names = self.communityDetector.detectCommunities(input_tags_list)
+        return [(self.recommenders[com_name].recommend_tags(input_tags)[0:max_number_of_tags], com_name)
+                for input_tags, com_name in zip(input_tags_list, com_names)]
\ No newline at end of file
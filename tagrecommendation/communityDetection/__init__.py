@@ -19,7 +19,8 @@
 #
 
 from sklearn.externals import joblib
-from numpy import load, where, zeros
+from numpy import load, ones
+from scipy.sparse import csr_matrix
 from utils import loadFromJson
 from tagrecommendation_settings import RECOMMENDATION_DATA_DIR
 import os
@@ -34,6 +35,8 @@ class CommunityDetector:
     init_method = None
     selected_instances = None
     tag_names = None
+    tag_columns = None
+    accepts_sparse_input = None
 
     def __init__(self,
                  verbose=True,
@@ -61,6 +64,16 @@ class CommunityDetector:
         self.class_name_ids = meta['class_name_ids']
         self.n_training_instances = meta['n_training_instances']
         self.tag_names = load(RECOMMENDATION_DATA_DIR + 'Classifier_TAG_NAMES.npy')
+        # Column of every tag in the instance vectors (first occurrence if a tag is repeated)
+        self.tag_columns = dict()
+        for column, tag in enumerate(self.tag_names):
+            self.tag_columns.setdefault(tag, column)
+        # Some classifiers (e.g. SVMs trained with dense data) only accept dense instance vectors
+        try:
+            self.clf.predict(csr_matrix((1, len(self.tag_names))))
+            self.accepts_sparse_input = True
+        except (TypeError, ValueError):
+            self.accepts_sparse_input = False
 
     def __repr__(self):
         return "Community Detector (%s, %i classes, %i instances, %s init) " % (self.clf_type,
@@ -68,21 +81,29 @@ class CommunityDetector:
                                                                                 self.n_training_instances,
                                                                                 self.init_method)
 
-    def load_instance_vector_from_tags(self, tags):
-        tags_t = tags[:]
+    def load_instance_vectors_from_tags(self, tags_list):
+        # Sparse matrix with one row per list of tags and ones in the columns of the tags
+        rows = []
+        columns = []
+        for row, tags in enumerate(tags_list):
+            tag_columns = set(self.tag_columns[tag] for tag in tags if tag in self.tag_columns)
+            rows += [row] * len(tag_columns)
+            columns += tag_columns
+        return csr_matrix((ones(len(rows)), (rows, columns)), shape=(len(tags_list), len(self.tag_names)))
 
-        instance_vector = zeros(len(self.tag_names))
-        for tag in tags_t:
-            w_out = where(self.tag_names == tag)[0]
-            if len(w_out) > 0:
-                pos = w_out[0]
-                instance_vector[pos] = 1
-        return instance_vector
+    def load_instance_vector_from_tags(self, tags):
+        return self.load_instance_vectors_from_tags([tags]).toarray()[0]
 
-    def detectCommunity(self, input_tags=None):
+    def detectCommunities(self, input_tags_list):
+        # Classify several lists of tags with a single call to the classifier
         if not self.clf:
             raise Exception("Classifier not yet trained!")
-        instance_vector = self.load_instance_vector_from_tags(input_tags)
-        cl = self.clf.predict([instance_vector])[0]
+        if not input_tags_list:
+            return []
+        instance_vectors = self.load_instance_vectors_from_tags(input_tags_list)
+        if not self.accepts_sparse_input:
+            instance_vectors = instance_vectors.toarray()
+        return [str(self.class_name_ids[unicode(cl)]) for cl in self.clf.predict(instance_vectors)]
 
-        return str(self.class_name_ids[unicode(cl)])
\ No newline at end of file
+    def detectCommunity(self, input_tags=None):
+        return self.detectCommunities([input_tags])[0]
\ No newline at end of file
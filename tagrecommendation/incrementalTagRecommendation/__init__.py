@@ -0,0 +1,164 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import cPickle
+import heapq
+import os
+from collections import Counter
+from math import sqrt
+
+from numpy import array, cumsum, float32, int32, int64
+
+
+class IncrementalTagRecommendationModel:
+    """
+    Keeps the tag occurrence and co-occurrence counts of the sounds of every class so that the data of the class tag
+    recommenders (the most similar tags of every tag, see tag_recommendation_utils.compute_most_similar) can be updated
+    when sounds are indexed, instead of recomputing all the similarity matrices with RecommendationDataProcessor.
+
+    Cosine similarity between two tags is their co-occurrence count divided by the square root of the product of
+    their occurrence counts (the norms of their columns in the association matrix). When a sound is added or removed
+    only the rows of its tags and of the tags which co-occur with them change, so only these rows are recomputed.
+    As in RecommendationDataProcessor, only tags used at least tag_threshold times (in all classes) are recommended.
+    """
+
+    def __init__(self, tag_threshold=10, N=100):
+        self.tag_threshold = tag_threshold
+        self.N = N
+        self.tag_counts = Counter()  # Occurrences of every tag in all sounds
+        self.class_tag_counts = dict()  # {class name: Counter with the occurrences of every tag in the class}
+        self.class_cooccurrences = dict()  # {class name: {tag: Counter with co-occurrences with other tags}}
+        self.class_most_similar = dict()  # {class name: {tag: [(similar tag, similarity), ...]}}
+        self.sounds = dict()  # {sound id: (class name, tags)}
+        self.changed_tags = dict()  # {class name: set of tags whose counts changed since the last update}
+        self.changed_vocabulary = set()  # Tags which started or stopped passing the threshold since the last update
+
+    def __repr__(self):
+        return "Incremental Tag Recommendation Model (%i sounds, %i classes, %i tags)" % (
+            len(self.sounds), len(self.class_tag_counts), len(self.tag_counts))
+
+    @property
+    def classes(self):
+        return self.class_tag_counts.keys()
+
+    def add_sound(self, sound_id, tags, class_name):
+        """
+        Adds the tags of a sound to the counts of the given class. If the sound was already added, its previous tags
+        are removed first.
+        """
+        self.remove_sound(sound_id)
+        tags = list(set(tags))
+        self.sounds[sound_id] = (class_name, tags)
+        self.__update_counts(class_name, tags, 1)
+
+    def remove_sound(self, sound_id):
+        if sound_id in self.sounds:
+            class_name, tags = self.sounds.pop(sound_id)
+            self.__update_counts(class_name, tags, -1)
+
+    def __update_counts(self, class_name, tags, increment):
+        tag_counts = self.class_tag_counts.setdefault(class_name, Counter())
+        cooccurrences = self.class_cooccurrences.setdefault(class_name, dict())
+        changed_tags = self.changed_tags.setdefault(class_name, set())
+        for tag in tags:
+            in_vocabulary = self.__in_vocabulary(tag)
+            self.tag_counts[tag] += increment
+            if self.__in_vocabulary(tag) != in_vocabulary:
+                self.changed_vocabulary.add(tag)
+            tag_counts[tag] += increment
+            tag_cooccurrences = cooccurrences.setdefault(tag, Counter())
+            for other_tag in tags:
+                if other_tag != tag:
+                    tag_cooccurrences[other_tag] += increment
+            changed_tags.add(tag)
+        # Counts which drop to zero are deleted when the rows of the tags are recomputed, so that tags whose rows
+        # contained them can still be found
+
+    def __in_vocabulary(self, tag):
+        return self.tag_counts[tag] >= self.tag_threshold
+
+    def __compute_row(self, class_name, tag):
+        tag_counts = self.class_tag_counts[class_name]
+        cooccurrences = self.class_cooccurrences[class_name]
+        most_similar = self.class_most_similar.setdefault(class_name, dict())
+        if tag in tag_counts and tag_counts[tag] <= 0:
+            del tag_counts[tag]
+            cooccurrences.pop(tag, None)
+        tag_cooccurrences = cooccurrences.get(tag, Counter())
+        for other_tag in [other_tag for other_tag, count in tag_cooccurrences.items() if count <= 0]:
+            del tag_cooccurrences[other_tag]
+
+        if tag not in tag_counts or not self.__in_vocabulary(tag):
+            most_similar.pop(tag, None)
+            return
+        norm = sqrt(tag_counts[tag])
+        similarities = [(count / (norm * sqrt(tag_counts[other_tag])), other_tag)
+                        for other_tag, count in tag_cooccurrences.items() if self.__in_vocabulary(other_tag)]
+        most_similar[tag] = [(other_tag, similarity) for similarity, other_tag in heapq.nlargest(self.N, similarities)]
+
+    def update(self, class_names=None):
+        """
+        Recomputes the rows of the tags affected by the sounds added or removed since the last update. Returns a
+        dictionary with the recommender data (see get_data) of the classes which changed and of class_names.
+        """
+        changed_vocabulary, self.changed_vocabulary = self.changed_vocabulary, set()
+        updated_data = dict()
+        for class_name in self.classes:
+            changed_tags = self.changed_tags.pop(class_name, set())
+            cooccurrences = self.class_cooccurrences[class_name]
+            changed_tags.update(tag for tag in changed_vocabulary if tag in cooccurrences)
+            if changed_tags:
+                # Rows of tags which co-occur with changed tags have a changed similarity in the changed tags columns
+                affected_tags = set(changed_tags)
+                for tag in changed_tags:
+                    affected_tags.update(cooccurrences.get(tag, ()))
+                for tag in affected_tags:
+                    self.__compute_row(class_name, tag)
+            if changed_tags or (class_names and class_name in class_names):
+                updated_data[class_name] = self.get_data(class_name)
+        return updated_data
+
+    def get_data(self, class_name):
+        """
+        Returns the data of the tag recommender of a class, in the same format as the data loaded by
+        CommunityBasedTagRecommender.load_recommenders.
+        """
+        most_similar = self.class_most_similar.get(class_name, dict())
+        tag_names = sorted(most_similar.keys())
+        tag_index = dict((tag, idx) for idx, tag in enumerate(tag_names))
+        indices = [tag_index[other_tag] for tag in tag_names for other_tag, _ in most_similar[tag]]
+        similarities = [similarity for tag in tag_names for _, similarity in most_similar[tag]]
+        indptr = cumsum([0] + [len(most_similar[tag]) for tag in tag_names]).astype(int64)
+        return {
+            'TAG_NAMES': array(tag_names, dtype=unicode),
+            'TAG_INDEX': tag_index,
+            'MOST_SIMILAR': (indptr, array(indices, dtype=int32), array(similarities, dtype=float32)),
+        }
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump(self, f, protocol=cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
@@ -19,12 +19,16 @@
 #
 
 from tagrecommendation_settings import RECOMMENDATION_TMP_DATA_DIR, RECOMMENDATION_DATA_DIR
-import fileinput, sys, os
-from utils import saveToJson, mtx2npy, loadFromJson
-from numpy import save, load, where, in1d
+import fileinput, sys, os, time
+from collections import Counter
+from itertools import islice
+from utils import saveToJson, mtx2npy, loadFromJson, iterateJsonObject
+from numpy import save, load, where, in1d, ones, array, int64
 from math import sqrt
 from pysparse import spmatrix
 from communityDetection import CommunityDetector
+from tagRecommendation.heuristics import heuristics
+from tagRecommendation.tag_recommendation_utils import compute_most_similar, save_most_similar
 from datetime import datetime
 import urllib
 
@@ -52,8 +56,12 @@ class RecommendationDataProcessor:
 
     The files that are generated by the system are:
     (for every sound class: Soundscape, Music, Fx, Samples, Speech)
-    [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET.npy
+    [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_INDPTR.npy
+    [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_INDICES.npy
+    [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_SIMILARITIES.npy
     [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_TAG_NAMES.npy
+    The NEIGHBOURS files store the most similar tags of every tag of the similarity matrix in CSR format (see
+    tag_recommendation_utils.compute_most_similar), which is all the tag recommender needs.
     '''
 
     verbose = None
@@ -65,113 +73,89 @@ class RecommendationDataProcessor:
         return "RecommendationDataProcessor instance"
 
     def tas_to_association_matrix(self, tag_threshold=0, line_limit=1000000000):
-
-        index = loadFromJson(RECOMMENDATION_DATA_DIR + "Index.json")
-        # Get tags from file
-        ts = []
-        idx = 0
-        n_original_associations = 0
-        sound_ids = []
+        """
+        Builds the resource x tag association matrix from Index.json. The index file is read twice as a stream (it is
+        never loaded as a whole): the first pass counts tag occurrences and the second collects the (resource, tag)
+        pairs of the tags that pass the threshold, which are then put in the matrix at once.
+        """
+        index_path = RECOMMENDATION_DATA_DIR + "Index.json"
+        stage_start = time.time()
+
+        # First pass: count tag occurrences
         if self.verbose:
-            print "Reading index file (%i entries)..." % len(index.items()),
-        for sid, tags in index.items():
-            ts += tags
+            print "Reading index file and counting tag occurrences...",
+        sys.stdout.flush()
+        tag_occurrences = Counter()
+        n_original_associations = 0
+        n_sounds = 0
+        for sid, tags in islice(iterateJsonObject(index_path), line_limit + 1):
+            tag_occurrences.update(tags)
             n_original_associations += len(tags)
-            sound_ids.append(sid)
-
-            idx += 1
-            if idx > line_limit:
-                break
+            n_sounds += 1
 
         stats = {
-            'n_sounds_in_matrix': len(sound_ids),
+            'n_sounds_in_matrix': n_sounds,
             #'biggest_id': max([int(sid) for sid in sound_ids])
         }
         saveToJson(RECOMMENDATION_TMP_DATA_DIR + 'Current_index_stats.json', stats)
         if self.verbose:
-            print "done!"
-
-        # Compute tag ocurrences after loading the file
-        tag_occurrences = dict()
-        unique_ts = list(set(ts))
-        for id, t in enumerate(unique_ts):
-            tag_occurrences[t] = ts.count(t)
+            print "done! (%i entries, %.2f seconds)" % (n_sounds, time.time() - stage_start)
 
-            if self.verbose:
-                sys.stdout.write("\rComputing tag occurrences %.2f%%"%(float(100*(id+1))/len(unique_ts)))
-                sys.stdout.flush()
-        print ""
+        # Filter tags
+        stage_start = time.time()
+        unique_ts = list(tag_occurrences.keys())
         tags = []
         tags_ids = []
         for id, t in enumerate(unique_ts):
-
             if tag_occurrences[t] >= tag_threshold:
                 tags.append(t)
                 tags_ids.append(id)
-
-            if self.verbose:
-                sys.stdout.write("\rFiltering tags %.2f%%"%(float(100*(id+1))/len(unique_ts)))
-                sys.stdout.flush()
+        tag_positions = dict((t, position) for position, t in enumerate(tags))
 
         nTags = len(tags)
         if self.verbose:
-            print ""
+            print "Filtering tags... done! (%.2f seconds)" % (time.time() - stage_start)
             print "\tOriginal number of tags: " + str(len(unique_ts))
             print "\tTags after filtering: " + str(nTags)
 
-        # Generate resource-tags dictionary only with filtered tags
+        # Second pass: generate resource-tags dictionary only with filtered tags and the positions of the non zero
+        # elements of the association matrix
+        stage_start = time.time()
         if self.verbose:
             print "Reading file for resources...",
         sys.stdout.flush()
         res_tags = {}
-        res_user = {}
-        res_tags_no_filt = {}
-        idx = 0
-        n_filtered_associations = 0
-        for sid, stags in index.items():
-            resource = sid
-            user = None
-            assigned_tags = stags
-            assigned_tags_filt = list(set(assigned_tags).intersection(set(tags)))
-            res_tags_no_filt[resource] = assigned_tags
-            res_user[resource] = user
+        resources = []
+        rows = []
+        columns = []
+        for sid, stags in islice(iterateJsonObject(index_path), line_limit + 1):
+            assigned_tags_filt = list(set(t for t in stags if t in tag_positions))
             if len(assigned_tags_filt) > 0:
-                res_tags[resource] = assigned_tags_filt
-                n_filtered_associations += len(assigned_tags_filt)
-
-            idx += 1
-            if idx > line_limit:
-                break
-
-        resources = res_tags.keys()
+                res_tags[sid] = assigned_tags_filt
+                rows += [len(resources)] * len(assigned_tags_filt)
+                columns += [tag_positions[t] for t in assigned_tags_filt]
+                resources.append(sid)
+        n_filtered_associations = len(rows)
         nResources = len(resources)
-        resources_ids = range(0,nResources)
         if self.verbose:
-            print "done!"
+            print "done! (%.2f seconds)" % (time.time() - stage_start)
 
         # Generate assocoation matrix
         if self.verbose:
             print "\tOriginal number of associations: " + str(n_original_associations)
             print "\tAssociations after filtering: " + str(n_filtered_associations)
 
+        stage_start = time.time()
         if self.verbose:
-            print 'Creating empty array of ' + str(nResources) + ' x ' + str(nTags) + '...',
-        M = spmatrix.ll_mat(nResources, nTags)
-        if self.verbose:
-            print 'done!'
-
-        done = 0
-        for r_id in resources:
-            for t in res_tags[r_id]:
-                M[resources.index(r_id),tags.index(t)] = 1
-                done += 1
-                if self.verbose:
-                    sys.stdout.write("\rGenerating association matrix %.2f%%" % (float(100*done)/n_filtered_associations))
-                    sys.stdout.flush()
+            print 'Generating association matrix of ' + str(nResources) + ' x ' + str(nTags) + '...',
+        sys.stdout.flush()
+        M = spmatrix.ll_mat(nResources, nTags, n_filtered_associations)
+        M.put(ones(n_filtered_associations), array(rows, dtype=int64), array(columns, dtype=int64))
         if self.verbose:
-            print ""
+            print 'done! (%.2f seconds)' % (time.time() - stage_start)
 
         # Save data
+        stage_start = time.time()
         if self.verbose:
             print "Saving association matrix, resource ids, tag ids and tag names"
 
@@ -183,6 +167,8 @@ class RecommendationDataProcessor:
         saveToJson(RECOMMENDATION_TMP_DATA_DIR + filename + '_RESOURCES_TAGS.json',res_tags, verbose = self.verbose)
         #saveToJson(RECOMMENDATION_TMP_DATA_DIR + filename + '_RESOURCES_TAGS_NO_FILTER.json',res_tags_no_filt, verbose = self.verbose)
         #saveToJson(RECOMMENDATION_TMP_DATA_DIR + filename + '_RESOURCES_USER.json',res_user, verbose = self.verbose)
+        if self.verbose:
+            print "Saved data (%.2f seconds)" % (time.time() - stage_start)
 
         return filename
 
@@ -193,7 +179,8 @@ class RecommendationDataProcessor:
                                                 save_sim=False,
                                                 training_set=None,
                                                 out_name_prefix="",
-                                                is_general_recommender=False):
+                                                is_general_recommender=False,
+                                                most_similar_N=heuristics['hRankPercentage015']['options']['cNMostSimilar_N']):
 
         if self.verbose:
             print "Loading association matrix and tag names, ids files..."
@@ -240,11 +227,11 @@ class RecommendationDataProcessor:
 
         if save_sim:
             if not is_general_recommender:
-                # Save sim
-                path = RECOMMENDATION_TMP_DATA_DIR + dataset + "_%s_SIMILARITY_MATRIX_" % out_name_prefix + metric + "_SUBSET.npy"
+                # Save most similar tags of every tag (sparse)
+                path = RECOMMENDATION_TMP_DATA_DIR + dataset + "_%s_SIMILARITY_MATRIX_" % out_name_prefix + metric + "_SUBSET"
                 if self.verbose:
-                    print "Saving to " + path + "..."
-                save(path, sim_matrix_npy)
+                    print "Saving to " + path + "_NEIGHBOURS_*.npy..."
+                save_most_similar(path, compute_most_similar(sim_matrix_npy, most_similar_N))
 
                 # Save tag names
                 path = RECOMMENDATION_TMP_DATA_DIR + dataset + "_%s_SIMILARITY_MATRIX_" % out_name_prefix + metric + "_SUBSET_TAG_NAMES.npy"
@@ -288,15 +275,17 @@ class RecommendationDataProcessor:
         except Exception as e:
             resource_class = dict()
 
-        for count, id in enumerate(instances_ids):
-            if not recompute_all_classes:
-                if id not in resource_class:
-                    resource_class[id] = cd.detectCommunity(input_tags=resources_tags[id])
-            else:
-                resource_class[id] = cd.detectCommunity(input_tags=resources_tags[id])
+        if not recompute_all_classes:
+            instances_ids = [id for id in instances_ids if id not in resource_class]
+        # Resources are classified in batches, with a single call to the classifier per batch
+        batch_size = 10000
+        for start in range(0, len(instances_ids), batch_size):
+            batch_ids = instances_ids[start:start + batch_size]
+            classes = cd.detectCommunities([resources_tags[id] for id in batch_ids])
+            resource_class.update(zip(batch_ids, classes))
 
             if self.verbose:
-                sys.stdout.write("\rClassifying resources... %.2f%%"%(float(100*(count+1))/len(instances_ids)))
+                sys.stdout.write("\rClassifying resources... %.2f%%"%(float(100*(start+len(batch_ids)))/len(instances_ids)))
                 sys.stdout.flush()
 
         print ""
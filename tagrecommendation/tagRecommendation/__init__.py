@@ -19,6 +19,7 @@
 #
 
 from heuristics import heuristics
+from tag_recommendation_utils import compute_most_similar
 
 
 class TagRecommender:
@@ -34,7 +35,7 @@ class TagRecommender:
 
     def __repr__(self):
         if self.data:
-            size = self.data['SIMILARITY_MATRIX'].shape[0]
+            size = self.data['TAG_NAMES'].shape[0]
         else:
             size = -1
 
@@ -48,19 +49,39 @@ class TagRecommender:
             self.heuristic = heuristic
         else:
             raise Exception("Wrong heuristic given")
+        if self.data:
+            self.prepare_data()
 
     def load_data(self, dataset=None, metric=None, data=None):
         self.data = data
         self.dataset = dataset
         self.metric = metric
+        if self.data:
+            self.prepare_data()
+
+    def prepare_data(self):
+        # Precompute the row of every tag and the most similar tags of every row so that recommending tags only
+        # needs to look up the rows of the input tags
+        if 'TAG_INDEX' not in self.data:
+            self.data['TAG_INDEX'] = dict((tag.decode('utf-8'), idx) for idx, tag in enumerate(self.data['TAG_NAMES']))
+        # Most similar tags are computed from the similarity matrix unless they were loaded precomputed from disk (see
+        # RecommendationDataProcessor), in which case they have been computed with the default N of the heuristic
+        N = self.heuristic['options']['cNMostSimilar_N']
+        if 'MOST_SIMILAR' not in self.data or \
+                ('SIMILARITY_MATRIX' in self.data and self.data.get('MOST_SIMILAR_N') != N):
+            self.data['MOST_SIMILAR'] = compute_most_similar(self.data['SIMILARITY_MATRIX'], N)
+            self.data['MOST_SIMILAR_N'] = N
 
     def recommend_tags(self, input_tags=None):
 
+        # Data can be replaced while recommending (see CommunityBasedTagRecommender.update_recommenders_data), use
+        # the same data in all steps
+        data = self.data
         if not input_tags:
             raise Exception("No input tags specified")
         if not self.heuristic:
             raise Exception("No heuristic specified (use 'set_heuristic()')")
-        if not self.data:
+        if not data:
             raise Exception("No data has been loaded (use 'load_data()')")
 
         # Prepare variables
@@ -69,10 +90,10 @@ class TagRecommender:
         selectAlgorithm = self.heuristic['s']
 
         # CHOOSE candidate tags
-        candidate_tags = chooseAlgorithm(input_tags, self.data['TAG_NAMES'], self.data['SIMILARITY_MATRIX'], self.heuristic['options'])
+        candidate_tags = chooseAlgorithm(input_tags, data, self.heuristic['options'])
 
         # AGGREGATE candidate tags
-        aggregated_candiate_tags, aggregated_candiate_tags_list = aggregateAlgorithm(candidate_tags, input_tags, self.heuristic['options'])
+        aggregated_candiate_tags, aggregated_candiate_tags_list = aggregateAlgorithm(candidate_tags, input_tags, data, self.heuristic['options'])
 
         # SELECT the number of tags to recommend
         if len(aggregated_candiate_tags_list) > 1:
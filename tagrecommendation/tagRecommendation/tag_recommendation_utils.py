@@ -19,60 +19,90 @@
 #
 
 
-import operator
 from numpy import *
 
 
-def cNMostSimilar(input_tags, tag_names, similarity_matrix, options):
-
+def compute_most_similar(similarity_matrix, N):
+    """
+    Computes the N most similar tags of every tag (excluding the most similar one, which is the tag itself) and
+    returns them in CSR format as a tuple of arrays (indptr, indices, similarities): the most similar tags of row i are
+    indices[indptr[i]:indptr[i + 1]], sorted by similarity.
+    """
+    rows_indices = []
+    rows_similarities = []
+    for idx in range(similarity_matrix.shape[0]):
+        row_idx = nonzero(similarity_matrix[idx,:])[0]
+        row = similarity_matrix[idx,row_idx]
+        most_similar_idx = row.argsort()[-N-1:-1][::-1] # We pick the first N most similar tags (practically the same as no threshold but more efficient)
+        rows_indices.append(row_idx[most_similar_idx].astype(int32))
+        rows_similarities.append(row[most_similar_idx].astype(float32))
+    indptr = concatenate([[0], cumsum([len(row) for row in rows_indices])]).astype(int64)
+    return indptr, concatenate(rows_indices + [array([], dtype=int32)]), \
+        concatenate(rows_similarities + [array([], dtype=float32)])
+
+
+def save_most_similar(path, most_similar):
+    indptr, indices, similarities = most_similar
+    save(path + '_NEIGHBOURS_INDPTR.npy', indptr)
+    save(path + '_NEIGHBOURS_INDICES.npy', indices)
+    save(path + '_NEIGHBOURS_SIMILARITIES.npy', similarities)
+
+
+def load_most_similar(path, mmap_mode='r'):
+    return load(path + '_NEIGHBOURS_INDPTR.npy', mmap_mode=mmap_mode), \
+        load(path + '_NEIGHBOURS_INDICES.npy', mmap_mode=mmap_mode), \
+        load(path + '_NEIGHBOURS_SIMILARITIES.npy', mmap_mode=mmap_mode)
+
+
+def cNMostSimilar(input_tags, data, options):
+    """
+    Returns the candidate tags as a tuple of arrays (tag rows, ranks). For every input tag, its N most similar tags
+    which are not input tags are candidates with ranks N, N-1, ...
+    """
     N = options['cNMostSimilar_N']
-    unicode_tag_names = [t.decode('utf-8') for t in tag_names]
-    candidate_tags = []
-    for tag in input_tags:
-        # Check that tag exists in the tag matrix, if it does not exist we cannot recommend similar tags
-        if tag in unicode_tag_names:
-            # Find N most similar tags in the row
-            idx = unicode_tag_names.index(tag)
-            #where(tag_names == tag)[0][0]
-            row_idx = nonzero(similarity_matrix[idx,:])
-            row_idx = row_idx[0]
-            row = similarity_matrix[idx,row_idx]
-            MAX = N
-            most_similar_idx = row.argsort()[-MAX-1:-1][::-1] # We pick the first N most similar tags (practically the same as no threshold but more efficient)
-            most_similar_dist = row[most_similar_idx]
-            most_similar_tags = tag_names[row_idx[most_similar_idx]]
-
-            rank = N
-            for count,item in enumerate(most_similar_tags):
-                if item not in input_tags:
-                    candidate_tags.append( {'name':item, 'rank':rank, 'dist':most_similar_dist[count], 'from':tag} )
-                    rank -= 1
-                else:
-                    pass # recommended tag was already present in input tags
-        else:
-            pass  # If tag does not exist we do not recommend anything. Maybe we could do something else here
-
-    return candidate_tags
-
-
-def aNormalizedRankSum(candidate_tags, input_tags, options):
+    # If a tag does not exist in the tag matrix we do not recommend anything for it
+    input_idx = array([data['TAG_INDEX'][tag] for tag in input_tags if tag in data['TAG_INDEX']], dtype=int64)
+    indptr, indices, _ = data['MOST_SIMILAR']
+    if not len(input_idx) or not len(indices):
+        return array([], dtype=int32), array([], dtype=int32)
 
-    factor = options['aNormalizedRankSum_factor']
+    # Gather the N most similar tags of all input tags in a (input tags, N) matrix padded with -1
+    starts = indptr[input_idx]
+    lengths = minimum(indptr[input_idx + 1] - starts, N)
+    positions = starts[:, newaxis] + arange(N)
+    most_similar = where(arange(N) < lengths[:, newaxis], indices[minimum(positions, len(indices) - 1)], -1)
+
+    # One extra element so that -1 padding indices map to a non input tag
+    is_input_tag = zeros(len(indptr), dtype=bool)
+    is_input_tag[input_idx] = True
+    is_candidate = (most_similar >= 0) & ~is_input_tag[most_similar]
+    ranks = N + 1 - cumsum(is_candidate, axis=1)
+    return most_similar[is_candidate], ranks[is_candidate]
 
-    candidate_tags.sort(key=operator.itemgetter('rank'))
-    candidate_tags.reverse()
-
-    aggregated_candiate_tags = {}
-    for item in candidate_tags:
-        if item['name'] in aggregated_candiate_tags: # Item already there
-            aggregated_candiate_tags[item['name']] = (aggregated_candiate_tags[item['name']] + float(item['rank'])/(len(input_tags))) * factor
-        else:
-            aggregated_candiate_tags[item['name']] = float(item['rank'])/(len(input_tags))
-    aggregated_candiate_tags_list = []
-    for key in aggregated_candiate_tags.keys():
-        aggregated_candiate_tags_list.append({"name":key, "rank": aggregated_candiate_tags[key]})
-    aggregated_candiate_tags_list.sort(key=operator.itemgetter('rank'))
-    aggregated_candiate_tags_list.reverse()
+
+def aNormalizedRankSum(candidate_tags, input_tags, data, options):
+
+    factor = options['aNormalizedRankSum_factor']
+    candidate_idx, ranks = candidate_tags
+    scores = ranks / float(len(input_tags))
+
+    if factor != 1.0:
+        # Ranks of the same tag are aggregated from the highest to the lowest as ((r1 + r2) * factor + r3) * factor...
+        # so r1 and r2 are multiplied by factor^(k-1), r3 by factor^(k-2), ... and rk by factor
+        order = lexsort((-scores, candidate_idx))
+        candidate_idx, scores = candidate_idx[order], scores[order]
+        counts = bincount(candidate_idx)
+        group_start = cumsum(counts) - counts
+        position = arange(len(candidate_idx)) - group_start[candidate_idx]
+        scores = scores * factor ** (counts[candidate_idx] - maximum(position, 1))
+
+    aggregated_scores = bincount(candidate_idx, weights=scores)
+    aggregated_idx = nonzero(bincount(candidate_idx))[0]
+    aggregated_idx = aggregated_idx[argsort(-aggregated_scores[aggregated_idx], kind='mergesort')]
+    tag_names = data['TAG_NAMES'][aggregated_idx]
+    aggregated_candiate_tags_list = [{"name": name, "rank": rank}
+                                     for name, rank in zip(tag_names, aggregated_scores[aggregated_idx].tolist())]
+    aggregated_candiate_tags = dict((item['name'], item['rank']) for item in aggregated_candiate_tags_list)
 
     return aggregated_candiate_tags, aggregated_candiate_tags_list
 
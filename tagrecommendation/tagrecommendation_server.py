@@ -27,16 +27,21 @@ from __future__ import print_function
 
 import json
 import logging
+import os
 
 import cloghandler
 import graypy
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 from twisted.web import server, resource
 
 from communityBasedTagRecommendation import CommunityBasedTagRecommender
+from incrementalTagRecommendation import IncrementalTagRecommendationModel
+from tagRecommendation.heuristics import heuristics
 import tagrecommendation_settings as tr_settings
 from utils import loadFromJson, saveToJson
 
+logger = logging.getLogger('tagrecommendation')
+
 
 def server_interface(resource):
     return {
@@ -53,6 +58,11 @@ class TagRecommendationServer(resource.Resource):
         self.methods = server_interface(self)
         self.isLeaf = False
 
+        self.incremental_model = None
+        self.incremental_update_running = False
+        self.incremental_update_all_classes = False
+        self.pending_sounds = []
+        self.n_sounds_since_model_save = 0
         self.load()
 
     def load(self):
@@ -80,7 +90,7 @@ class TagRecommendationServer(resource.Resource):
             }
 
         try:
-            self.index = loadFromJson(tr_settings.RECOMMENDATION_DATA_DIR, 'Index.json')
+            self.index = loadFromJson(tr_settings.RECOMMENDATION_DATA_DIR + 'Index.json')
             self.index_stats['biggest_id_in_index'] = max([int(key) for key in self.index.keys()])
             self.index_stats['n_sounds_in_index'] = len(self.index.keys())
         except Exception as e:
@@ -89,6 +99,79 @@ class TagRecommendationServer(resource.Resource):
             self.index_stats['n_sounds_in_index'] = 0
             self.index = dict()
 
+        if tr_settings.INCREMENTAL_UPDATES and self.cbtr:
+            # Replace the data loaded from disk with the data of the incremental model
+            self.run_incremental_update(all_classes=True)
+
+    def run_incremental_update(self, all_classes=False):
+        # Sounds are added to the incremental model and the affected recommendation data is recomputed in a thread.
+        # The data of the recommenders is then replaced in the reactor thread, so requests are not stopped while the
+        # data is recomputed as with reload() (although they are slower while the thread holds the GIL to update or
+        # save the model). Only one update runs at a time, sounds added in the meantime are processed in the next
+        # update.
+        self.incremental_update_all_classes = self.incremental_update_all_classes or all_classes
+        if self.incremental_update_running or not self.cbtr or \
+                not (self.pending_sounds or self.incremental_update_all_classes):
+            return
+        sounds, self.pending_sounds = self.pending_sounds, []
+        all_classes, self.incremental_update_all_classes = self.incremental_update_all_classes, False
+        index = dict(self.index) if self.incremental_model is None else None
+        self.incremental_update_running = True
+        d = threads.deferToThread(self.compute_incremental_update, self.cbtr, sounds, all_classes, index)
+        d.addCallback(self.incremental_update_done, self.cbtr)
+        d.addErrback(self.incremental_update_failed)
+
+    def compute_incremental_update(self, cbtr, sounds, all_classes, index):
+        # Runs in a thread, the incremental model is only used from here
+        model_path = tr_settings.RECOMMENDATION_DATA_DIR + 'Incremental_model.pkl'
+        if self.incremental_model is None:
+            if os.path.exists(model_path):
+                self.incremental_model = IncrementalTagRecommendationModel.load(model_path)
+                logger.info('Loaded %s' % self.incremental_model)
+            else:
+                self.incremental_model = IncrementalTagRecommendationModel(
+                    tag_threshold=tr_settings.TAG_THRESHOLD,
+                    N=heuristics[cbtr.recommendation_heuristic]['options']['cNMostSimilar_N'])
+                logger.info('Building incremental model from the index (%i sounds)' % len(index))
+            # Add sounds of the index which are not in the model (e.g. added before the model was last saved)
+            sounds = [(sound_id, tags) for sound_id, tags in index.items()
+                      if set(self.incremental_model.sounds.get(sound_id, (None, []))[1]) != set(tags)] + sounds
+            self.n_sounds_since_model_save = tr_settings.INCREMENTAL_MODEL_SAVE_INTERVAL
+
+        resource_class = dict()
+        if index is not None:
+            # Reuse the classes computed by RecommendationDataProcessor for the sounds of the index
+            try:
+                resource_class = loadFromJson(
+                    tr_settings.RECOMMENDATION_DATA_DIR + 'Classifier_classified_resources.json')
+            except Exception:
+                pass
+        # Sounds without a known class are classified with a single call to the classifier
+        unclassified_sounds = [(sound_id, tags) for sound_id, tags in sounds if sound_id not in resource_class]
+        resource_class.update(zip([sound_id for sound_id, _ in unclassified_sounds],
+                                  cbtr.communityDetector.detectCommunities([tags for _, tags in unclassified_sounds])))
+        for sound_id, tags in sounds:
+            self.incremental_model.add_sound(sound_id, tags, resource_class[sound_id])
+        recommenders_data = self.incremental_model.update(class_names=cbtr.classes if all_classes else None)
+
+        self.n_sounds_since_model_save += len(sounds)
+        if self.n_sounds_since_model_save >= tr_settings.INCREMENTAL_MODEL_SAVE_INTERVAL:
+            self.incremental_model.save(model_path)
+            self.n_sounds_since_model_save = 0
+        return recommenders_data
+
+    def incremental_update_done(self, recommenders_data, cbtr):
+        self.incremental_update_running = False
+        # If the server was reloaded during the update, data of all classes will be replaced in the next update
+        if cbtr is self.cbtr:
+            self.cbtr.update_recommenders_data(recommenders_data)
+            logger.info('Updated recommendation data of classes %s incrementally' % ', '.join(recommenders_data.keys()))
+        self.run_incremental_update()
+
+    def incremental_update_failed(self, failure):
+        self.incremental_update_running = False
+        logger.error('Errors occurred while updating recommendation data incrementally (%s)' % failure.getErrorMessage())
+
     def error(self,message):
         return json.dumps({'Error': message})
 
@@ -131,7 +214,8 @@ class TagRecommendationServer(resource.Resource):
 
     def add_to_index(self, sound_ids, sound_tagss):
         sound_ids = sound_ids[0].split(",")
-        sound_tags = [stags.split(",") for stags in sound_tagss[0].split("-!-!-")]
+        # Request arguments are utf-8 byte strings, tags are stored as unicode as when the index is loaded from disk
+        sound_tags = [[tag.decode('utf-8') for tag in stags.split(",")] for stags in sound_tagss[0].split("-!-!-")]
         logger.info('Adding %i sounds to recommendation index' % len(sound_ids))
 
         for count, sound_id in enumerate(sound_ids):
@@ -146,6 +230,10 @@ class TagRecommendationServer(resource.Resource):
             self.index_stats['biggest_id_in_index'] = max([int(key) for key in self.index.keys()])
             self.index_stats['n_sounds_in_index'] = len(self.index.keys())
 
+        if tr_settings.INCREMENTAL_UPDATES:
+            self.pending_sounds += zip(sound_ids, sound_tags)
+            self.run_incremental_update()
+
         result = {'error': False, 'result': True}
         return json.dumps(result)
 
@@ -154,7 +242,6 @@ if __name__ == '__main__':
     # Set up logging
     if not tr_settings.LOG_TO_STDOUT:
         print("LOG_TO_STDOUT is False, will not log")
-    logger = logging.getLogger('tagrecommendation')
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     if tr_settings.LOG_TO_FILE:
@@ -26,6 +26,13 @@ LOGFILE = '/var/log/freesound/tagrecommendation.log'
 LISTEN_PORT = 8010
 RECOMMENDATION_DATA_DIR = '/freesound-data/tag_recommendation_models/'
 RECOMMENDATION_TMP_DATA_DIR = os.path.join(RECOMMENDATION_DATA_DIR, 'tmp')
+# Minimum number of times that a tag must have been used to be recommended
+TAG_THRESHOLD = 10
+# Update the recommendation data of the running server as sounds are added to the index (see
+# IncrementalTagRecommendationModel) instead of only when update_tagrecommendation_data.py is run
+INCREMENTAL_UPDATES = False
+# Number of sounds added to the index after which the incremental model is saved to disk
+INCREMENTAL_MODEL_SAVE_INTERVAL = 1000
 
 # Graylog GELF endpoint
 LOGSERVER_IP_ADDRESS = 'IP_ADDRESS'
@@ -54,11 +61,16 @@ LOG_TO_FILE = False
 # docker-compose run tagrecommendation  bash -c "cd /code; python update_tagrecommendation_data.py"
 #
 # For every class used:
-#   [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET.npy
+#   [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_INDPTR.npy
+#   [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_INDICES.npy
+#   [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_SIMILARITIES.npy
 #   [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET_TAG_NAMES.npy
 # Example:
-#   FREESOUND2012_CFX_SIMILARITY_MATRIX_cosine_SUBSET.npy
+#   FREESOUND2012_CFX_SIMILARITY_MATRIX_cosine_SUBSET_NEIGHBOURS_INDPTR.npy
+#   ...
 #   FREESOUND2012_CFX_SIMILARITY_MATRIX_cosine_SUBSET_TAG_NAMES.npy
+# (data generated by older versions with a dense [[DATABASE]]_[[CLASSNAME]]_SIMILARITY_MATRIX_cosine_SUBSET.npy file
+# instead of the NEIGHBOURS files can still be loaded)
 #   ...
 #
 # Once the files are generated, some remaining might be needed here and there and the recommendation system can be
@@ -0,0 +1,81 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+# These tests need the dependencies of the tag recommendation service (see requirements.txt) and are skipped if they
+# are not installed. Run them in the tagrecommendation container with: python -m unittest tests
+
+import shutil
+import tempfile
+import unittest
+
+import tagrecommendation_settings as tr_settings
+try:
+    from tagrecommendation_server import TagRecommendationServer
+except ImportError:
+    TagRecommendationServer = None
+
+
+class FakeCommunityDetector(object):
+    def detectCommunities(self, tags_list):
+        return ['Music' for _ in tags_list]
+
+
+class FakeCommunityBasedTagRecommender(object):
+    classes = ['Music']
+    recommendation_heuristic = 'hRankPercentage015'
+    communityDetector = FakeCommunityDetector()
+
+
+@unittest.skipIf(TagRecommendationServer is None, 'Tag recommendation service dependencies are not installed')
+class IncrementalUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.settings = dict((name, getattr(tr_settings, name)) for name in
+                             ['RECOMMENDATION_DATA_DIR', 'INCREMENTAL_UPDATES', 'TAG_THRESHOLD'])
+        tr_settings.RECOMMENDATION_DATA_DIR = self.data_dir + '/'
+        tr_settings.INCREMENTAL_UPDATES = True
+        tr_settings.TAG_THRESHOLD = 1
+        self.server = TagRecommendationServer()  # No recommendation data in data_dir, so updates are not started
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(tr_settings, name, value)
+        shutil.rmtree(self.data_dir)
+
+    def test_add_to_index_non_ascii_tags(self):
+        # Tags are received as utf-8 byte strings and must be counted as the same tags loaded from Index.json
+        self.server.index = {u'1': [u'caf\xe9', u'birds']}
+        self.server.add_to_index(sound_ids=['2,3'],
+                                 sound_tagss=[u'caf\xe9,field-recording-!-!-caf\xe9,birds'.encode('utf-8')])
+        self.assertEqual(self.server.index['2'], [u'caf\xe9', u'field-recording'])
+        self.assertEqual(self.server.pending_sounds, [('2', [u'caf\xe9', u'field-recording']),
+                                                      ('3', [u'caf\xe9', u'birds'])])
+
+        recommenders_data = self.server.compute_incremental_update(
+            FakeCommunityBasedTagRecommender(), self.server.pending_sounds, False, dict(self.server.index))
+        model = self.server.incremental_model
+        self.assertEqual(model.tag_counts, {u'caf\xe9': 3, u'birds': 2, u'field-recording': 1})
+        data = recommenders_data['Music']
+        self.assertEqual(sorted(data['TAG_NAMES']), [u'birds', u'caf\xe9', u'field-recording'])
+        indptr, indices, _ = data['MOST_SIMILAR']
+        row = data['TAG_INDEX'][u'caf\xe9']
+        self.assertEqual(sorted(data['TAG_NAMES'][indices[indptr[row]:indptr[row + 1]]]),
+                         [u'birds', u'field-recording'])
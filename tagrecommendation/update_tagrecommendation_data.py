@@ -20,8 +20,9 @@
 
 
 from recommendationDataProcessor import RecommendationDataProcessor
+from tagrecommendation_settings import TAG_THRESHOLD
 
 rdp = RecommendationDataProcessor()
-rdp.process_tag_recommendation_data(tag_threshold=10, line_limit=9999999999999999)
+rdp.process_tag_recommendation_data(tag_threshold=TAG_THRESHOLD, line_limit=9999999999999999)
 rdp.clear_temp_files()
 #rdp.rollback_last_backup()
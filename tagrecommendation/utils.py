@@ -29,6 +29,65 @@ def loadFromJson(path, verbose=False):
             print "Loading data from '" + path + "'"
         return json.load(f)
 
+def iterateJsonObject(path, chunk_size=2 ** 20):
+    """
+    Iterates over the (key, value) items of a file containing a JSON object without loading the whole file in memory:
+    the file is read in chunks and values are decoded one at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        state = {'buffer': '', 'position': 0, 'eof': False}
+
+        def read_more():
+            if state['eof']:
+                raise ValueError("Unexpected end of JSON file '%s'" % path)
+            chunk = f.read(chunk_size)
+            state['eof'] = not chunk
+            state['buffer'] = state['buffer'][state['position']:] + chunk
+            state['position'] = 0
+
+        def next_char():
+            # Returns the next non whitespace character without consuming it
+            while True:
+                buf = state['buffer']
+                while state['position'] < len(buf) and buf[state['position']].isspace():
+                    state['position'] += 1
+                if state['position'] < len(buf):
+                    return buf[state['position']]
+                if state['eof']:
+                    return None
+                read_more()
+
+        def decode():
+            # Decodes the next value, only accepting it if it is not at the end of the buffer (it could be truncated)
+            while True:
+                try:
+                    value, end = decoder.raw_decode(state['buffer'], state['position'])
+                    if end < len(state['buffer']) or state['eof']:
+                        state['position'] = end
+                        return value
+                except ValueError:
+                    if state['eof']:
+                        raise
+                read_more()
+
+        if next_char() != '{':
+            raise ValueError("File '%s' does not contain a JSON object" % path)
+        state['position'] += 1
+        while True:
+            char = next_char()
+            if char == '}':
+                return
+            if char == ',':
+                state['position'] += 1
+                next_char()
+            key = decode()
+            if next_char() != ':':
+                raise ValueError("Expected ':' in JSON file '%s'" % path)
+            state['position'] += 1
+            next_char()
+            yield key, decode()
+
 def saveToJson(path="", data="", verbose=True):
     with open(path, mode='w') as f:
         if verbose:
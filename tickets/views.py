@@ -447,6 +447,8 @@ def moderation_assigned(request, user_id):
                 # 'is_explicit' field and leave it as the user originally set it
 
                 Sound.objects.filter(ticket__in=tickets).update(**sounds_update_params)
+                Sound.objects.invalidate_template_caches(
+                    Sound.objects.filter(ticket__in=tickets).values_list('id', flat=True))
 
                 if msg:
                     notification = Ticket.NOTIFICATION_APPROVED_BUT
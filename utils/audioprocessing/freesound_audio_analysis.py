@@ -24,6 +24,7 @@ import shutil
 from django.conf import settings
 
 import utils.audioprocessing.processing as audioprocessing
+import utils.audioprocessing.processing_artifacts as processing_artifacts
 from utils.audioprocessing.freesound_audio_processing import FreesoundAudioProcessorBase
 from utils.audioprocessing.processing import AudioProcessingException
 from utils.filesystem import create_directories, TemporaryDirectory
@@ -36,6 +37,28 @@ class FreesoundAudioAnalyzer(FreesoundAudioProcessorBase):
         super(FreesoundAudioAnalyzer, self).set_failure(message, error)
         self.sound.set_analysis_state(failure_state)
 
+    def restore_analysis_artifacts(self):
+        """
+        Restores the analysis files of an analyzed sound with the same md5 (see
+        utils.audioprocessing.processing_artifacts) if this sound has no analysis files.
+        :return: True if the analysis files have been restored and analysis is finished
+        """
+        location_keys = processing_artifacts.ANALYSIS_LOCATION_KEYS
+        if any(os.path.exists(self.sound.locations(location_key)) for location_key in location_keys):
+            return False
+        try:
+            if not processing_artifacts.restore_artifacts(self.sound, location_keys):
+                return False
+        except (IOError, OSError) as e:
+            self.log_info("could not reuse analysis files of sounds with the same md5: %s" % e)
+            return False
+
+        self.log_info("reused analysis files of a sound with the same md5 (%s)" % self.sound.md5)
+        self.sound.set_analysis_state('OK')
+        self.sound.set_similarity_state('PE')  # Set similarity to PE so sound will get indexed to Gaia
+        copy_analysis_to_mirror_locations(self.sound)
+        return True
+
     def analyze(self):
 
         with TemporaryDirectory(
@@ -43,6 +66,10 @@ class FreesoundAudioAnalyzer(FreesoundAudioProcessorBase):
                 dir=settings.PROCESSING_TEMP_DIR) as tmp_directory:
 
             try:
+                # Reuse the analysis files of a sound with the same contents if this sound has not been analyzed
+                if settings.REUSE_PROCESSING_ARTIFACTS and self.restore_analysis_artifacts():
+                    return True
+
                 # Get the path of the original sound and convert to PCM
                 sound_path = self.get_sound_path()
                 tmp_wavefile = self.convert_to_pcm(sound_path, tmp_directory)
@@ -90,4 +117,11 @@ class FreesoundAudioAnalyzer(FreesoundAudioProcessorBase):
         # Copy analysis files to mirror locations
         copy_analysis_to_mirror_locations(self.sound)
 
+        # Store analysis files so that sounds with the same contents can reuse them
+        if settings.REUSE_PROCESSING_ARTIFACTS:
+            try:
+                processing_artifacts.store_artifacts(self.sound, processing_artifacts.ANALYSIS_LOCATION_KEYS)
+            except (IOError, OSError) as e:
+                self.log_error("could not store analysis files for reuse: %s" % e)
+
         return True
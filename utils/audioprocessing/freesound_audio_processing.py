@@ -21,11 +21,14 @@
 import logging
 import os
 import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
 
 import color_schemes
 import utils.audioprocessing.processing as audioprocessing
+import utils.audioprocessing.processing_artifacts as processing_artifacts
 from sounds.models import Sound
 from utils.audioprocessing.processing import AudioProcessingException
 from utils.filesystem import create_directories, TemporaryDirectory
@@ -130,6 +133,67 @@ class FreesoundAudioProcessor(FreesoundAudioProcessorBase):
         self.sound.set_processing_ongoing_state("FI")
         self.sound.change_processing_state("FA", processing_log=self.work_log)
 
+    def restore_processing_artifacts(self, skip_previews=False, skip_displays=False):
+        """
+        Restores the previews, displays and audio info fields of a processed sound with the same md5 (see
+        utils.audioprocessing.processing_artifacts). Sounds which already have some processing outputs are not
+        restored, so processing an already processed sound again computes everything again.
+        :return: True if the outputs have been restored and processing is finished
+        """
+        all_location_keys = processing_artifacts.PREVIEW_LOCATION_KEYS + processing_artifacts.DISPLAY_LOCATION_KEYS
+        if any(os.path.exists(self.sound.locations(location_key)) for location_key in all_location_keys):
+            return False
+        audio_info = processing_artifacts.load_audio_info(self.sound.md5)
+        if audio_info is None:
+            return False
+        location_keys = (processing_artifacts.PREVIEW_LOCATION_KEYS if not skip_previews else []) + \
+                        (processing_artifacts.DISPLAY_LOCATION_KEYS if not skip_displays else [])
+        try:
+            if not processing_artifacts.restore_artifacts(self.sound, location_keys):
+                return False
+        except (IOError, OSError) as e:
+            self.log_info("could not reuse processing outputs of sounds with the same md5: %s" % e)
+            return False
+
+        if self.sound.type in ["mp3", "ogg", "m4a"]:
+            audio_info['bitdepth'] = 0  # mp3 and ogg don't have bitdepth
+        self.sound.set_audio_info_fields(**audio_info)
+        self.log_info("reused processing outputs of a sound with the same md5 (%s)" % self.sound.md5)
+
+        self.sound.set_processing_ongoing_state("FI")
+        self.sound.change_processing_state("OK", processing_log=self.work_log)
+        copy_previews_to_mirror_locations(self.sound)
+        copy_displays_to_mirror_locations(self.sound)
+        return True
+
+    def encode_previews(self, input_filename, previews):
+        """
+        Runs the given preview encodes concurrently, at most settings.PROCESSING_MAX_PARALLEL_PREVIEW_ENCODES at a time.
+        Encoders run in external processes, so threads are enough to run them in parallel.
+        :param input_filename: PCM file to encode
+        :param previews: list of (format, output_path, quality) tuples, format being 'mp3' or 'ogg'
+        :return: list with the (elapsed time, exception or None) of every preview in the same order
+        """
+        convert_functions = {"mp3": audioprocessing.convert_to_mp3, "ogg": audioprocessing.convert_to_ogg}
+
+        def encode(preview):
+            format_name, output_path, quality = preview
+            convert_function = convert_functions[format_name]
+            start_time = time.time()
+            try:
+                convert_function(input_filename, output_path, quality)
+                error = None
+            except Exception as e:
+                error = e
+            return time.time() - start_time, error
+
+        pool = ThreadPool(max(1, min(settings.PROCESSING_MAX_PARALLEL_PREVIEW_ENCODES, len(previews))))
+        try:
+            return pool.map(encode, previews)
+        finally:
+            pool.close()
+            pool.join()
+
     def process(self, skip_previews=False, skip_displays=False):
 
         with TemporaryDirectory(
@@ -139,6 +203,14 @@ class FreesoundAudioProcessor(FreesoundAudioProcessorBase):
             # Change ongoing processing state to "processing" in Sound model
             self.sound.set_processing_ongoing_state("PR")
 
+            # Reuse the outputs of a sound with the same contents if this sound has not been processed before
+            if settings.REUSE_PROCESSING_ARTIFACTS and self.restore_processing_artifacts(skip_previews, skip_displays):
+                return True
+
+            # Outputs shared with other sounds must not be overwritten
+            processing_artifacts.unlink_shared_files(
+                self.sound, processing_artifacts.PREVIEW_LOCATION_KEYS + processing_artifacts.DISPLAY_LOCATION_KEYS)
+
             # Get the path of the original sound and convert to PCM
             try:
                 sound_path = self.get_sound_path()
@@ -207,40 +279,32 @@ class FreesoundAudioProcessor(FreesoundAudioProcessorBase):
                     self.set_failure("could not create directory for previews")
                     return False
 
-                # Generate MP3 previews
-                for mp3_path, quality in [(self.sound.locations("preview.LQ.mp3.path"), 70),
-                                          (self.sound.locations("preview.HQ.mp3.path"), 192)]:
-                    try:
-                        audioprocessing.convert_to_mp3(tmp_wavefile2, mp3_path, quality)
-                    except OSError as e:
-                        self.set_failure("conversion to mp3 (preview) has failed, "
-                                         "make sure that lame executable exists: %s" % e)
-                        return False
-
-                    except AudioProcessingException as e:
-                        self.set_failure("conversion to mp3 (preview) has failed", e)
-                        return False
-                    except Exception as e:
-                        self.set_failure("unhandled exception generating MP3 previews", e)
-                        return False
-                    self.log_info("created mp3: " + mp3_path)
-
-                # Generate OGG previews
-                for ogg_path, quality in [(self.sound.locations("preview.LQ.ogg.path"), 1),
-                                          (self.sound.locations("preview.HQ.ogg.path"), 6)]:
-                    try:
-                        audioprocessing.convert_to_ogg(tmp_wavefile2, ogg_path, quality)
-                    except OSError as e:
-                        self.set_failure("conversion to ogg (preview) has failed, "
-                                         "make sure that oggenc executable exists: %s" % e)
-                        return False
-                    except AudioProcessingException as e:
-                        self.set_failure("conversion to ogg (preview) has failed", e)
-                        return False
-                    except Exception as e:
-                        self.set_failure("unhandled exception generating OGG previews", e)
-                        return False
-                    self.log_info("created ogg: " + ogg_path)
+                # Generate MP3 and OGG previews
+                # All encoders read the same stereofied PCM file, which is decoded only once. Encoders run
+                # concurrently, at most settings.PROCESSING_MAX_PARALLEL_PREVIEW_ENCODES at a time
+                previews = [("mp3", self.sound.locations("preview.LQ.mp3.path"), 70),
+                            ("mp3", self.sound.locations("preview.HQ.mp3.path"), 192),
+                            ("ogg", self.sound.locations("preview.LQ.ogg.path"), 1),
+                            ("ogg", self.sound.locations("preview.HQ.ogg.path"), 6)]
+                results = self.encode_previews(tmp_wavefile2, previews)
+
+                for (format_name, preview_path, _), (elapsed_time, error) in zip(previews, results):
+                    if error is None:
+                        self.log_info("created %s in %.2f seconds: %s" % (format_name, elapsed_time, preview_path))
+
+                # Report the first error in the order of the previews
+                for (format_name, _, _), (_, error) in zip(previews, results):
+                    if error is None:
+                        continue
+                    executable = {"mp3": "lame", "ogg": "oggenc"}[format_name]
+                    if isinstance(error, OSError):
+                        self.set_failure("conversion to %s (preview) has failed, "
+                                         "make sure that %s executable exists: %s" % (format_name, executable, error))
+                    elif isinstance(error, AudioProcessingException):
+                        self.set_failure("conversion to %s (preview) has failed" % format_name, error)
+                    else:
+                        self.set_failure("unhandled exception generating %s previews" % format_name.upper(), error)
+                    return False
 
             # Generate display images for different sizes and colour scheme front-ends
             if not skip_displays:
@@ -254,27 +318,28 @@ class FreesoundAudioProcessor(FreesoundAudioProcessorBase):
                     return False
 
                 # Generate display images, M and L sizes for NG and BW front-ends
-                for width, height, color_scheme, waveform_path, spectral_path in [
-                    (120, 71, color_schemes.FREESOUND2_COLOR_SCHEME,
-                     self.sound.locations("display.wave.M.path"), self.sound.locations("display.spectral.M.path")),
-                    (900, 201, color_schemes.FREESOUND2_COLOR_SCHEME,
-                     self.sound.locations("display.wave.L.path"), self.sound.locations("display.spectral.L.path")),
-                    (195, 101, color_schemes.BEASTWHOOSH_COLOR_SCHEME,
-                     self.sound.locations("display.wave_bw.M.path"), self.sound.locations("display.spectral_bw.M.path")),
-                    (780, 301, color_schemes.BEASTWHOOSH_COLOR_SCHEME,
-                     self.sound.locations("display.wave_bw.L.path"), self.sound.locations("display.spectral_bw.L.path")),
-                ]:
-                    try:
-                        fft_size = 2048
-                        audioprocessing.create_wave_images(tmp_wavefile2, waveform_path, spectral_path, width, height,
-                                                           fft_size, color_scheme=color_scheme)
+                # All images are generated at once so the audio file is only read and analyzed once
+                images = [
+                    (self.sound.locations("display.wave.M.path"), self.sound.locations("display.spectral.M.path"),
+                     120, 71, color_schemes.FREESOUND2_COLOR_SCHEME),
+                    (self.sound.locations("display.wave.L.path"), self.sound.locations("display.spectral.L.path"),
+                     900, 201, color_schemes.FREESOUND2_COLOR_SCHEME),
+                    (self.sound.locations("display.wave_bw.M.path"), self.sound.locations("display.spectral_bw.M.path"),
+                     195, 101, color_schemes.BEASTWHOOSH_COLOR_SCHEME),
+                    (self.sound.locations("display.wave_bw.L.path"), self.sound.locations("display.spectral_bw.L.path"),
+                     780, 301, color_schemes.BEASTWHOOSH_COLOR_SCHEME),
+                ]
+                try:
+                    fft_size = 2048
+                    audioprocessing.create_multiple_wave_images(tmp_wavefile2, images, fft_size)
+                    for waveform_path, spectral_path, _, _, _ in images:
                         self.log_info("created wave and spectrogram images: %s, %s" % (waveform_path, spectral_path))
-                    except AudioProcessingException as e:
-                        self.set_failure("creation of display images has failed", e)
-                        return False
-                    except Exception as e:
-                        self.set_failure("unhandled exception while generating displays", e)
-                        return False
+                except AudioProcessingException as e:
+                    self.set_failure("creation of display images has failed", e)
+                    return False
+                except Exception as e:
+                    self.set_failure("unhandled exception while generating displays", e)
+                    return False
 
         # Change processing state and processing ongoing state in Sound model
         self.sound.set_processing_ongoing_state("FI")
@@ -284,4 +349,13 @@ class FreesoundAudioProcessor(FreesoundAudioProcessorBase):
         copy_previews_to_mirror_locations(self.sound)
         copy_displays_to_mirror_locations(self.sound)
 
+        # Store outputs so that sounds with the same contents can reuse them
+        if settings.REUSE_PROCESSING_ARTIFACTS:
+            try:
+                processing_artifacts.store_artifacts(
+                    self.sound, processing_artifacts.PREVIEW_LOCATION_KEYS + processing_artifacts.DISPLAY_LOCATION_KEYS,
+                    audio_info=info)
+            except (IOError, OSError) as e:
+                self.log_error("could not store processing outputs for reuse: %s" % e)
+
         return True
@@ -25,6 +25,7 @@ from __future__ import print_function
 import math
 import os
 import re
+import struct
 import subprocess
 
 import numpy
@@ -64,54 +65,139 @@ class TestAudioFile(object):
         return numpy.random.random(will_read) * 2 - 1
 
 
-def get_max_level(filename):
-    max_value = 0
-    buffer_size = 4096
-    audio_file = pysndfile.PySndfile(filename, 'r')
-    n_samples_left = audio_file.frames()
+def read_samples(input_filename, block_size=2 ** 20):
+    """
+    Reads all the samples of an audio file, selecting the left channel only if it has more than one. If the file can
+    not be read until the end (this can happen with a broken header) the samples which could not be read are zeros.
+    Returns the samples (float32) and the sample rate.
+    """
+    audio_file = pysndfile.PySndfile(input_filename, 'r')
+    samplerate = audio_file.samplerate()
+    nframes = audio_file.frames()
+    samples = numpy.zeros(nframes, dtype=numpy.float32)
 
-    while n_samples_left:
-        to_read = min(buffer_size, n_samples_left)
+    for start in range(0, nframes, block_size):
+        to_read = min(block_size, nframes - start)
 
         try:
-            samples = audio_file.read_frames(to_read)
+            block = audio_file.read_frames(to_read, dtype=numpy.float32)
         except RuntimeError:
             # this can happen with a broken header
             break
 
         # convert to mono by selecting left channel only
         if audio_file.channels() > 1:
-            samples = samples[:, 0]
+            block = block[:, 0]
 
-        max_value = max(max_value, numpy.abs(samples).max())
-
-        n_samples_left -= to_read
+        samples[start:start + len(block)] = block
 
     audio_file.close()
 
-    return max_value
+    return samples, samplerate
+
+
+# sample formats of WAV files which can be memory-mapped, (format code, bits per sample): (dtype, scale to [-1, 1))
+WAV_MEMMAP_FORMATS = {
+    (1, 16): ('<i2', 1.0 / 2 ** 15),
+    (1, 32): ('<i4', 1.0 / 2 ** 31),
+    (3, 32): ('<f4', 1.0),
+}
+
+
+def memmap_wav_samples(input_filename):
+    """
+    Memory-maps the samples of the left channel of a WAV file, so that samples are read from disk when they are used
+    instead of loading the whole file in memory. Only 16 and 32 bit integer and 32 bit float PCM files are supported.
+    If the data chunk is longer than the file (this can happen with a broken header) only the samples in the file are
+    mapped. Returns the samples (in the sample format of the file), the factor which scales them to [-1, 1) and the
+    sample rate, or None if the file can not be memory-mapped.
+    """
+    with open(input_filename, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = chunk_header[:4], struct.unpack('<I', chunk_header[4:])[0]
+            if chunk_id == b'data':
+                data_offset = f.tell()
+                break
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size % 2, os.SEEK_CUR)  # chunks are word aligned
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    if fmt is None or len(fmt) < 16:
+        return None
+    audio_format, channels, samplerate, _, block_align, bits_per_sample = struct.unpack('<HHIIHH', fmt[:16])
+    if audio_format == 0xFFFE and len(fmt) >= 26:
+        # WAVE_FORMAT_EXTENSIBLE, the format code is at the start of the sub format GUID
+        audio_format = struct.unpack('<H', fmt[24:26])[0]
+    if (audio_format, bits_per_sample) not in WAV_MEMMAP_FORMATS or block_align != channels * bits_per_sample / 8:
+        return None
+    dtype, scale = WAV_MEMMAP_FORMATS[(audio_format, bits_per_sample)]
+
+    nframes = min(chunk_size, os.path.getsize(input_filename) - data_offset) // block_align
+    if not nframes:
+        return numpy.zeros(0, dtype=dtype), scale, samplerate
+    samples = numpy.memmap(input_filename, dtype=dtype, mode='r', offset=data_offset, shape=(nframes, channels))
+    # convert to mono by selecting left channel only (a view of the mapped file)
+    return samples[:, 0], scale, samplerate
+
+
+def open_samples(input_filename):
+    """
+    Returns the samples of the left channel of an audio file, the factor which scales them to [-1, 1) and the sample
+    rate. Samples of WAV files are memory-mapped (see memmap_wav_samples), samples of other files are read in memory
+    (see read_samples).
+    """
+    memmap = memmap_wav_samples(input_filename)
+    if memmap is not None:
+        return memmap
+    samples, samplerate = read_samples(input_filename)
+    return samples, 1.0, samplerate
+
+
+def get_samples_max_level(samples, scale, block_size=2 ** 20):
+    """ maximum absolute value of the samples, computed in blocks so that mapped samples are not loaded at once """
+
+    max_level = 0
+    for start in range(0, len(samples), block_size):
+        max_level = max(max_level, numpy.abs(samples[start:start + block_size].astype(numpy.float64)).max())
+    return max_level * scale
+
+
+def get_max_level(filename):
+    samples, scale, _ = open_samples(filename)
+    return get_samples_max_level(samples, scale)
 
 
 class AudioProcessor(object):
     """
-    The audio processor processes chunks of audio an calculates the spectrac centroid and the peak
-    samples in that chunk of audio.
+    The audio processor calculates the spectral centroids, spectra and peak samples of the columns of waveform and
+    spectrogram images. The spectra of all the columns of an image are computed with batched numpy operations, instead
+    of seeking and reading the file for every column. Samples of WAV files are memory-mapped, so only the samples
+    around the columns being computed are in memory.
     """
 
-    def __init__(self, input_filename, fft_size, window_function=numpy.hanning):
-        max_level = get_max_level(input_filename)
+    # number of FFT frames computed at once (bounds the memory used by images with many columns)
+    fft_batch_size = 256
 
-        self.audio_file = pysndfile.PySndfile(input_filename, 'r')
-        self.nframes = self.audio_file.frames()
-        self.samplerate = self.audio_file.samplerate()
+    def __init__(self, input_filename, fft_size, window_function=numpy.hanning):
+        self.samples, self.sample_scale, self.samplerate = open_samples(input_filename)
+        self.nframes = len(self.samples)
         self.fft_size = fft_size
         self.window = window_function(self.fft_size)
-        self.spectrum_range = None
         self.lower = 100
         self.higher = 22050
         self.lower_log = math.log10(self.lower)
         self.higher_log = math.log10(self.higher)
-        self.clip = lambda val, low, high: min(high, max(low, val))
+
+        max_level = get_samples_max_level(self.samples, self.sample_scale)
 
         # figure out what the maximum value is for an FFT doing the FFT of a DC signal
         fft = numpy.fft.rfft(numpy.ones(fft_size) * self.window)
@@ -119,130 +205,77 @@ class AudioProcessor(object):
         # set the scale to normalized audio and normalized FFT
         self.scale = 1.0 / max_level / max_fft if max_level > 0 else 1
 
-    def read(self, start, size, resize_if_less=False):
-        """ read size samples starting at start, if resize_if_less is True and less than size
-        samples are read, resize the array to size and fill with zeros """
-
-        # number of zeros to add to start and end of the buffer
-        add_to_start = 0
-        add_to_end = 0
-
-        if start < 0:
-            # the first FFT window starts centered around zero
-            if size + start <= 0:
-                return numpy.zeros(size) if resize_if_less else numpy.array([])
-            else:
-                self.audio_file.seek(0)
-
-                add_to_start = -start  # remember: start is negative!
-                to_read = size + start
-
-                if to_read > self.nframes:
-                    add_to_end = to_read - self.nframes
-                    to_read = self.nframes
-        else:
-            self.audio_file.seek(start)
-
-            to_read = size
-            if start + to_read >= self.nframes:
-                to_read = self.nframes - start
-                add_to_end = size - to_read
-
-        try:
-            samples = self.audio_file.read_frames(to_read)
-        except RuntimeError:
-            # this can happen for wave files with broken headers...
-            return numpy.zeros(size) if resize_if_less else numpy.zeros(2)
-
-        # convert to mono by selecting left channel only
-        if self.audio_file.channels() > 1:
-            samples = samples[:, 0]
+    def seek_points(self, image_width):
+        """ first sample of every column of an image with image_width columns, followed by the number of samples """
 
-        if resize_if_less and (add_to_start > 0 or add_to_end > 0):
-            if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=0)
+        samples_per_pixel = self.nframes / float(image_width)
+        return (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
 
-            if add_to_end > 0:
-                samples = numpy.resize(samples, size)
-                samples[size - add_to_end:] = 0
+    def frames(self, seek_points):
+        """ fft_size samples centered around every seek point, zero padded before and after the audio """
 
-        return samples
+        if not self.nframes:
+            return numpy.zeros((len(seek_points), self.fft_size))
+        positions = seek_points[:, numpy.newaxis] - self.fft_size / 2 + numpy.arange(self.fft_size)
+        inside = (positions >= 0) & (positions < self.nframes)
+        return numpy.where(inside, self.samples[positions.clip(0, self.nframes - 1)] * self.sample_scale, 0.0)
 
-    def spectral_centroid(self, seek_point, spec_range=110.0):
-        """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
+    def spectral_centroids(self, seek_points, spec_range=110.0):
+        """ calculate the spectral centroid and the db spectrum of the fft_size samples starting at every seek point """
 
-        samples = self.read(seek_point - self.fft_size / 2, self.fft_size, True)
+        spectral_centroids = numpy.zeros(len(seek_points))
+        db_spectra = numpy.zeros((len(seek_points), self.fft_size / 2 + 1))
+        spectrum_range = numpy.arange(self.fft_size / 2 + 1)
+        length = numpy.float64(len(spectrum_range))
 
-        samples *= self.window
-        fft = numpy.fft.rfft(samples)
-        spectrum = self.scale * numpy.abs(fft)  # normalized abs(FFT) between 0 and 1
-        length = numpy.float64(spectrum.shape[0])
+        for start in range(0, len(seek_points), self.fft_batch_size):
+            end = start + self.fft_batch_size
+            fft = numpy.fft.rfft(self.frames(seek_points[start:end]) * self.window, axis=1)
+            # normalized abs(FFT) between 0 and 1 (numpy.abs is much slower than this for complex arrays)
+            spectra = self.scale * numpy.sqrt(fft.real ** 2 + fft.imag ** 2)
 
-        # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
-        db_spectrum = ((20 * (numpy.log10(spectrum + 1e-60))).clip(-spec_range, 0.0) + spec_range) / spec_range
+            # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
+            db_spectra[start:end] = \
+                ((20 * (numpy.log10(spectra + 1e-60))).clip(-spec_range, 0.0) + spec_range) / spec_range
 
-        energy = spectrum.sum()
-        spectral_centroid = 0
-
-        if energy > 1e-60:
-            # calculate the spectral centroid
-
-            if self.spectrum_range is None:
-                self.spectrum_range = numpy.arange(length)
-
-            spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.samplerate * 0.5
+            # calculate the spectral centroid of the frames with energy
+            energies = spectra.sum(axis=1)
+            with_energy = energies > 1e-60
+            centroids = spectra[with_energy].dot(spectrum_range) / (energies[with_energy] * (length - 1)) * \
+                self.samplerate * 0.5
 
             # clip > log10 > scale between 0 and 1
-            spectral_centroid = (math.log10(self.clip(spectral_centroid, self.lower, self.higher)) - self.lower_log) / (
-                        self.higher_log - self.lower_log)
-
-        return spectral_centroid, db_spectrum
-
-    def peaks(self, start_seek, end_seek):
-        """ read all samples between start_seek and end_seek, then find the minimum and maximum peak
-        in that range. Returns that pair in the order they were found. So if min was found first,
-        it returns (min, max) else the other way around. """
-
-        # larger blocksizes are faster but take more mem...
-        # Aha, Watson, a clue, a tradeof!
-        block_size = 4096
-
-        max_index = -1
-        max_value = -1
-        min_index = -1
-        min_value = 1
-
-        if start_seek < 0:
-            start_seek = 0
-
-        if end_seek > self.nframes:
-            end_seek = self.nframes
-
-        if end_seek <= start_seek:
-            samples = self.read(start_seek, 1)
-            return samples[0], samples[0]
-
-        if block_size > end_seek - start_seek:
-            block_size = end_seek - start_seek
-
-        for i in range(start_seek, end_seek, block_size):
-            samples = self.read(i, block_size)
-
-            local_max_index = numpy.argmax(samples)
-            local_max_value = samples[local_max_index]
-
-            if local_max_value > max_value:
-                max_value = local_max_value
-                max_index = local_max_index
-
-            local_min_index = numpy.argmin(samples)
-            local_min_value = samples[local_min_index]
-
-            if local_min_value < min_value:
-                min_value = local_min_value
-                min_index = local_min_index
+            spectral_centroids[start:end][with_energy] = \
+                (numpy.log10(centroids.clip(self.lower, self.higher)) - self.lower_log) / \
+                (self.higher_log - self.lower_log)
+
+        return spectral_centroids, db_spectra
+
+    def peaks(self, seek_points):
+        """ find the minimum and maximum peak in the samples between every pair of consecutive seek points. Returns two
+        arrays with the peaks of every column in the order they were found. So if the min of a column was found first,
+        its peaks are (min, max) else the other way around. Columns without samples take the sample at their seek
+        point as both peaks. """
+
+        num_columns = len(seek_points) - 1
+        first_peaks = numpy.zeros(num_columns, dtype=numpy.float32)
+        second_peaks = numpy.zeros(num_columns, dtype=numpy.float32)
+        if not self.nframes:
+            return first_peaks, second_peaks
+
+        # the samples of every column are a view of the samples of the file (mapped samples are only read from disk
+        # here), argmin and argmax give the first occurrence of the peaks
+        for x, (start_seek, end_seek) in enumerate(zip(seek_points[:-1].tolist(), seek_points[1:].tolist())):
+            samples = self.samples[start_seek:max(end_seek, start_seek + 1)]
+            min_index = samples.argmin()
+            max_index = samples.argmax()
+
+            if min_index < max_index:
+                first_peaks[x], second_peaks[x] = samples[min_index], samples[max_index]
+            else:
+                first_peaks[x], second_peaks[x] = samples[max_index], samples[min_index]
 
-        return (min_value, max_value) if min_index < max_index else (max_value, min_value)
+        return first_peaks * self.sample_scale, second_peaks * self.sample_scale
 
 
 def interpolate_colors(colors, flat=False, num_colors=256):
@@ -317,6 +350,13 @@ class WaveformImage(object):
 
         self.draw_anti_aliased_pixels(x, y1, y2, line_color)
 
+    def draw_waveform(self, first_peaks, second_peaks, spectral_centroids):
+        """ draw the peaks of all columns """
+
+        for x, (peak1, peak2, spectral_centroid) in enumerate(
+                zip(first_peaks.tolist(), second_peaks.tolist(), spectral_centroids.tolist())):
+            self.draw_peaks(x, (peak1, peak2), spectral_centroid)
+
     def draw_anti_aliased_pixels(self, x, y1, y2, color):
         """ vertical anti-aliasing at y1 and y2 """
 
@@ -366,12 +406,11 @@ class SpectrogramImage(object):
         self.image_height = image_height
         self.fft_size = fft_size
 
-        self.image = Image.new("RGB", (image_height, image_width))
-        self.palette = interpolate_colors(COLOR_SCHEMES.get(color_scheme,
-                                                            COLOR_SCHEMES[DEFAULT_COLOR_SCHEME_KEY])['spec_colors'])
+        self.palette = numpy.array(interpolate_colors(
+            COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES[DEFAULT_COLOR_SCHEME_KEY])['spec_colors']), dtype=numpy.uint8)
 
         # generate the lookup which translates y-coordinate to fft-bin
-        self.y_to_bin = []
+        y_to_bin = []
         f_min = 100.0
         f_max = 22050.0
         y_min = math.log10(f_min)
@@ -383,25 +422,26 @@ class SpectrogramImage(object):
             if bin < self.fft_size / 2:
                 alpha = bin - int(bin)
 
-                self.y_to_bin.append((int(bin), alpha * 255))
+                y_to_bin.append((int(bin), alpha * 255))
 
-        # this is a bit strange, but using image.load()[x,y] = ... is
-        # a lot slower than using image.putadata and then rotating the image
-        # so we store all the pixels in an array and then create the image when saving
-        self.pixels = []
+        self.y_bins = numpy.array([index for index, _ in y_to_bin], dtype=numpy.int64)
+        self.y_alphas = numpy.array([alpha for _, alpha in y_to_bin])
 
-    def draw_spectrum(self, x, spectrum):
-        # for all frequencies, draw the pixels
-        for (index, alpha) in self.y_to_bin:
-            self.pixels.append(self.palette[int((255.0 - alpha) * spectrum[index] + alpha * spectrum[index + 1])])
+        # pixels are stored as an array of (x, y) pixels and the image is created when saving
+        self.pixels = numpy.zeros((image_width, image_height, 3), dtype=numpy.uint8)
+        self.pixels[:] = self.palette[0]
+
+    def draw_spectrogram(self, db_spectra):
+        """ draw the spectra of all columns """
 
-        # if the FFT is too small to fill up the image, fill with black to the top
-        for y in range(len(self.y_to_bin), self.image_height):
-            self.pixels.append(self.palette[0])
+        # for all frequencies, draw the pixels
+        # if the FFT is too small to fill up the image, the pixels at the top keep the first color
+        colors = (255.0 - self.y_alphas) * db_spectra[:, self.y_bins] + self.y_alphas * db_spectra[:, self.y_bins + 1]
+        self.pixels[:, :len(self.y_bins)] = self.palette[colors.astype(numpy.int64)]
 
     def save(self, filename, quality=80):
-        self.image.putdata(self.pixels)
-        self.image.transpose(Image.ROTATE_90).save(filename, quality=quality)
+        # y grows upwards in the spectrogram
+        Image.fromarray(self.pixels.transpose(1, 0, 2)[::-1]).save(filename, quality=quality)
 
 
 def create_wave_images(input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size,
@@ -414,35 +454,47 @@ def create_wave_images(input_filename, output_filename_w, output_filename_s, ima
     :param image_width: width of both spectrogram and waveform images
     :param image_height: height of both spectrogram and waveform images
     :param fft_size: size of the FFT computed for the spectrogram image
-    :param progress_callback: function to iteratively call while images are being created. Will be called every 1%,
-                                with parameters (current_position, width)
+    :param progress_callback: function to call when images start and finish being created, with parameters
+                                (current_position, width)
     :param color_scheme: color scheme to use for the generated images (defaults to Freesound2 color scheme)
     """
-    processor = AudioProcessor(input_filename, fft_size, numpy.hanning)
-    samples_per_pixel = processor.nframes / float(image_width)
-
-    waveform = WaveformImage(image_width, image_height, color_scheme)
-    spectrogram = SpectrogramImage(image_width, image_height, fft_size, color_scheme)
+    if progress_callback:
+        progress_callback(0, image_width)
 
-    for x in range(image_width):
+    create_multiple_wave_images(input_filename,
+                                [(output_filename_w, output_filename_s, image_width, image_height, color_scheme)],
+                                fft_size)
 
-        if progress_callback and x % (image_width / 100) == 0:
-            progress_callback(x, image_width)
+    if progress_callback:
+        progress_callback(image_width, image_width)
 
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
 
-        (spectral_centroid, db_spectrum) = processor.spectral_centroid(seek_point)
-        peaks = processor.peaks(seek_point, next_seek_point)
+def create_multiple_wave_images(input_filename, images, fft_size):
+    """
+    Utility function for creating wavefile and spectrum images of several sizes and color schemes from an audio input
+    file. The audio file is only read once, and the peaks and spectra of the columns of images with the same width are
+    only computed once.
+    :param input_filename: input audio filename (must be PCM)
+    :param images: list of (output_filename_w, output_filename_s, image_width, image_height, color_scheme) tuples
+                    with the parameters of every pair of waveform and spectrogram images (see create_wave_images)
+    :param fft_size: size of the FFT computed for the spectrogram images
+    """
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning)
+    columns = dict()
 
-        waveform.draw_peaks(x, peaks, spectral_centroid)
-        spectrogram.draw_spectrum(x, db_spectrum)
+    for output_filename_w, output_filename_s, image_width, image_height, color_scheme in images:
+        if image_width not in columns:
+            seek_points = processor.seek_points(image_width)
+            columns[image_width] = processor.peaks(seek_points) + processor.spectral_centroids(seek_points[:-1])
+        first_peaks, second_peaks, spectral_centroids, db_spectra = columns[image_width]
 
-    if progress_callback:
-        progress_callback(image_width, image_width)
+        waveform = WaveformImage(image_width, image_height, color_scheme)
+        waveform.draw_waveform(first_peaks, second_peaks, spectral_centroids)
+        waveform.save(output_filename_w)
 
-    waveform.save(output_filename_w)
-    spectrogram.save(output_filename_s)
+        spectrogram = SpectrogramImage(image_width, image_height, fft_size, color_scheme)
+        spectrogram.draw_spectrogram(db_spectra)
+        spectrogram.save(output_filename_s)
 
 
 class NoSpaceLeftException(Exception):
@@ -476,7 +528,7 @@ def convert_to_pcm(input_filename, output_filename):
     else:
         return False
 
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     (stdout, stderr) = process.communicate()
 
     # If external process returned an error (return code != 0) or the expected PCM file does not
@@ -506,7 +558,7 @@ def stereofy_and_find_info(stereofy_executble_path, input_filename, output_filen
 
     cmd = [stereofy_executble_path, "--input", input_filename, "--output", output_filename]
 
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     (stdout, stderr) = process.communicate()
 
     if process.returncode != 0 or not os.path.exists(output_filename):
@@ -553,7 +605,7 @@ def convert_to_mp3(input_filename, output_filename, quality=70):
 
     command = ["lame", "--silent", "--abr", str(quality), input_filename, output_filename]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     (stdout, stderr) = process.communicate()
 
     if process.returncode != 0 or not os.path.exists(output_filename):
@@ -570,7 +622,7 @@ def convert_to_ogg(input_filename, output_filename, quality=1):
 
     command = ["oggenc", "-q", str(quality), input_filename, "-o", output_filename]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     (stdout, stderr) = process.communicate()
 
     if process.returncode != 0 or not os.path.exists(output_filename):
@@ -592,7 +644,7 @@ def convert_using_ffmpeg(input_filename, output_filename, mono_out=False):
         command += ['-ac', '1']
     command += [output_filename]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     (stdout, stderr) = process.communicate()
     if process.returncode != 0 or not os.path.exists(output_filename):
         raise AudioProcessingException("ffmpeg returned an error\nstdout: %s \nstderr: %s" % (stdout, stderr))
@@ -606,7 +658,7 @@ def analyze_using_essentia(essentia_executable_path, input_filename, output_file
     if essentia_profile_path is not None:
         exec_array += [essentia_profile_path]
 
-    p = subprocess.Popen(exec_array, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    p = subprocess.Popen(exec_array, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
     out, err = p.communicate()
     if p.returncode != 0:
         raise AudioProcessingException("essentia extractor returned an error\nstdout: %s \nstderr: %s" % (out, err))
@@ -0,0 +1,177 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+"""
+Store of processing and analysis outputs (previews, displays, analysis files and audio info fields) addressed by the
+md5 of the original file, so that sounds with the same contents (e.g. a sound deleted and uploaded again) reuse the
+outputs of the first one instead of computing them again.
+
+Files in the store are hard links of the files of the sounds (files are only copied if hard links are not supported),
+so the number of links of a stored file tells how many sound files use it. Removing the file of a sound never affects
+the files of other sounds, and stored files are only removed when no sound file links to them anymore.
+
+Deleting a sound does not remove its files, so the stored files of deleted sounds are kept and reused if the same
+file is uploaded again. As stored files are hard links, they only take extra disk space once the files of all the
+sounds linking to them are removed, and then they are removed by the clean_processing_artifacts management command.
+"""
+
+import errno
+import json
+import os
+import shutil
+
+from django.conf import settings
+
+from utils.filesystem import create_directories
+
+PREVIEW_LOCATION_KEYS = ['preview.LQ.mp3.path', 'preview.HQ.mp3.path', 'preview.LQ.ogg.path', 'preview.HQ.ogg.path']
+DISPLAY_LOCATION_KEYS = ['display.%s.%s.path' % (display_type, size)
+                         for display_type in ['wave', 'spectral', 'wave_bw', 'spectral_bw'] for size in ['M', 'L']]
+ANALYSIS_LOCATION_KEYS = ['analysis.statistics.path', 'analysis.frames.path']
+AUDIO_INFO_FILENAME = 'audio_info.json'
+
+
+def get_artifacts_directory(md5):
+    return os.path.join(settings.PROCESSING_ARTIFACTS_PATH, md5[:2], md5)
+
+
+def link_or_copy(source_path, destination_path):
+    """
+    Hard links source_path to destination_path (replacing destination_path if it exists). The file is copied instead
+    if both paths are in different devices or the filesystem does not support hard links.
+    """
+    tmp_path = destination_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source_path, tmp_path)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(source_path, tmp_path)
+    os.rename(tmp_path, destination_path)
+
+
+def store_artifacts(sound, location_keys, audio_info=None):
+    """
+    Adds the files of a sound at the given location keys (and optionally its audio info fields) to the store.
+    """
+    directory = get_artifacts_directory(sound.md5)
+    create_directories(directory)
+    for location_key in location_keys:
+        path = sound.locations(location_key)
+        if os.path.exists(path):
+            link_or_copy(path, os.path.join(directory, location_key))
+    if audio_info is not None:
+        tmp_path = os.path.join(directory, AUDIO_INFO_FILENAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(audio_info, f)
+        os.rename(tmp_path, os.path.join(directory, AUDIO_INFO_FILENAME))
+
+
+def has_artifacts(md5, location_keys):
+    directory = get_artifacts_directory(md5)
+    return all(os.path.exists(os.path.join(directory, location_key)) for location_key in location_keys)
+
+
+def restore_artifacts(sound, location_keys):
+    """
+    Links the stored files with the md5 of the sound to the locations of the sound. Files are only restored if all of
+    them are in the store.
+    :return: True if the files have been restored, False otherwise
+    """
+    if not has_artifacts(sound.md5, location_keys):
+        return False
+    directory = get_artifacts_directory(sound.md5)
+    for location_key in location_keys:
+        path = sound.locations(location_key)
+        create_directories(os.path.dirname(path))
+        link_or_copy(os.path.join(directory, location_key), path)
+    return True
+
+
+def unlink_shared_files(sound, location_keys):
+    """
+    Removes the files of a sound which are linked by the store or by other sounds, so that computing them again
+    creates new files instead of overwriting the contents shared with other sounds.
+    """
+    for location_key in location_keys:
+        path = sound.locations(location_key)
+        try:
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def load_audio_info(md5):
+    """
+    Returns the stored audio info fields (see Sound.set_audio_info_fields) for the given md5, or None if there are none.
+    """
+    try:
+        with open(os.path.join(get_artifacts_directory(md5), AUDIO_INFO_FILENAME)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def count_references(md5, location_key):
+    """
+    Returns the number of sound files which are links of a stored file (copies of stored files are not counted).
+    """
+    try:
+        return os.stat(os.path.join(get_artifacts_directory(md5), location_key)).st_nlink - 1
+    except OSError:
+        return 0
+
+
+def remove_unreferenced_artifacts(md5):
+    """
+    Removes the stored files with the given md5 which are not linked by any sound file. If no files are left, the
+    directory of the md5 (including the audio info fields) is removed.
+    """
+    directory = get_artifacts_directory(md5)
+    if not os.path.isdir(directory):
+        return
+    for location_key in PREVIEW_LOCATION_KEYS + DISPLAY_LOCATION_KEYS + ANALYSIS_LOCATION_KEYS:
+        path = os.path.join(directory, location_key)
+        if os.path.exists(path) and count_references(md5, location_key) == 0:
+            os.remove(path)
+    if os.listdir(directory) in ([], [AUDIO_INFO_FILENAME]):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def remove_all_unreferenced_artifacts():
+    """
+    Removes the stored files of all md5s which are not linked by any sound file (see remove_unreferenced_artifacts).
+    :return: number of md5s whose stored files have been completely removed
+    """
+    num_removed = 0
+    if not os.path.isdir(settings.PROCESSING_ARTIFACTS_PATH):
+        return num_removed
+    for prefix in os.listdir(settings.PROCESSING_ARTIFACTS_PATH):
+        prefix_directory = os.path.join(settings.PROCESSING_ARTIFACTS_PATH, prefix)
+        if not os.path.isdir(prefix_directory):
+            continue
+        for md5 in os.listdir(prefix_directory):
+            remove_unreferenced_artifacts(md5)
+            if not os.path.exists(get_artifacts_directory(md5)):
+                num_removed += 1
+    return num_removed
@@ -18,6 +18,8 @@
 #     See AUTHORS file.
 #
 
+import time
+
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 
@@ -29,3 +31,56 @@ def get_template_cache_key(fragment_name, *variables):
 def invalidate_template_cache(fragment_name, *variables):
     cache_key = get_template_cache_key(fragment_name, *variables)
     cache.delete(cache_key)
+
+
+def get_template_cache_version_key(namespace, object_id):
+    return 'template_cache_version_%s_%s' % (namespace, object_id)
+
+
+def new_template_cache_version():
+    # Versions start at the current time (in microseconds) so that, if a version is evicted from the cache, fragments
+    # cached with a previous version are not used again
+    return int(time.time() * 1000000)
+
+
+def get_template_cache_versions(namespace, object_ids):
+    """
+    Returns a dictionary with the template cache version of every object. The version of an object is included in the
+    keys of the cached template fragments of the object, so changing it invalidates all of them at once (see
+    bump_template_cache_version).
+    """
+    keys = dict((get_template_cache_version_key(namespace, object_id), object_id) for object_id in object_ids)
+    versions = cache.get_many(keys.keys())
+    missing_keys = [key for key in keys if key not in versions]
+    if missing_keys:
+        version = new_template_cache_version()
+        for key in missing_keys:
+            cache.add(key, version, None)
+        # Versions could have been set by another process in the meantime
+        versions.update(cache.get_many(missing_keys))
+    return dict((object_id, versions.get(key, 0)) for key, object_id in keys.items())
+
+
+def get_template_cache_version(namespace, object_id):
+    return get_template_cache_versions(namespace, [object_id])[object_id]
+
+
+def bump_template_cache_version(namespace, object_id):
+    """
+    Invalidates the cached template fragments of an object with a single atomic increment of its version.
+    """
+    try:
+        cache.incr(get_template_cache_version_key(namespace, object_id))
+    except ValueError:
+        # There is no version in the cache, a new one will be created the next time it is needed
+        pass
+
+
+def bump_template_cache_versions(namespace, object_ids):
+    """
+    Invalidates the cached template fragments of many objects at once. Versions are replaced with a single request
+    instead of being incremented one by one.
+    """
+    versions = cache.get_many([get_template_cache_version_key(namespace, object_id) for object_id in object_ids])
+    new_version = new_template_cache_version()
+    cache.set_many(dict((key, max(version + 1, new_version)) for key, version in versions.items()), None)
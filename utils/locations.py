@@ -18,6 +18,12 @@
 #     See AUTHORS file.
 #
 
+import collections
+import os
+
+from django.conf import settings
+
+
 def locations_decorator(cache=True):
     """wraps a locations function and adds two things:
         * caching for the calculation done inside the function if cache is true
@@ -44,9 +50,132 @@ def locations_decorator(cache=True):
         return wrapped
     return decorator
 
+class LocationTemplate(object):
+    """
+    Template of a location computed by a lazy locations function (see lazy_locations_decorator). The pattern is
+    formatted with the values returned by the locations function. If base_setting is given, the location is the
+    formatted pattern joined to the path in that setting (if is_path) or appended to the URL in that setting.
+    """
+
+    def __init__(self, pattern, base_setting=None, is_path=True):
+        self.pattern = pattern
+        self.base_setting = base_setting
+        self.is_path = is_path
+
+    def get_base(self):
+        return getattr(settings, self.base_setting) if self.base_setting is not None else None
+
+    def render(self, values, base=None):
+        location = self.pattern % values
+        if self.base_setting is None:
+            return location
+        return os.path.join(base, location) if self.is_path else base + location
+
+
+def path_location(base_setting, pattern):
+    return LocationTemplate(pattern, base_setting=base_setting, is_path=True)
+
+
+def url_location(base_setting, pattern):
+    return LocationTemplate(pattern, base_setting=base_setting, is_path=False)
+
+
+def flatten_location_templates(templates, prefix=""):
+    for key, value in templates.items():
+        if isinstance(value, dict):
+            for item in flatten_location_templates(value, prefix + key + "."):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+class LazyLocations(collections.Mapping):
+    """
+    Read-only dict of the locations of an instance returned by a lazy locations function (see
+    lazy_locations_decorator). Locations are only computed when they are accessed.
+    """
+
+    def __init__(self, instance, templates, prefix=""):
+        self.instance = instance
+        self.templates = templates
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        return self.instance.locations(self.prefix + key)
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __repr__(self):
+        return repr(dict((key, value) for key, value in self.items()))
+
+
+def get_locations_values(instance, values_function):
+    try:
+        return instance._locations_values
+    except AttributeError:
+        instance._locations_values = values_function(instance)
+        return instance._locations_values
+
+
+def lazy_locations_decorator(templates):
+    """wraps a function which returns the values used to compute the locations of an instance, given the nested dict
+    of LocationTemplate objects of all locations. Behaves like locations_decorator (with cache), but:
+        * locations("a.b.c") only computes the location at a.b.c, and every computed location is cached in the instance
+        * locations() (or locations("a")) returns a LazyLocations object instead of a dict, so locations accessed
+          through it are also computed only when needed (e.g. {{ sound.locations.preview.LQ.mp3.url }} in templates)
+        * the values returned by the wrapped function are computed once per instance
+    Locations of many instances can be computed at once with bulk_locations.
+    """
+    flat_templates = dict(flatten_location_templates(templates))
+
+    def decorator(values_function):
+        def wrapped(self, path=None):
+            if not path:
+                return LazyLocations(self, templates)
+            try:
+                return self._locations_cache[path]
+            except AttributeError:
+                self._locations_cache = dict()
+            except KeyError:
+                pass
+
+            template = flat_templates.get(path)
+            if template is None:
+                node = templates
+                for piece in path.split("."):
+                    node = node[piece]
+                return LazyLocations(self, node, prefix=path + ".")
+            location = template.render(get_locations_values(self, values_function), template.get_base())
+            self._locations_cache[path] = location
+            return location
+        wrapped.flat_templates = flat_templates
+        wrapped.values_function = values_function
+        return wrapped
+    return decorator
+
+
+def bulk_locations(instances, path):
+    """
+    Returns the location at the given path for every instance in a list of instances of the same class, whose locations
+    function is decorated with lazy_locations_decorator. The template and the setting of the location are only looked up
+    once for all instances, and locations are not cached in the instances.
+    """
+    if not instances:
+        return []
+    locations_function = type(instances[0]).locations
+    template = locations_function.flat_templates[path]
+    base = template.get_base()
+    return [template.render(get_locations_values(instance, locations_function.values_function), base)
+            for instance in instances]
+
+
 def pretty_print_locations(locations, indent=0):
     for (key, value) in locations.iteritems():
-        if isinstance(value, dict):
+        if isinstance(value, collections.Mapping):
             print "  "*indent, "*", key
             pretty_print_locations(value, indent+1)
         else:
@@ -0,0 +1,115 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import hashlib
+import math
+import time
+import urllib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from utils.search.solr import Multidict
+
+SEARCH_RESULTS_CACHE_GENERATION_KEY = 'search-results-generation'
+SEARCH_RESULTS_CACHE_BUMP_TIME_KEY = 'search-results-generation-bump-time'
+
+
+def get_search_results_cache_generation():
+    return cache.get(SEARCH_RESULTS_CACHE_GENERATION_KEY, 0)
+
+
+def bump_search_results_cache_generation():
+    """
+    Invalidate all cached search results. Instead of deleting cached results (which we can't list), the generation
+    number included in the cache keys is increased so that old entries are never read again and just expire.
+    This should be called whenever the contents of the Solr index change. Changes are only visible in search results
+    after Solr's next soft commit, so results cached right after a bump expire once changes are visible (see
+    get_search_results_cache_timeout).
+    """
+    cache.set(SEARCH_RESULTS_CACHE_BUMP_TIME_KEY, time.time(), None)
+    if not cache.add(SEARCH_RESULTS_CACHE_GENERATION_KEY, 1, None):
+        try:
+            cache.incr(SEARCH_RESULTS_CACHE_GENERATION_KEY)
+        except ValueError:
+            # Key expired or was evicted between add and incr, a new generation will be started on next bump
+            pass
+
+
+def get_search_results_cache_timeout():
+    """
+    Returns the number of seconds search results computed now can be cached. Results computed less than
+    settings.SEARCH_RESULTS_CACHE_VISIBILITY_DELAY seconds after the last change of the index might not include that
+    change yet (changes are made visible by Solr soft commits), so they are only cached until the change is visible.
+    """
+    last_bump_time = cache.get(SEARCH_RESULTS_CACHE_BUMP_TIME_KEY)
+    if last_bump_time is not None:
+        time_until_visible = last_bump_time + settings.SEARCH_RESULTS_CACHE_VISIBILITY_DELAY - time.time()
+        if time_until_visible > 0:
+            return int(math.ceil(time_until_visible))
+    return settings.SEARCH_RESULTS_CACHE_TIME
+
+
+def get_search_results_cache_key(query):
+    """
+    Returns the cache key for the results of a SolrQuery. Query parameters are sorted so that equivalent queries
+    built in a different order share the same key.
+    :param SolrQuery query: query object.
+    :return str: cache key.
+    """
+    query_hash = hashlib.md5(urllib.urlencode(sorted(Multidict(query.params).items()))).hexdigest()
+    return 'search-results-%i-%s' % (get_search_results_cache_generation(), query_hash)
+
+
+def get_cached_search_results(query, compute_results):
+    """
+    Returns the results for a SolrQuery from the cache or computes them (and stores them in the cache) if they are not
+    cached. To avoid many processes querying Solr at the same time for the same hot query when its results are not in
+    the cache, only one process computes the results while the others wait for them to be available in the cache.
+    :param SolrQuery query: query object.
+    :param function compute_results: function which performs the query to Solr and returns its results. Results must
+    be picklable.
+    :return: results as returned by compute_results.
+    """
+    cache_key = get_search_results_cache_key(query)
+    results = cache.get(cache_key)
+    if results is not None:
+        return results
+
+    lock_key = cache_key + '-lock'
+    if cache.add(lock_key, True, settings.SEARCH_RESULTS_CACHE_LOCK_TIMEOUT):
+        try:
+            results = compute_results()
+            cache.set(cache_key, results, get_search_results_cache_timeout())
+        finally:
+            cache.delete(lock_key)
+        return results
+
+    # Another process is computing the results for this query, wait for them to appear in the cache
+    wait_until = time.time() + settings.SEARCH_RESULTS_CACHE_LOCK_TIMEOUT
+    while time.time() < wait_until:
+        time.sleep(0.05)
+        results = cache.get(cache_key)
+        if results is not None:
+            return results
+        if cache.get(lock_key) is None:
+            # The other process finished without storing results (e.g. Solr error), don't wait any longer
+            break
+    return compute_results()
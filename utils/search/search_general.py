@@ -18,17 +18,25 @@
 #     See AUTHORS file.
 #
 
+import Queue
+import gearman
+import json
 import logging
 import math
+import os
 import random
 import socket
+import threading
+import time
 
 from django.conf import settings
+from django.db import connection, transaction
 
 import sounds
 from search.forms import SEARCH_SORT_OPTIONS_WEB
 from search.views import search_prepare_sort, search_prepare_query
-from utils.search.solr import Solr, SolrQuery, SolrResponseInterpreter, SolrException
+from utils.search.search_cache import bump_search_results_cache_generation
+from utils.search.solr import Solr, SolrQuery, SolrResponseInterpreter, SolrException, SolrJsonUpdateEncoder
 from utils.text import remove_control_chars
 
 search_logger = logging.getLogger("search")
@@ -66,12 +74,11 @@ def convert_to_solr_document(sound):
 
     document["comment"] = [remove_control_chars(comment_text) for comment_text in getattr(sound, "comments_array")]
     document["comments"] = getattr(sound, "num_comments")
-    locations = sound.locations()
-    document["waveform_path_m"] = locations["display"]["wave"]["M"]["path"]
-    document["waveform_path_l"] = locations["display"]["wave"]["L"]["path"]
-    document["spectral_path_m"] = locations["display"]["spectral"]["M"]["path"]
-    document["spectral_path_l"] = locations["display"]["spectral"]["L"]["path"]
-    document["preview_path"] = locations["preview"]["LQ"]["mp3"]["path"]
+    document["waveform_path_m"] = sound.locations("display.wave.M.path")
+    document["waveform_path_l"] = sound.locations("display.wave.L.path")
+    document["spectral_path_m"] = sound.locations("display.spectral.M.path")
+    document["spectral_path_l"] = sound.locations("display.spectral.L.path")
+    document["preview_path"] = sound.locations("preview.LQ.mp3.path")
 
     # Audio Commons analysis
     # NOTE: as the sound object here is the one returned by SoundManager.bulk_query_solr, it will have the Audio Commons
@@ -88,12 +95,110 @@ def convert_to_solr_document(sound):
     return document
 
 
-def add_sounds_to_solr(sounds):
-    solr = Solr(settings.SOLR_URL)
+def add_sounds_to_solr(sounds, delete_ids=None):
+    """
+    Add sounds to the Solr index.
+    :param sounds: iterable of Sound objects as returned by SoundManager.bulk_query_solr.
+    :param list delete_ids: ids of sounds to delete from the index before adding the new ones. The deletes are sent to
+    Solr in the same update request as the sounds being added.
+    """
+    solr = Solr(settings.SOLR_URL, encoder=SolrJsonUpdateEncoder())
     documents = [convert_to_solr_document(s) for s in sounds]
     console_logger.info("Adding %d sounds to solr index" % len(documents))
     search_logger.info("Adding %d sounds to solr index" % len(documents))
-    solr.add(documents)
+    if delete_ids:
+        solr.update(docs=documents, delete_ids=delete_ids)
+    else:
+        solr.add(documents)
+    bump_search_results_cache_generation()
+
+
+# Sound fields which are only counters and can be updated in the Solr index with atomic updates instead of re-sending
+# the whole document
+SOLR_COUNTER_FIELDS = ['num_downloads', 'avg_rating', 'num_ratings']
+
+
+def send_sound_index_event(sound_id, counter_fields=None):
+    """
+    Notify the Solr indexing worker (see gm_worker_solr_indexing management command) that a sound has changed so its
+    document in the index is updated. The event is sent once the current DB transaction is committed so that the worker
+    reads the updated data. If settings.SOLR_INDEX_EVENTS_ENABLED is False, this function does nothing and changes
+    only reach the index through the is_index_dirty flag (see post_dirty_sounds_to_solr management command).
+    :param int sound_id: ID of the sound that changed.
+    :param list counter_fields: if only counter fields of the sound changed, list with the names of these fields (see
+    SOLR_COUNTER_FIELDS). If None, the full Solr document of the sound will be rebuilt.
+    """
+    if not settings.SOLR_INDEX_EVENTS_ENABLED:
+        return
+
+    def submit_event():
+        try:
+            gm_client = gearman.GearmanClient(settings.GEARMAN_JOB_SERVERS)
+            gm_client.submit_job("sound_index_event", json.dumps({
+                'sound_id': sound_id,
+                'counter_fields': counter_fields,
+            }), wait_until_complete=False, background=True)
+        except (gearman.errors.GearmanError, socket.error) as e:
+            search_logger.error('could not send index event for sound with id %s (%s)' % (sound_id, e))
+
+    transaction.on_commit(submit_event)
+
+
+def update_sounds_in_solr(full_update_ids, counter_updates):
+    """
+    Update the Solr index for sounds that have changed. Sounds in full_update_ids are re-indexed (or deleted from the
+    index if they are not moderated and processed OK). For sounds in counter_updates, only the changed counter fields are
+    sent to Solr using atomic updates.
+    :param set full_update_ids: IDs of the sounds whose full document needs to be rebuilt.
+    :param dict counter_updates: dictionary with sound IDs as keys and the set of counter fields that changed as values.
+    Sounds that are also in full_update_ids are ignored.
+    :return tuple: number of sounds fully re-indexed, number of sounds updated with atomic updates and number of sounds
+    deleted from the index.
+    """
+    full_update_ids = set(full_update_ids)
+    counter_updates = {sid: fields for sid, fields in counter_updates.items() if sid not in full_update_ids}
+
+    counter_docs = []
+    if counter_updates:
+        for sound in sounds.models.Sound.objects.filter(
+                id__in=counter_updates.keys(), processing_state="OK", moderation_state="OK")\
+                .values('id', *SOLR_COUNTER_FIELDS):
+            document = {'id': sound['id']}
+            for field in counter_updates[sound['id']]:
+                document[field] = {'set': sound[field]}
+            counter_docs.append(document)
+        if counter_docs:
+            try:
+                Solr(settings.SOLR_URL, encoder=SolrJsonUpdateEncoder()).add(counter_docs)
+                # Counters are used for sorting and filtering results
+                bump_search_results_cache_generation()
+            except (SolrException, socket.error) as e:
+                # Atomic updates fail if the documents do not exist in the index, re-index the full documents instead
+                search_logger.info("atomic update of %i sounds failed, re-indexing them (%s)" % (len(counter_docs), e))
+                full_update_ids.update(doc['id'] for doc in counter_docs)
+                counter_docs = []
+
+    num_indexed = num_deleted = 0
+    if full_update_ids:
+        ids_to_index = list(sounds.models.Sound.objects.filter(
+            id__in=full_update_ids, processing_state="OK", moderation_state="OK").values_list('id', flat=True))
+        if ids_to_index:
+            _index_sounds_slice(ids_to_index, mark_index_clean=True, delete_if_existing=True)
+        ids_to_delete = list(full_update_ids.difference(ids_to_index))
+        if ids_to_delete:
+            delete_sounds_from_solr(ids_to_delete)
+        num_indexed, num_deleted = len(ids_to_index), len(ids_to_delete)
+
+    return num_indexed, len(counter_docs), num_deleted
+
+
+def _index_sounds_slice(sound_ids, mark_index_clean=False, delete_if_existing=False):
+    sounds_qs = sounds.models.Sound.objects.bulk_query_solr(sound_ids)
+    add_sounds_to_solr(sounds_qs, delete_ids=sound_ids if delete_if_existing else None)
+
+    if mark_index_clean:
+        console_logger.info("Marking sounds as clean.")
+        sounds.models.Sound.objects.filter(pk__in=sound_ids).update(is_index_dirty=False)
 
 
 def add_all_sounds_to_solr(sound_queryset, slice_size=1000, mark_index_clean=False, delete_if_existing=False):
@@ -114,14 +219,7 @@ def add_all_sounds_to_solr(sound_queryset, slice_size=1000, mark_index_clean=Fal
         console_logger.info("Adding sounds to solr, slice %i of %i", (i/slice_size) + 1, n_slices)
         try:
             sound_ids = all_sound_ids[i:i+slice_size]
-            sounds_qs = sounds.models.Sound.objects.bulk_query_solr(sound_ids)
-            if delete_if_existing:
-                delete_sounds_from_solr(sound_ids=sound_ids)
-            add_sounds_to_solr(sounds_qs)
-
-            if mark_index_clean:
-                console_logger.info("Marking sounds as clean.")
-                sounds.models.Sound.objects.filter(pk__in=sound_ids).update(is_index_dirty=False)
+            _index_sounds_slice(sound_ids, mark_index_clean=mark_index_clean, delete_if_existing=delete_if_existing)
             num_correctly_indexed_sounds += len(sound_ids)
         except SolrException as e:
             console_logger.error("failed to add sound batch to solr index, reason: %s", str(e))
@@ -130,24 +228,144 @@ def add_all_sounds_to_solr(sound_queryset, slice_size=1000, mark_index_clean=Fal
     return num_correctly_indexed_sounds
 
 
+def _read_reindex_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path) as f:
+            return json.load(f)['last_indexed_id']
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def _write_reindex_checkpoint(checkpoint_path, last_indexed_id):
+    # Write to a temporary file and rename it so that a crash never leaves a half-written checkpoint
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_indexed_id': last_indexed_id}, f)
+    os.rename(tmp_path, checkpoint_path)
+
+
+def add_all_sounds_to_solr_pipelined(sound_queryset, slice_size=1000, num_workers=4, mark_index_clean=False,
+                                     delete_if_existing=False, checkpoint_path=None):
+    """
+    Add all sounds from the sound_queryset to the Solr index overlapping DB queries, conversion to Solr documents and
+    requests to Solr. Sound ids are streamed from the DB (ordered by id) and split in slices which are handled by
+    `num_workers` worker threads. At most 2 * `num_workers` slices are queued at any time so memory usage is bounded
+    regardless of the number of sounds to index.
+    If `checkpoint_path` is given, the id of the last sound such that it and all sounds with lower ids have been
+    indexed is saved in that file after every slice. If the process is interrupted, calling this function again with
+    the same `checkpoint_path` resumes indexing after that sound. The file is removed when indexing finishes.
+    :param QuerySet sound_queryset: queryset of Sound objects.
+    :param int slice_size: sounds are indexed in chunks of this size.
+    :param int num_workers: number of slices to be indexed in parallel.
+    :param bool mark_index_clean: if True, set 'is_index_dirty=False' for the indexed sounds' objects.
+    :param bool delete_if_existing: if True, delete sounds from Solr index before (re-)indexing them (see
+    add_all_sounds_to_solr).
+    :param str checkpoint_path: path of the file used to store indexing progress (None to disable checkpoints).
+    :return int: number of correctly indexed sounds
+    """
+    if checkpoint_path is not None:
+        last_indexed_id = _read_reindex_checkpoint(checkpoint_path)
+        if last_indexed_id is not None:
+            console_logger.info("Resuming indexing after sound %i", last_indexed_id)
+            sound_queryset = sound_queryset.filter(id__gt=last_indexed_id)
+
+    slices_queue = Queue.Queue(maxsize=2 * num_workers)
+    lock = threading.Lock()
+    state = {
+        'num_indexed': 0,
+        'error': None,
+        'completed_slices': {},  # slice number -> last sound id of the slice, for slices done out of order
+        'next_slice_to_checkpoint': 0,
+    }
+    start_time = time.time()
+
+    def mark_slice_done(slice_number, sound_ids):
+        with lock:
+            state['num_indexed'] += len(sound_ids)
+            state['completed_slices'][slice_number] = sound_ids[-1]
+            # Only move the checkpoint forward when all previous slices are done as well
+            checkpoint_id = None
+            while state['next_slice_to_checkpoint'] in state['completed_slices']:
+                checkpoint_id = state['completed_slices'].pop(state['next_slice_to_checkpoint'])
+                state['next_slice_to_checkpoint'] += 1
+            if checkpoint_id is not None and checkpoint_path is not None:
+                _write_reindex_checkpoint(checkpoint_path, checkpoint_id)
+            elapsed = time.time() - start_time
+            console_logger.info("Added %i sounds to solr (%.1f docs/sec)",
+                                state['num_indexed'], state['num_indexed'] / elapsed if elapsed else 0)
+
+    def worker():
+        try:
+            while True:
+                item = slices_queue.get()
+                if item is None:
+                    break
+                if state['error'] is not None:
+                    # Keep consuming slices so that the producer does not block, but don't index them
+                    continue
+                slice_number, sound_ids = item
+                try:
+                    _index_sounds_slice(sound_ids, mark_index_clean=mark_index_clean,
+                                        delete_if_existing=delete_if_existing)
+                    mark_slice_done(slice_number, sound_ids)
+                except Exception as e:
+                    console_logger.error("failed to add sound batch to solr index, reason: %s", str(e))
+                    state['error'] = e
+        finally:
+            # Each thread uses its own DB connection, close it so it is not leaked
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(num_workers)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+
+    try:
+        # iterator() uses a server-side cursor so we never load all ids in memory
+        sound_ids = []
+        slice_number = 0
+        for sound_id in sound_queryset.order_by('id').values_list('id', flat=True).iterator():
+            sound_ids.append(sound_id)
+            if len(sound_ids) == slice_size:
+                slices_queue.put((slice_number, sound_ids))  # Blocks if workers are behind
+                slice_number += 1
+                sound_ids = []
+                if state['error'] is not None:
+                    break
+        if sound_ids and state['error'] is None:
+            slices_queue.put((slice_number, sound_ids))
+    finally:
+        for _ in workers:
+            slices_queue.put(None)
+        for t in workers:
+            t.join()
+
+    if state['error'] is not None:
+        raise state['error']
+
+    elapsed = time.time() - start_time
+    console_logger.info("Finished adding %i sounds to solr in %.1f seconds (%.1f docs/sec)",
+                        state['num_indexed'], elapsed, state['num_indexed'] / elapsed if elapsed else 0)
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return state['num_indexed']
+
+
+# Number of ids requested per page when getting all sound ids from the index
+SOLR_IDS_PAGE_SIZE = 10000
+
+
 def get_all_sound_ids_from_solr(limit=False):
     search_logger.info("getting all sound ids from solr.")
-    if not limit:
-        limit = 99999999999999
     solr = Solr(settings.SOLR_URL)
+    query = search_prepare_query('', '', None, 1, SOLR_IDS_PAGE_SIZE, include_facets=False)
     solr_ids = []
-    solr_count = None
-    PAGE_SIZE = 2000
-    current_page = 1
-    while (len(solr_ids) < solr_count or solr_count is None) and len(solr_ids) < limit:
-        response = SolrResponseInterpreter(
-            solr.select(unicode(search_prepare_query(
-                '', '', search_prepare_sort('created asc', SEARCH_SORT_OPTIONS_WEB), current_page, PAGE_SIZE,
-                include_facets=False))))
-        solr_ids += [element['id'] for element in response.docs]
-        solr_count = response.num_found
-        current_page += 1
-    return sorted(solr_ids)
+    # Ids are returned sorted and paged by id so that the last pages are as fast as the first ones
+    for sound_id in solr.iterate_ids(query, page_size=SOLR_IDS_PAGE_SIZE):
+        if limit and len(solr_ids) >= limit:
+            break
+        solr_ids.append(sound_id)
+    return solr_ids
 
 
 def check_if_sound_exists_in_solr(sound):
@@ -184,23 +402,21 @@ def delete_sound_from_solr(sound_id):
     search_logger.info("deleting sound with id %d" % sound_id)
     try:
         Solr(settings.SOLR_URL).delete_by_id(sound_id)
+        bump_search_results_cache_generation()
     except (SolrException, socket.error) as e:
         search_logger.error('could not delete sound with id %s (%s).' % (sound_id, e))
 
 
-def delete_sounds_from_solr(sound_ids):
-    solr_max_boolean_clause = 1000  # This number is specified in solrconfig.xml
-    for count, i in enumerate(range(0, len(sound_ids), solr_max_boolean_clause)):
-        range_ids = sound_ids[i:i+solr_max_boolean_clause]
+def delete_sounds_from_solr(sound_ids, chunk_size=10000):
+    n_chunks = int(math.ceil(float(len(sound_ids)) / chunk_size))
+    solr = Solr(settings.SOLR_URL, encoder=SolrJsonUpdateEncoder())
+    for count, i in enumerate(range(0, len(sound_ids), chunk_size)):
+        range_ids = sound_ids[i:i+chunk_size]
         try:
             search_logger.info(
                 "deleting %i sounds from solr [%i of %i, %i sounds]" %
-                (len(sound_ids),
-                 count + 1,
-                 int(math.ceil(float(len(sound_ids)) / solr_max_boolean_clause)),
-                 len(range_ids)))
-            sound_ids_query = ' OR '.join(['id:{0}'.format(sid) for sid in range_ids])
-            Solr(settings.SOLR_URL).delete_by_query(sound_ids_query)
+                (len(sound_ids), count + 1, n_chunks, len(range_ids)))
+            solr.delete_by_ids(range_ids)
+            bump_search_results_cache_generation()
         except (SolrException, socket.error) as e:
-            search_logger.error('could not delete solr sounds chunk %i of %i' %
-                                (count + 1, int(math.ceil(float(len(sound_ids)) / solr_max_boolean_clause))))
+            search_logger.error('could not delete solr sounds chunk %i of %i' % (count + 1, n_chunks))
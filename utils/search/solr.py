@@ -23,10 +23,14 @@
 from datetime import datetime, date
 from time import strptime
 from xml.etree import cElementTree as ET
-import itertools, re, urllib
+from cStringIO import StringIO
+import copy, itertools, math, re, urllib
 import httplib, urlparse
+import os, socket, threading, time
 import cjson
 from socket import error
+
+
 class Multidict(dict):
     """A dictionary that represents a query string. If values in the dics are tuples, they are expanded.
     None values are skipped and all values are utf-encoded. We need this because in solr, we can have multiple
@@ -269,6 +273,27 @@ class SolrQuery(object):
         self.params['f.%s.hl.simple.pre' % field] = pre
         self.params['f.%s.hl.simple.post' % field] = post
 
+    def set_id_seek_options(self, after_id=None, rows=None, id_field="id"):
+        """Set options for paging through all results in id order ("seek" paging): results are sorted by id and only
+        documents with an id greater than after_id are returned, so the next page is requested with the last id of the
+        current page. Unlike paging with start offsets, the cost of a page does not grow with its position in the
+        results. This is equivalent to cursorMark deep paging, which is not available in our version of Solr.
+        The filter for after_id is added to the existing filter queries, so use a copy of the query for every page.
+            after_id: id of the last document of the previous page (None for the first page)
+            rows: number of documents per page
+            id_field: name of the unique key field
+        """
+        self.params['sort'] = "%s asc" % id_field
+        self.params['start'] = 0
+        self.params['rows'] = rows
+        if after_id is not None:
+            filter_query = self.params.get('fq')
+            if not filter_query:
+                filter_query = []
+            elif not isinstance(filter_query, list):
+                filter_query = [filter_query]
+            self.params['fq'] = filter_query + ["%s:{%s TO *]" % (id_field, after_id)]
+
     def __unicode__(self):
         return urllib.urlencode(Multidict(self.params))
 
@@ -301,6 +326,8 @@ class BaseSolrAddEncoder(object):
     >>> encoder.encode([{"id": 5, "name": "guido", "tag":["python", "coder"], "status":"bdfl"}])
     '<add><doc><field name="status">bdfl</field><field name="tag">python</field><field name="tag">coder</field><field name="id">5</field><field name="name">guido</field></doc></add>'
     """
+    content_type = 'text/xml'
+
     def encode(self, docs):
         """Encodes a document as an XML tree. this particular one takes a dictionary and
         translates the key value pairs to <field name="key">value<f/field>
@@ -341,6 +368,82 @@ class BaseSolrAddEncoder(object):
 
         return ET.tostring(message, "utf-8")
 
+    def encode_delete_by_ids(self, ids):
+        """Encodes a delete command for all the given document ids
+
+        >>> BaseSolrAddEncoder().encode_delete_by_ids([1, 2])
+        '<delete><id>1</id><id>2</id></delete>'
+        """
+        message = ET.Element('delete')
+        for id in ids:
+            element = ET.Element('id')
+            element.text = unicode(id)
+            message.append(element)
+        return ET.tostring(message, "utf-8")
+
+
+class SolrJsonUpdateEncoder(object):
+    """Encodes documents as a Solr JSON update message. Compared to BaseSolrAddEncoder, it produces smaller payloads
+    which are faster to encode, and it can combine deletes and adds in a single update message (see encode_update()).
+
+    >>> encoder = SolrJsonUpdateEncoder()
+    >>> encoder.encode([{"id": 5, "tag":["python", "coder"], "is_bdfl": True}])
+    '[{"tag": ["python", "coder"], "is_bdfl": true, "id": 5}]'
+    """
+    content_type = 'application/json'
+
+    @staticmethod
+    def _is_valid_value(value):
+        # NaN and infinite floats are not valid JSON and would make Solr reject the whole update message
+        return not isinstance(value, float) or not (math.isnan(value) or math.isinf(value))
+
+    @staticmethod
+    def _convert_value(value):
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        elif isinstance(value, date):
+            return value.strftime('%Y-%m-%dT00:00:00.000Z')
+        elif isinstance(value, str):
+            return value.decode('utf-8')
+        elif isinstance(value, (list, tuple)):
+            return [SolrJsonUpdateEncoder._convert_value(v) for v in value if SolrJsonUpdateEncoder._is_valid_value(v)]
+        elif isinstance(value, dict):
+            # Atomic updates (e.g. {"set": 5}), setting a NaN or infinite value removes the value of the field
+            return dict((key, SolrJsonUpdateEncoder._convert_value(v) if SolrJsonUpdateEncoder._is_valid_value(v)
+                         else None) for key, v in value.items())
+        return value
+
+    def _convert_doc(self, doc):
+        # Fields with NaN or infinite values are left out
+        return dict((key, self._convert_value(value)) for key, value in doc.items() if self._is_valid_value(value))
+
+    def encode(self, docs):
+        """Encodes a list of documents (dictionaries) as a JSON array of documents
+        """
+        return cjson.encode([self._convert_doc(doc) for doc in docs])
+
+    def encode_delete_by_ids(self, ids):
+        """Encodes a delete command for all the given document ids
+
+        >>> SolrJsonUpdateEncoder().encode_delete_by_ids([1, 2])
+        '{"delete": ["1", "2"]}'
+        """
+        return cjson.encode({'delete': [unicode(id) for id in ids]})
+
+    def encode_update(self, docs=None, delete_ids=None):
+        """Encodes an update message which first deletes the documents with ids in delete_ids and then adds the
+        documents in docs. As Solr JSON update messages use repeated "add" keys (one per document), the message is
+        built by hand instead of serializing a single dictionary.
+
+        >>> SolrJsonUpdateEncoder().encode_update(docs=[{"id": 1}], delete_ids=[1])
+        '{"delete": ["1"], "add": {"doc": {"id": 1}}}'
+        """
+        commands = []
+        if delete_ids:
+            commands.append('"delete": %s' % cjson.encode([unicode(id) for id in delete_ids]))
+        for doc in docs or []:
+            commands.append('"add": {"doc": %s}' % cjson.encode(self._convert_doc(doc)))
+        return '{%s}' % ', '.join(commands)
 
 
 class SolrResponseDecoderException(Exception):
@@ -383,8 +486,136 @@ class SolrException(Exception):
     pass
 
 
+class SolrConnectionPool(object):
+    """A thread-safe pool of keep-alive HTTP connections to Solr servers.
+
+    Connections are kept per (host, port) pair and reused across requests, so that consecutive queries to the same
+    server do not need a new TCP handshake. Idle connections are closed after `idle_timeout` seconds, and at most
+    `max_connections_per_host` idle connections are kept for each server. If a reused connection turns out to be stale
+    (e.g. the server closed it while it was idle), the request is transparently retried once with a new connection.
+
+    >>> pool = SolrConnectionPool(max_connections_per_host=2, idle_timeout=10)
+    >>> sorted(pool.stats().items())
+    [('discarded', 0), ('evictions', 0), ('hits', 0), ('idle', 0), ('misses', 0), ('retries', 0)]
+    """
+    def __init__(self, max_connections_per_host=10, idle_timeout=30, timeout=None):
+        """Creates a SolrConnectionPool object
+        max_connections_per_host: maximum number of idle connections kept for every (host, port)
+        idle_timeout: number of seconds after which an idle connection is closed instead of being reused
+        timeout: socket timeout (in seconds) of the created connections, default: no timeout
+        """
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Must be called with self._lock held (or from __init__)
+        self._pid = os.getpid()
+        self._idle = {}  # (host, port) -> list of (connection, time when connection was released)
+        self._counters = {'hits': 0, 'misses': 0, 'retries': 0, 'evictions': 0, 'discarded': 0}
+
+    def _new_connection(self, host, port):
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _get(self, host, port):
+        """Returns a tuple (connection, reused) with an idle connection to host:port if there is one which has not
+        expired, or a new connection otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            if os.getpid() != self._pid:
+                # We are in a forked child process: sockets in the pool are shared with the parent, don't touch them
+                self._reset()
+            idle = self._idle.get((host, port), [])
+            while idle:
+                # Most recently released connections are at the end of the list (and are the least likely to be
+                # stale), so once we find an expired connection all the remaining ones are expired as well
+                conn, released = idle.pop()
+                if now - released < self.idle_timeout:
+                    self._counters['hits'] += 1
+                    return conn, True
+                conn.close()
+                self._counters['evictions'] += 1
+                for conn, _ in idle:
+                    conn.close()
+                    self._counters['evictions'] += 1
+                del idle[:]
+            self._counters['misses'] += 1
+        return self._new_connection(host, port), False
+
+    def _release(self, host, port, conn):
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset()
+            idle = self._idle.setdefault((host, port), [])
+            if len(idle) < self.max_connections_per_host:
+                idle.append((conn, time.time()))
+                return
+            self._counters['discarded'] += 1
+        conn.close()
+
+    def request(self, host, port, method, path, body=None, headers=None):
+        """Performs an HTTP request using a pooled connection and returns a tuple (status, reason, data) with the
+        response. The response body is fully read so that the connection can be returned to the pool.
+        """
+        headers = headers or {}
+        conn, reused = self._get(host, port)
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except socket.timeout:
+                raise
+            except (socket.error, httplib.BadStatusLine, httplib.CannotSendRequest):
+                conn.close()
+                if not reused:
+                    raise
+                # The idle connection was closed by the server, retry once with a fresh connection
+                with self._lock:
+                    self._counters['retries'] += 1
+                conn = self._new_connection(host, port)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            data = response.read()
+        except:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(host, port, conn)
+        return response.status, response.reason, data
+
+    def clear(self):
+        """Closes all idle connections of the pool
+        """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+                del idle[:]
+
+    def stats(self):
+        """Returns a dictionary with the pool counters: number of requests that reused an idle connection (hits),
+        that had to open a new one (misses), that were retried because of a stale connection (retries), number of
+        connections closed because of being idle for too long (evictions) or because the pool was full (discarded),
+        and number of connections currently idle in the pool (idle).
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['idle'] = sum(len(idle) for idle in self._idle.values())
+        return stats
+
+
+# Pool shared by all Solr instances of the process (unless a specific pool is passed to Solr)
+default_connection_pool = SolrConnectionPool()
+
+
 class Solr(object):
-    def __init__(self, url="http://localhost:8983/solr", verbose=False, persistent=False, encoder=BaseSolrAddEncoder(), decoder=SolrJsonResponseDecoder()):
+    def __init__(self, url="http://localhost:8983/solr", verbose=False, persistent=False, encoder=BaseSolrAddEncoder(), decoder=SolrJsonResponseDecoder(), pool=None):
         url_split = urlparse.urlparse(url)
 
         self.host = url_split.hostname
@@ -396,11 +627,12 @@ class Solr(object):
         self.verbose = verbose
 
         self.persistent = persistent
+        self.pool = pool if pool is not None else default_connection_pool
 
         if self.persistent:
             self.conn = httplib.HTTPConnection(self.host, self.port)
 
-    def _request(self, query_string="", message=""):
+    def _request(self, query_string="", message="", content_type='text/xml'):
         if query_string != "":
             path = '%s/select/?%s' % (self.path, query_string)
         else:
@@ -411,22 +643,23 @@ class Solr(object):
             print "\tPath:", path
             print "\tSending data:", message
 
-        if self.persistent:
-            conn = self.conn
-        else:
-            conn = httplib.HTTPConnection(self.host, self.port)
-
         if query_string:
-            conn.request('GET', path)
-        elif message:
-            conn.request('POST', path, message, {'Content-type': 'text/xml'})
+            method, body, headers = 'GET', None, {}
+        else:
+            method, body, headers = 'POST', message, {'Content-type': content_type}
 
-        response = conn.getresponse()
+        if self.persistent:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            status, reason, data = response.status, response.reason, response.read()
+        else:
+            status, reason, data = self.pool.request(self.host, self.port, method, path, body, headers)
 
-        if response.status != 200:
-            raise SolrException, response.reason
+        if status != 200:
+            raise SolrException, reason
 
-        return response
+        # The body has already been read so the connection can be reused, return a file-like object to the decoder
+        return StringIO(data)
 
     def select(self, query_string, raw=False):
         if raw:
@@ -434,10 +667,49 @@ class Solr(object):
         else:
             return self.decoder.decode(self._request(query_string=query_string))
 
+    def iterate_ids(self, query, page_size=10000, id_field="id"):
+        """Generator which yields the ids of all documents matching a SolrQuery in ascending order. Pages are requested
+        using SolrQuery.set_id_seek_options so that getting the ids of the whole index does not become slower as we
+        advance through the results. Sort, start and field list options of the query are ignored.
+        """
+        after_id = None
+        while True:
+            page_query = copy.deepcopy(query)
+            page_query.set_id_seek_options(after_id=after_id, rows=page_size, id_field=id_field)
+            page_query.params['fl'] = id_field
+            page_ids = [doc[id_field] for doc in SolrResponseInterpreter(self.select(unicode(page_query))).docs]
+            for page_id in page_ids:
+                yield page_id
+            if len(page_ids) < page_size:
+                return
+            after_id = page_ids[-1]
+
     def add(self, docs):
         encoded_docs = self.encoder.encode(docs)
         try:
-            self._request(message=encoded_docs)
+            self._request(message=encoded_docs, content_type=self.encoder.content_type)
+        except error as e:
+            raise SolrException(e)
+
+    def update(self, docs=None, delete_ids=None):
+        """Deletes the documents with ids in delete_ids and adds the documents in docs. If the encoder supports it
+        (e.g. SolrJsonUpdateEncoder), both operations are sent in a single update request.
+        """
+        if hasattr(self.encoder, 'encode_update'):
+            try:
+                self._request(message=self.encoder.encode_update(docs=docs, delete_ids=delete_ids),
+                              content_type=self.encoder.content_type)
+            except error as e:
+                raise SolrException(e)
+        else:
+            if delete_ids:
+                self.delete_by_ids(delete_ids)
+            if docs:
+                self.add(docs)
+
+    def delete_by_ids(self, ids):
+        try:
+            self._request(message=self.encoder.encode_delete_by_ids(ids), content_type=self.encoder.content_type)
         except error as e:
             raise SolrException(e)
 
@@ -18,6 +18,7 @@
 #     See AUTHORS file.
 #
 
+import copy
 import logging
 import traceback
 
@@ -126,32 +127,106 @@ def api_search(target=None, filter=None, preset=None, metric_descriptor_names=No
 
 
 def get_sounds_descriptors(sound_ids, descriptor_names, normalization=True, only_leaf_descriptors=False):
-    cache_key = "analysis-sound-id-%s-descriptors-%s-normalization-%s"
-
-    cached_data = {}
-    # Check if at least some sound analysis data is already on cache
-    not_cached_sound_ids = sound_ids[:]
-    for id in sound_ids:
-        analysis_data = cache.get(hash_cache_key(cache_key % (str(id), ",".join(sorted(descriptor_names)), str(normalization))))
-        if analysis_data:
-            cached_data[unicode(id)] = analysis_data
-            # remove id form list so it is not included in similarity request
-            not_cached_sound_ids.remove(id)
-    try:
-        returned_data = Similarity.get_sounds_descriptors(not_cached_sound_ids, descriptor_names, normalization, only_leaf_descriptors)
-    except Exception as e:
-        web_logger.error('Something wrong occurred with the "get sound descriptors" request (%s)\n\t%s' %\
-                         (e, traceback.format_exc()))
-        raise
-
-    # save sound analysis information in cache
-    for key, item in returned_data.items():
-        cache.set(hash_cache_key(cache_key % (key, ",".join(sorted(descriptor_names)), str(normalization))),
-                  item, SIMILARITY_CACHE_TIME)
-
-    returned_data.update(cached_data)
+    """
+    Returns the descriptor values of the given sounds as returned by the similarity service ({sound_id: values}).
+    Values are cached per sound and per requested descriptor so that requests for different sets of descriptors share
+    cache entries. All cache entries are read with a single get_many call and all the (sound, descriptor) pairs which
+    are not cached are requested to the similarity service with a single request.
+    """
+    # An empty list of descriptor names means all descriptors, which are cached as a single entry
+    descriptor_names = [name.strip('.') for name in descriptor_names] or ['']
+    cache_keys = dict()
+    for sound_id in sound_ids:
+        for name in descriptor_names:
+            cache_keys[hash_cache_key(get_sound_descriptor_cache_key(sound_id, name, normalization,
+                                                                     only_leaf_descriptors))] = (unicode(sound_id), name)
+    cached_items = cache.get_many(cache_keys.keys())
+
+    data = {}
+    missing_sound_ids = set()
+    missing_descriptor_names = set()
+    for key, (sound_id, name) in cache_keys.items():
+        if key in cached_items:
+            sound_data = data.setdefault(sound_id, {})
+            if 'value' in cached_items[key]:
+                merge_descriptor_values(sound_data, name, cached_items[key]['value'])
+        else:
+            missing_sound_ids.add(sound_id)
+            missing_descriptor_names.add(name)
 
-    return returned_data
+    if missing_sound_ids:
+        try:
+            returned_data = Similarity.get_sounds_descriptors(
+                [sound_id for sound_id in sound_ids if unicode(sound_id) in missing_sound_ids],
+                sorted(name for name in missing_descriptor_names if name), normalization, only_leaf_descriptors)
+        except Exception as e:
+            web_logger.error('Something wrong occurred with the "get sound descriptors" request (%s)\n\t%s' %
+                             (e, traceback.format_exc()))
+            raise
+
+        # Cache the values of all returned (sound, descriptor) pairs, including descriptors which are not present for
+        # a sound (as an entry without 'value') so that they are not requested again. Descriptors which contain other
+        # requested descriptors (e.g. 'lowlevel' and 'lowlevel.pitch') are not cached as the returned values depend
+        # on the combination of requested descriptors.
+        cacheable_names = [name for name in missing_descriptor_names
+                           if not any(other.startswith(name + '.') for other in missing_descriptor_names)]
+        items_to_cache = {}
+        for sound_id, values in returned_data.items():
+            sound_data = data.setdefault(unicode(sound_id), {})
+            for name in missing_descriptor_names:
+                item = {}
+                if has_descriptor_value(values, name):
+                    item['value'] = get_descriptor_value(values, name)
+                    merge_descriptor_values(sound_data, name, copy.deepcopy(item['value']))
+                if name not in cacheable_names:
+                    continue
+                items_to_cache[hash_cache_key(get_sound_descriptor_cache_key(
+                    sound_id, name, normalization, only_leaf_descriptors))] = item
+        cache.set_many(items_to_cache, SIMILARITY_CACHE_TIME)
+
+    return data
+
+
+def get_sound_descriptor_cache_key(sound_id, descriptor_name, normalization, only_leaf_descriptors):
+    return "analysis-sound-id-%s-descriptor-%s-normalization-%s-leaf-%s" % (
+        sound_id, descriptor_name, normalization, only_leaf_descriptors)
+
+
+def has_descriptor_value(values, descriptor_name):
+    for key in [key for key in descriptor_name.split('.') if key]:
+        if not isinstance(values, dict) or key not in values:
+            return False
+        values = values[key]
+    return True
+
+
+def get_descriptor_value(values, descriptor_name):
+    """
+    Returns the part of the nested descriptor values of a sound corresponding to a descriptor name (e.g.
+    'lowlevel.pitch'). An empty descriptor name returns all the values.
+    """
+    for key in [key for key in descriptor_name.split('.') if key]:
+        values = values[key]
+    return values
+
+
+def merge_descriptor_values(values, descriptor_name, value):
+    """
+    Sets the value of a descriptor name in the nested descriptor values of a sound, merging it with the values already
+    present (e.g. when both 'lowlevel.pitch.mean' and 'lowlevel.pitch' are requested).
+    """
+    keys = [key for key in descriptor_name.split('.') if key]
+    for key in keys[:-1]:
+        values = values.setdefault(key, {})
+    if not keys:
+        parent, key = {'': values}, ''
+    else:
+        parent, key = values, keys[-1]
+    if isinstance(value, dict) and isinstance(parent.get(key), dict):
+        for child_key, child_value in value.items():
+            merge_descriptor_values(parent[key], child_key, child_value)
+    else:
+        parent[key] = value
 
 
 def delete_sound_from_gaia(sound):
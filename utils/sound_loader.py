@@ -0,0 +1,97 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import sounds
+from utils.cache import get_template_cache_versions
+
+
+class SoundLoader(object):
+    """
+    Loads the sounds displayed while handling a request (e.g. by the display_sound templatetag) with as few queries
+    as possible. Views and templates register the IDs of the sounds they will display with add(), and all registered
+    sounds are loaded with a single Sound.objects.bulk_query_id query the first time one of them is needed. Loaded
+    sounds are kept in an identity map, so a sound is never loaded twice in the same request. Use get_sound_loader
+    to get the loader of a request.
+    """
+
+    def __init__(self):
+        self.sounds = {}  # {sound_id: Sound object retrieved with bulk_query_id, or None if the sound does not exist}
+        self.pending_ids = set()
+        self.template_cache_versions = {}
+
+    def add(self, sound_ids):
+        """Registers sounds to be loaded with the next query. Sounds which have already been loaded are ignored."""
+        self.pending_ids.update(int(sound_id) for sound_id in sound_ids if int(sound_id) not in self.sounds)
+
+    def add_sounds(self, sound_objs):
+        """Adds sounds already retrieved with Sound.objects.bulk_query_id (or bulk_query) to the identity map."""
+        for sound_obj in sound_objs:
+            if self.sounds.get(sound_obj.id) is None:
+                self.sounds[sound_obj.id] = sound_obj
+            self.pending_ids.discard(sound_obj.id)
+
+    def load(self):
+        """Loads all the registered sounds (and their template cache versions) which have not been loaded yet."""
+        if not self.pending_ids:
+            return
+        sound_ids = list(self.pending_ids)
+        self.pending_ids = set()
+        sound_objs = sounds.models.Sound.objects.dict_ids(sound_ids)
+        for sound_id in sound_ids:
+            self.sounds[sound_id] = sound_objs.get(sound_id)
+        self.template_cache_versions.update(get_template_cache_versions('sound', sound_objs.keys()))
+
+    def get(self, sound_id):
+        """Returns the sound with the given ID or None if it does not exist. All registered sounds are loaded too."""
+        sound_id = int(sound_id)
+        self.add([sound_id])
+        self.load()
+        return self.sounds[sound_id]
+
+    def dict_ids(self, sound_ids):
+        """Same as Sound.objects.dict_ids but using the sounds already loaded in the request."""
+        self.add(sound_ids)
+        self.load()
+        return {sound_obj.id: sound_obj for sound_obj in (self.sounds[int(sound_id)] for sound_id in sound_ids)
+                if sound_obj is not None}
+
+    def ordered_ids(self, sound_ids):
+        """Same as Sound.objects.ordered_ids but using the sounds already loaded in the request."""
+        sound_objs = self.dict_ids(sound_ids)
+        return [sound_objs[sound_id] for sound_id in sound_ids if sound_id in sound_objs]
+
+    def get_template_cache_version(self, sound_obj):
+        """
+        Returns the template cache version of a sound (see Sound.get_template_cache_version). The versions of all the
+        sounds in the identity map whose version is not known yet are retrieved at once.
+        """
+        if sound_obj.id not in self.template_cache_versions:
+            sound_ids = [sound_id for sound_id, loaded_sound_obj in self.sounds.items()
+                         if loaded_sound_obj is not None and sound_id not in self.template_cache_versions]
+            self.template_cache_versions.update(
+                get_template_cache_versions('sound', set(sound_ids) | {sound_obj.id}))
+        return self.template_cache_versions[sound_obj.id]
+
+
+def get_sound_loader(request):
+    """Returns the SoundLoader of the given request, creating it the first time it is needed."""
+    if not hasattr(request, 'sound_loader'):
+        request.sound_loader = SoundLoader()
+    return request.sound_loader
@@ -0,0 +1,50 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from utils.cache import get_template_cache_version, get_template_cache_versions, bump_template_cache_version, \
+    bump_template_cache_versions, get_template_cache_version_key
+
+
+class TemplateCacheVersionTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_template_cache_version(self):
+        version = get_template_cache_version('sound', 1)
+        self.assertEqual(get_template_cache_version('sound', 1), version)
+        bump_template_cache_version('sound', 1)
+        self.assertEqual(get_template_cache_version('sound', 1), version + 1)
+
+        # If the version is evicted from the cache, a new one different from the previous ones is used
+        cache.delete(get_template_cache_version_key('sound', 1))
+        bump_template_cache_version('sound', 1)
+        self.assertNotIn(get_template_cache_version('sound', 1), [version, version + 1])
+
+    def test_bump_template_cache_versions(self):
+        versions = get_template_cache_versions('sound', [1, 2, 3])
+        bump_template_cache_versions('sound', [1, 2])
+        new_versions = get_template_cache_versions('sound', [1, 2, 3])
+        self.assertGreater(new_versions[1], versions[1])
+        self.assertGreater(new_versions[2], versions[2])
+        self.assertEqual(new_versions[3], versions[3])
@@ -0,0 +1,71 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+from django.test import SimpleTestCase, override_settings
+
+from utils.locations import lazy_locations_decorator, path_location, url_location, bulk_locations, LocationTemplate
+
+
+class FakeObject(object):
+    num_values_calls = 0
+
+    def __init__(self, object_id):
+        self.id = object_id
+
+    @lazy_locations_decorator(dict(
+        path=path_location('SOUNDS_PATH', "%(id_folder)s/%(id)d.wav"),
+        preview=dict(
+            url=url_location('PREVIEWS_URL', "%(id_folder)s/%(id)d.mp3"),
+            filename=LocationTemplate("%(id)d.mp3"),
+        )
+    ))
+    def locations(self):
+        FakeObject.num_values_calls += 1
+        return dict(id_folder=str(self.id/1000), id=self.id)
+
+
+@override_settings(SOUNDS_PATH='/sounds', PREVIEWS_URL='/data/previews/')
+class LazyLocationsTest(SimpleTestCase):
+
+    def test_locations(self):
+        obj = FakeObject(1234)
+        self.assertEqual(obj.locations('path'), '/sounds/1/1234.wav')
+        self.assertEqual(obj.locations('preview.url'), '/data/previews/1/1234.mp3')
+        self.assertEqual(obj.locations('preview.filename'), '1234.mp3')
+
+        # Nested access returns the same locations
+        self.assertEqual(obj.locations()['preview']['url'], obj.locations('preview.url'))
+        self.assertEqual(obj.locations('preview')['filename'], obj.locations('preview.filename'))
+        self.assertEqual(dict(obj.locations('preview')),
+                         {'url': '/data/previews/1/1234.mp3', 'filename': '1234.mp3'})
+        self.assertRaises(KeyError, obj.locations, 'preview.path')
+
+    def test_values_computed_once(self):
+        FakeObject.num_values_calls = 0
+        obj = FakeObject(1)
+        obj.locations('path')
+        obj.locations('preview.url')
+        obj.locations()['preview']['filename']
+        self.assertEqual(FakeObject.num_values_calls, 1)
+
+    def test_bulk_locations(self):
+        objs = [FakeObject(object_id) for object_id in [1, 1000, 2500]]
+        self.assertEqual(bulk_locations(objs, 'preview.url'), [obj.locations('preview.url') for obj in objs])
+        self.assertEqual(bulk_locations([], 'preview.url'), [])
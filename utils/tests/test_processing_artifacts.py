@@ -0,0 +1,112 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from utils.audioprocessing import processing_artifacts
+
+
+class FakeSound(object):
+
+    def __init__(self, sound_id, md5, directory):
+        self.id = sound_id
+        self.md5 = md5
+        self.directory = directory
+
+    def locations(self, location_key):
+        return os.path.join(self.directory, str(self.id), location_key)
+
+
+class ProcessingArtifactsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PROCESSING_ARTIFACTS_PATH=os.path.join(self.tmp_directory, 'artifacts'))
+        self.settings_override.enable()
+        self.location_keys = processing_artifacts.PREVIEW_LOCATION_KEYS[:2]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmp_directory)
+
+    def create_sound_files(self, sound):
+        os.makedirs(os.path.dirname(sound.locations(self.location_keys[0])))
+        for location_key in self.location_keys:
+            with open(sound.locations(location_key), 'w') as f:
+                f.write(location_key)
+
+    def test_store_and_restore_artifacts(self):
+        sound = FakeSound(1, 'a' * 32, self.tmp_directory)
+        other_sound = FakeSound(2, 'a' * 32, self.tmp_directory)
+        self.assertFalse(processing_artifacts.restore_artifacts(other_sound, self.location_keys))
+
+        self.create_sound_files(sound)
+        processing_artifacts.store_artifacts(sound, self.location_keys, audio_info={'duration': 1.5})
+        self.assertEqual(processing_artifacts.load_audio_info(sound.md5), {'duration': 1.5})
+        self.assertEqual(processing_artifacts.count_references(sound.md5, self.location_keys[0]), 1)
+
+        self.assertTrue(processing_artifacts.restore_artifacts(other_sound, self.location_keys))
+        for location_key in self.location_keys:
+            with open(other_sound.locations(location_key)) as f:
+                self.assertEqual(f.read(), location_key)
+        self.assertEqual(processing_artifacts.count_references(sound.md5, self.location_keys[0]), 2)
+
+        # Computing the files of a sound again does not modify the files of the other sounds
+        processing_artifacts.unlink_shared_files(other_sound, self.location_keys)
+        self.assertFalse(os.path.exists(other_sound.locations(self.location_keys[0])))
+        self.assertTrue(os.path.exists(sound.locations(self.location_keys[0])))
+        self.assertEqual(processing_artifacts.count_references(sound.md5, self.location_keys[0]), 1)
+
+    def test_remove_unreferenced_artifacts(self):
+        sound = FakeSound(1, 'b' * 32, self.tmp_directory)
+        self.create_sound_files(sound)
+        processing_artifacts.store_artifacts(sound, self.location_keys, audio_info={'duration': 1.5})
+        directory = processing_artifacts.get_artifacts_directory(sound.md5)
+
+        # Files are kept while sound files link to them
+        processing_artifacts.remove_unreferenced_artifacts(sound.md5)
+        self.assertTrue(processing_artifacts.has_artifacts(sound.md5, self.location_keys))
+
+        os.remove(sound.locations(self.location_keys[0]))
+        processing_artifacts.remove_unreferenced_artifacts(sound.md5)
+        self.assertFalse(os.path.exists(os.path.join(directory, self.location_keys[0])))
+        self.assertTrue(os.path.exists(os.path.join(directory, self.location_keys[1])))
+
+        os.remove(sound.locations(self.location_keys[1]))
+        processing_artifacts.remove_unreferenced_artifacts(sound.md5)
+        self.assertFalse(os.path.exists(directory))
+
+    def test_remove_all_unreferenced_artifacts(self):
+        sound = FakeSound(1, 'c' * 32, self.tmp_directory)
+        other_sound = FakeSound(2, 'd' * 32, self.tmp_directory)
+        for fake_sound in [sound, other_sound]:
+            self.create_sound_files(fake_sound)
+            processing_artifacts.store_artifacts(fake_sound, self.location_keys)
+        for location_key in self.location_keys:
+            os.remove(sound.locations(location_key))
+
+        self.assertEqual(processing_artifacts.remove_all_unreferenced_artifacts(), 1)
+        self.assertFalse(os.path.exists(processing_artifacts.get_artifacts_directory(sound.md5)))
+        self.assertTrue(processing_artifacts.has_artifacts(other_sound.md5, self.location_keys))
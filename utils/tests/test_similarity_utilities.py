@@ -0,0 +1,83 @@
+#
+# Freesound is (c) MUSIC TECHNOLOGY GROUP, UNIVERSITAT POMPEU FABRA
+#
+# Freesound is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Freesound is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+#     See AUTHORS file.
+#
+
+import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from utils.similarity_utilities import get_sounds_descriptors
+
+
+def fake_sounds_descriptors(sound_ids, descriptor_names, normalization, only_leaf_descriptors):
+    data = {}
+    for sound_id in sound_ids:
+        values = {}
+        for name in descriptor_names:
+            section, descriptor = name.split('.')
+            values.setdefault(section, {})[descriptor] = {'mean': int(sound_id) * 10, 'var': 1.0}
+        data[unicode(sound_id)] = values
+    return data
+
+
+@mock.patch('utils.similarity_utilities.Similarity.get_sounds_descriptors', side_effect=fake_sounds_descriptors)
+class GetSoundsDescriptorsTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_sounds_descriptors_cached_per_sound_and_descriptor(self, get_sounds_descriptors_mock):
+        data = get_sounds_descriptors([1, 2], ['lowlevel.pitch'])
+        self.assertEqual(data['1'], {'lowlevel': {'pitch': {'mean': 10, 'var': 1.0}}})
+        self.assertEqual(get_sounds_descriptors_mock.call_count, 1)
+
+        # Everything is cached, the similarity service is not queried
+        self.assertEqual(get_sounds_descriptors([1, 2], ['lowlevel.pitch']), data)
+        self.assertEqual(get_sounds_descriptors_mock.call_count, 1)
+
+        # Sounds and descriptors with missing values are requested in a single request
+        data = get_sounds_descriptors([1, 2, 3], ['lowlevel.pitch', 'lowlevel.loudness'])
+        self.assertEqual(get_sounds_descriptors_mock.call_count, 2)
+        self.assertEqual(get_sounds_descriptors_mock.call_args[0][:2],
+                         ([1, 2, 3], ['lowlevel.loudness', 'lowlevel.pitch']))
+        self.assertEqual(data['1'], {'lowlevel': {'pitch': {'mean': 10, 'var': 1.0},
+                                                  'loudness': {'mean': 10, 'var': 1.0}}})
+        self.assertEqual(data['3']['lowlevel']['pitch']['mean'], 30)
+
+        get_sounds_descriptors([3], ['lowlevel.pitch', 'lowlevel.loudness'])
+        self.assertEqual(get_sounds_descriptors_mock.call_count, 2)
+
+        # Only missing descriptors are requested when all sounds miss the same ones
+        get_sounds_descriptors([1, 2], ['lowlevel.pitch', 'lowlevel.centroid'])
+        self.assertEqual(get_sounds_descriptors_mock.call_args[0][:2], ([1, 2], ['lowlevel.centroid']))
+
+    def test_get_sounds_descriptors_normalization_not_shared(self, get_sounds_descriptors_mock):
+        get_sounds_descriptors([1], ['lowlevel.pitch'], normalization=True)
+        get_sounds_descriptors([1], ['lowlevel.pitch'], normalization=False)
+        self.assertEqual(get_sounds_descriptors_mock.call_count, 2)
+
+    def test_get_sounds_descriptors_missing_sounds(self, get_sounds_descriptors_mock):
+        get_sounds_descriptors_mock.side_effect = lambda sound_ids, *args: \
+            fake_sounds_descriptors([sound_id for sound_id in sound_ids if sound_id != 2], *args)
+        data = get_sounds_descriptors([1, 2], ['lowlevel.pitch'])
+        self.assertEqual(data.keys(), ['1'])
+
+        # Sounds not returned by the similarity service are not cached
+        get_sounds_descriptors([1, 2], ['lowlevel.pitch'])
+        self.assertEqual(get_sounds_descriptors_mock.call_args[0][0], [2])
@@ -508,13 +508,12 @@ def convert_to_ogg_mock_fail(input_filename, output_filename, quality):
     raise AudioProcessingException("conversion to ogg (preview) has failed")
 
 
-def create_wave_images_mock(
-        input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size, **kwargs):
-    create_test_files(paths=[output_filename_w, output_filename_s])
+def create_multiple_wave_images_mock(input_filename, images, fft_size):
+    for output_filename_w, output_filename_s, image_width, image_height, color_scheme in images:
+        create_test_files(paths=[output_filename_w, output_filename_s])
 
 
-def create_wave_images_mock_fail(
-        input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size, **kwargs):
+def create_multiple_wave_images_mock_fail(input_filename, images, fft_size):
     raise AudioProcessingException("creation of display images has failed")
 
 
@@ -547,6 +546,25 @@ class AudioProcessingTestCase(TestCase):
         exc = cm.exception
         self.assertIn('did not find Sound object', exc.message)
 
+    @override_settings(PROCESSING_MAX_PARALLEL_PREVIEW_ENCODES=2)
+    @mock.patch('utils.audioprocessing.processing.os.path.exists', return_value=True)
+    @mock.patch('utils.audioprocessing.processing.subprocess.Popen')
+    def test_encode_previews(self, popen, _):
+        popen.return_value.communicate.return_value = ('', '')
+        popen.return_value.returncode = 0
+        results = FreesoundAudioProcessor(sound_id=self.sound.id).encode_previews(
+            'in.wav', [('mp3', 'out.mp3', 70), ('ogg', 'out.ogg', 1), ('mp3', 'out_hq.mp3', 192)])
+        self.assertEqual([error for _, error in results], [None, None, None])
+        self.assertEqual(sorted(call[0][0][0] for call in popen.call_args_list), ['lame', 'lame', 'oggenc'])
+        # Encoders run concurrently, so they must not inherit the pipes of each other (otherwise every encoder waits
+        # for the slowest one to finish)
+        self.assertTrue(all(call[1]['close_fds'] for call in popen.call_args_list))
+
+        # Errors are returned in the same order as the previews
+        popen.return_value.returncode = 1
+        results = FreesoundAudioProcessor(sound_id=self.sound.id).encode_previews('in.wav', [('ogg', 'out.ogg', 1)])
+        self.assertIsInstance(results[0][1], AudioProcessingException)
+
     @override_settings(USE_PREVIEWS_WHEN_ORIGINAL_FILES_MISSING=False)
     @override_processing_tmp_path_with_temp_directory
     def test_sound_path_does_not_exist(self):
@@ -661,7 +679,8 @@ class AudioProcessingTestCase(TestCase):
         self.assertIn('conversion to ogg (preview) has failed', self.sound.processing_log)
         self.assertFalse(len(os.listdir(settings.PROCESSING_TEMP_DIR)), 0)
 
-    @mock.patch('utils.audioprocessing.processing.create_wave_images', side_effect=create_wave_images_mock_fail)
+    @mock.patch('utils.audioprocessing.processing.create_multiple_wave_images',
+                side_effect=create_multiple_wave_images_mock_fail)
     @mock.patch('utils.audioprocessing.processing.convert_to_ogg', side_effect=convert_to_ogg_mock)
     @mock.patch('utils.audioprocessing.processing.convert_to_mp3', side_effect=convert_to_mp3_mock)
     @mock.patch('utils.audioprocessing.processing.stereofy_and_find_info', side_effect=stereofy_mock)
@@ -674,7 +693,7 @@ class AudioProcessingTestCase(TestCase):
     def test_create_images_fails(self, *args):
         self.pre_test()
         result = FreesoundAudioProcessor(sound_id=Sound.objects.first().id).process()
-        # processing will fail because create_wave_images mock raises an exception
+        # processing will fail because create_multiple_wave_images mock raises an exception
         self.assertFalse(result)  # Processing failed, retutned False
         self.sound.refresh_from_db()
         self.assertEqual(self.sound.processing_state, "FA")
@@ -682,7 +701,8 @@ class AudioProcessingTestCase(TestCase):
         self.assertIn('creation of display images has failed', self.sound.processing_log)
         self.assertFalse(len(os.listdir(settings.PROCESSING_TEMP_DIR)), 0)
 
-    @mock.patch('utils.audioprocessing.processing.create_wave_images', side_effect=create_wave_images_mock)
+    @mock.patch('utils.audioprocessing.processing.create_multiple_wave_images',
+                side_effect=create_multiple_wave_images_mock)
     @mock.patch('utils.audioprocessing.processing.convert_to_ogg', side_effect=convert_to_ogg_mock)
     @mock.patch('utils.audioprocessing.processing.convert_to_mp3', side_effect=convert_to_mp3_mock)
     @mock.patch('utils.audioprocessing.processing.stereofy_and_find_info', side_effect=stereofy_mock)
@@ -716,7 +736,8 @@ class AudioProcessingTestCase(TestCase):
         self.assertEqual(self.sound.processing_ongoing_state, "FI")
         self.assertFalse(len(os.listdir(settings.PROCESSING_TEMP_DIR)), 0)
 
-    @mock.patch('utils.audioprocessing.processing.create_wave_images', side_effect=create_wave_images_mock)
+    @mock.patch('utils.audioprocessing.processing.create_multiple_wave_images',
+                side_effect=create_multiple_wave_images_mock)
     @mock.patch('utils.audioprocessing.processing.convert_to_ogg', side_effect=convert_to_ogg_mock)
     @mock.patch('utils.audioprocessing.processing.convert_to_mp3', side_effect=convert_to_mp3_mock)
     @mock.patch('utils.audioprocessing.processing.stereofy_and_find_info', side_effect=stereofy_mock)